@@ -0,0 +1,336 @@
+#Client for the Raspberry Pi SCPI server (SCPI_Server/pi_server.py)
+
+import asyncio
+import queue
+import socket
+import struct
+
+def is_query(line):
+    ''' the server answers every line that contains a query with exactly one reply line '''
+    return '?' in line
+
+def _block_end(data, pos):
+    '''
+        return the index after the next definite length block starting at or after pos,
+        or None if there is no such block. blocks start a reply or follow a semicolon.
+    '''
+    idx = data.find(b'#', pos)
+    while idx != -1:
+        if (idx == 0) or (data[idx-1:idx] == b';'):
+            digits = int(data[idx+1:idx+2])
+            return idx+2+digits+int(data[idx+2:idx+2+digits])
+        idx = data.find(b'#', idx+1)
+    return None
+
+def _split_reply(data):
+    # binary blocks are sent byte by byte, latin-1 maps them to characters one to one
+    return data.rstrip(b'\r\n').decode('latin-1')
+
+class PiConnection(object):
+    '''
+        a persistent connection to a Pi server
+    '''
+    def __init__(self, host, port, timeout):
+        self._sock = socket.create_connection((host, port), timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile('rb')
+
+    def close(self):
+        try:
+            self._reader.close()
+        finally:
+            self._sock.close()
+
+    def send(self, lines):
+        ''' send several lines with a single write '''
+        self._sock.sendall(''.join(line+'\n' for line in lines).encode())
+
+    def read_reply(self):
+        ''' read one reply line, including definite length blocks containing line feeds '''
+        data = self._reader.readline()
+        pos = 0
+        while True:
+            if not data.endswith(b'\n'):
+                raise ConnectionError('connection closed by the server.')
+            end = _block_end(data, pos)
+            if end is None:
+                return _split_reply(data)
+            while len(data) <= end:
+                more = self._reader.readline()
+                if not more:
+                    raise ConnectionError('connection closed by the server.')
+                data += more
+            pos = end
+
+class PiClient(object):
+    '''
+        client for the Raspberry Pi SCPI server
+
+        keeps a pool of persistent connections that may be shared by several threads.
+        requests are pipelined: all lines of a request are sent at once and the
+        replies to the lines containing queries are read back in order afterwards.
+        broken connections are re-opened automatically.
+    '''
+    def __init__(self, host, port = 4000, pool_size = 2, timeout = 5., retries = 1):
+        '''
+            Input:
+                host, port - address of the server
+                pool_size (int) - maximum number of idle connections kept open
+                timeout (float) - socket timeout in seconds
+                retries (int) - number of times a request is repeated on a new
+                    connection if the connection fails
+        '''
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self._pool = queue.LifoQueue(pool_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        ''' close all idle connections '''
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return PiConnection(self.host, self.port, self.timeout)
+
+    def _release(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def pipeline(self, lines):
+        '''
+            send several command lines at once and collect the replies
+
+            Output:
+                list with the reply string of every line containing a query and None
+                for all other lines
+        '''
+        attempt = 0
+        while True:
+            connection = None
+            sent = False
+            try:
+                connection = self._acquire()
+                connection.send(lines)
+                sent = True
+                replies = [connection.read_reply() if is_query(line) else None for line in lines]
+            except (OSError, ValueError) as err:
+                if connection is not None:
+                    connection.close()
+                # commands are only repeated if they can not have been executed before
+                attempt += 1
+                if (attempt > self.retries) or (sent and not all(is_query(line) for line in lines)):
+                    raise ConnectionError('request to %s:%d failed: %s'%(self.host, self.port, err))
+                continue
+            self._release(connection)
+            return replies
+
+    def write(self, line):
+        ''' send a command line that does not return a result '''
+        self.pipeline([line])
+
+    def query(self, line):
+        ''' send a command line and return its reply '''
+        return self.pipeline([line])[0]
+
+    def set_pins(self, values):
+        '''
+            set several output pins with a single command line
+
+            Input:
+                values (dict) - maps BCM pin numbers to 0/1
+        '''
+        self.write(_set_pins_line(values))
+
+    def read_pins(self, pins):
+        '''
+            read several input pins with a single command line
+
+            Output:
+                list of int, one value per entry of pins
+        '''
+        return _parse_pins(self.query(_read_pins_line(pins)), pins)
+
+class AsyncPiClient(object):
+    '''
+        asyncio client for the Raspberry Pi SCPI server
+
+        offers the same requests as PiClient. connections are pooled and each
+        request pipelines its lines over one connection.
+    '''
+    def __init__(self, host, port = 4000, pool_size = 2, timeout = 5., retries = 1):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self._pool_size = pool_size
+        self._pool = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        ''' close all idle connections '''
+        while self._pool:
+            _, writer = self._pool.pop()
+            writer.close()
+            await writer.wait_closed()
+
+    async def _acquire(self):
+        if self._pool:
+            return self._pool.pop()
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+    def _release(self, connection):
+        if len(self._pool) < self._pool_size:
+            self._pool.append(connection)
+        else:
+            connection[1].close()
+
+    async def _read_reply(self, reader):
+        data = await reader.readline()
+        pos = 0
+        while True:
+            if not data.endswith(b'\n'):
+                raise ConnectionError('connection closed by the server.')
+            end = _block_end(data, pos)
+            if end is None:
+                return _split_reply(data)
+            while len(data) <= end:
+                more = await reader.readline()
+                if not more:
+                    raise ConnectionError('connection closed by the server.')
+                data += more
+            pos = end
+
+    async def pipeline(self, lines):
+        ''' see PiClient.pipeline '''
+        attempt = 0
+        while True:
+            connection = None
+            sent = False
+            try:
+                connection = await self._acquire()
+                reader, writer = connection
+                writer.write(''.join(line+'\n' for line in lines).encode())
+                await asyncio.wait_for(writer.drain(), self.timeout)
+                sent = True
+                replies = []
+                for line in lines:
+                    replies.append(await asyncio.wait_for(self._read_reply(reader), self.timeout) if is_query(line) else None)
+            except (OSError, ValueError, asyncio.TimeoutError) as err:
+                if connection is not None:
+                    connection[1].close()
+                attempt += 1
+                if (attempt > self.retries) or (sent and not all(is_query(line) for line in lines)):
+                    raise ConnectionError('request to %s:%d failed: %s'%(self.host, self.port, err))
+                continue
+            self._release(connection)
+            return replies
+
+    async def write(self, line):
+        await self.pipeline([line])
+
+    async def query(self, line):
+        return (await self.pipeline([line]))[0]
+
+    async def set_pins(self, values):
+        await self.write(_set_pins_line(values))
+
+    async def read_pins(self, pins):
+        return _parse_pins(await self.query(_read_pins_line(pins)), pins)
+
+def _set_pins_line(values):
+    return 'GPIO:SOURce:DIGital:' + ';'.join('DATA%d %d'%(pin, int(bool(value))) for pin, value in values.items())
+
+def _read_pins_line(pins):
+    return 'GPIO:MEASure:DIGital:' + ';'.join('DATA%d?'%pin for pin in pins)
+
+def _parse_pins(reply, pins):
+    values = reply.split(';') if reply else []
+    if len(values) != len(pins):
+        raise ValueError('unable to read pins %s, the server reported an error.'%list(pins))
+    return [int(value) for value in values]
+
+# layout of the run-length encoded buffers of SCPI_Server/gpio_codec.py
+RLE_HEADER = struct.Struct('<4sd')
+RLE_MAGIC = b'GPRL'
+# header of the frames sent by GPIO:STReam, see SCPI_Server/sampler.py
+FRAME_HEADER = struct.Struct('<4sBBHQdQ')
+FRAME_MAGIC = b'GPST'
+
+def block_unpack(reply):
+    ''' return the payload of a definite length block reply as bytes '''
+    data = reply.encode('latin-1') if isinstance(reply, str) else reply
+    if data[:1] != b'#':
+        raise ValueError('reply is not a definite length block.')
+    digits = int(data[1:2])
+    length = int(data[2:2+digits])
+    return data[2+digits:2+digits+length]
+
+def _varints(data, pos):
+    ''' generator of the unsigned LEB128 varints in data starting at pos '''
+    value = shift = 0
+    for byte in data[pos:]:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+def decode_transitions(data):
+    '''
+        decode a buffer encoded by gpio_codec.encode_transitions
+
+        Output:
+            first (int) - index of the first sample
+            period (float) - time between samples in seconds
+            samples (list of int) - bank states as bit masks
+    '''
+    magic, period = RLE_HEADER.unpack_from(data)
+    if magic != RLE_MAGIC:
+        raise ValueError('data is not a run-length encoded GPIO buffer.')
+    values = _varints(data, RLE_HEADER.size)
+    first, count, state = next(values), next(values), next(values)
+    samples = []
+    for delta, toggled in zip(values, values):
+        samples.extend([state]*delta)
+        state ^= toggled
+    samples.extend([state]*(count-len(samples)))
+    return first, period, samples
+
+def decode_stream_frame(data):
+    '''
+        decode a frame published by GPIO:STReam
+
+        Output:
+            dict with the keys first, period, decimation, mask and samples
+    '''
+    magic, fmt, _, decimation, first, period, mask = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise ValueError('data is not a GPIO stream frame.')
+    payload = data[FRAME_HEADER.size:]
+    if fmt:
+        _, _, samples = decode_transitions(payload)
+    else:
+        samples = list(struct.unpack('<%dI'%(len(payload)//4), payload))
+    return {'first': first, 'period': period, 'decimation': decimation, 'mask': mask, 'samples': samples}
@@ -1,7 +1,16 @@
-import RPi.GPIO as GPIO
+import array
+import os
+import struct
+import tempfile
 import time
 import sys
 
+# compiled tunes are cached next to the csv as <csv>.bin
+# layout: magic, mtime and size of the csv it was compiled from, followed by
+# (frequency, duration) pairs of doubles
+TUNE_HEADER = struct.Struct('<4sqq')
+TUNE_MAGIC = b'TUNE'
+
 def parse_pwm_file(csv_file):
     final_pwm_list = []
     with open(csv_file) as my_file:
@@ -9,26 +18,90 @@ def parse_pwm_file(csv_file):
             final_pwm_list.append([float(x) for x in line.split(',')])
     return final_pwm_list
 
+def compile_tune(csv_file):
+    '''
+        parse a tune csv and cache it as a binary array of (freq, duration) pairs
+
+        the cache is only a speed-up, a tune is still played if it can not be written.
+    '''
+    tune = array.array('d', [value for row in parse_pwm_file(csv_file) for value in row[:2]])
+    stat = os.stat(csv_file)
+    header = TUNE_HEADER.pack(TUNE_MAGIC, stat.st_mtime_ns, stat.st_size)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(csv_file)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header + tune.tobytes())
+            os.replace(tmp_path, csv_file + '.bin')
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except OSError:
+        pass
+    return tune
+
+def load_tune(csv_file):
+    '''
+        return the tune as a flat array of (freq, duration) pairs, using the
+        compiled cache if it is up to date
+    '''
+    stat = os.stat(csv_file)
+    try:
+        with open(csv_file + '.bin', 'rb') as f:
+            data = f.read()
+        magic, mtime, size = TUNE_HEADER.unpack_from(data)
+        if (magic == TUNE_MAGIC) and (mtime == stat.st_mtime_ns) and (size == stat.st_size):
+            tune = array.array('d')
+            tune.frombytes(data[TUNE_HEADER.size:])
+            return tune
+    except (OSError, struct.error, ValueError):
+        pass
+    return compile_tune(csv_file)
+
+def play(pwm, tune):
+    '''
+        play a tune on a started PWM channel
+
+        notes are scheduled at absolute deadlines so the sleep overshoot does not
+        accumulate over long tunes. the duty cycle is only changed between notes
+        and rests and the frequency only when it changes.
+    '''
+    duty = None
+    freq = None
+    deadline = time.perf_counter()
+    for idx in range(0, len(tune)-1, 2):
+        cur_freq, cur_dur = tune[idx], tune[idx+1]
+        if cur_freq == 0:
+            # rest, the frequency is irrelevant while the output is off
+            if duty != 0:
+                pwm.ChangeDutyCycle(0)
+                duty = 0
+        else:
+            if cur_freq != freq:
+                pwm.ChangeFrequency(cur_freq)
+                freq = cur_freq
+            if duty != 50:
+                pwm.ChangeDutyCycle(50)
+                duty = 50
+        deadline += cur_dur
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
 def main(port_num, pwm_file):
+    # only the player needs the GPIO library, tunes can be compiled anywhere
+    import RPi.GPIO as GPIO
     #port_num is usually 13
     leGPIOpwm = port_num
 
-    final_pwm_list = parse_pwm_file(pwm_file)
+    tune = load_tune(pwm_file)
 
     GPIO.setmode(GPIO.BCM)
     GPIO.setup(leGPIOpwm, GPIO.OUT)
     pwm = GPIO.PWM(leGPIOpwm, 1000)
     pwm.start(0)
 
-    pwm.ChangeDutyCycle(50)
-    for cur_freq, cur_dur in final_pwm_list:
-        if cur_freq == 0:
-            cur_freq = 10000
-            pwm.ChangeDutyCycle(0)
-        else:
-            pwm.ChangeDutyCycle(50)
-        pwm.ChangeFrequency(cur_freq)
-        time.sleep(cur_dur)
+    play(pwm, tune)
 
 if __name__ == "__main__":
     main(int(sys.argv[1]), sys.argv[2])
@@ -0,0 +1,213 @@
+#Fair scheduling of the command lines of all clients of the server
+
+import collections
+import contextlib
+import threading
+import time
+
+from scpi_base import SCPIBase
+from tracing import tracer
+
+# executor of the worker thread, see blocking
+_worker = threading.local()
+
+def blocking():
+    '''
+        return a context manager for handlers that wait for a long time, e.g. pulses
+
+        the worker running the handler leaves the pool until the context is left
+        and a new worker takes its place, so a long wait does not hold up the
+        lines of other connections. does nothing outside of a CommandExecutor.
+    '''
+    executor = getattr(_worker, 'executor', None)
+    if executor is None:
+        return contextlib.nullcontext()
+    return executor._blocking()
+
+class CommandExecutor(object):
+    '''
+        executes the command lines of all connections on a small pool of threads
+
+        every connection has its own queue. the next line is taken from the queue
+        with the smallest virtual time (stride scheduling): executing a line
+        advances the virtual time of its connection by 1/weight, so under load a
+        HIGH connection gets 4x the share of a NORMal one and 16x that of a LOW
+        one, and a flooding client can not starve the others. CRITical lines
+        bypass the fair share and are taken first, so they only wait for the
+        lines already being executed. handlers that wait, such as pulses, leave
+        the pool while they wait (see blocking), so they do not count as executed.
+
+        the priority is read from the session (SYSTem:COMMunicate:PRIority) when
+        a line is submitted.
+    '''
+    WEIGHTS = {SCPIBase.PRIORITY_LOW: 1., SCPIBase.PRIORITY_NORMAL: 4., SCPIBase.PRIORITY_HIGH: 16.}
+
+    class Job:
+        def __init__(self, line, session, allowed):
+            self.line = line
+            self.session = session
+            self.allowed = allowed
+            self.priority = session.priority
+            self.submitted = time.perf_counter()
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self, process, workers = 2):
+        '''
+            Input:
+                process (function) - called with line, session and allowed, returns the results
+                workers (int) - number of lines executed concurrently, not counting
+                    lines waiting in a blocking context
+        '''
+        self._process = process
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._pass = {}
+        self._vtime = 0.
+        # per priority: queued lines, executed lines, total and longest wait in seconds
+        self._depth = dict((priority, 0) for priority in SCPIBase.PRIORITY_NAMES.values())
+        self._executed = dict(self._depth)
+        self._wait = dict((priority, 0.) for priority in self._depth)
+        self._max_wait = dict(self._wait)
+        # workers that are not waiting in a blocking context
+        self._workers = workers
+        self._running = 0
+        self._started = 0
+        # lines being executed, including those waiting in a blocking context
+        self._active = 0
+        self._paused = 0
+        with self._cond:
+            for _ in range(workers):
+                self._spawn()
+
+    def _spawn(self):
+        ''' start a worker, must be called with the lock held '''
+        self._running += 1
+        threading.Thread(target=self._loop, name='CommandExecutor%d'%self._started, daemon=True).start()
+        self._started += 1
+
+    @contextlib.contextmanager
+    def _blocking(self):
+        with self._cond:
+            self._running -= 1
+            if self._running < self._workers:
+                self._spawn()
+        try:
+            yield
+        finally:
+            # the pool has one worker too many now, which retires after its line
+            with self._cond:
+                self._running += 1
+
+    @contextlib.contextmanager
+    def pause(self):
+        '''
+            return a context manager that waits until all lines being executed
+            are complete and starts no new line until it is left
+
+            called by a line, e.g. SYSTem:RELoad, the calling line is not waited for.
+        '''
+        own = 1 if getattr(_worker, 'executor', None) is self else 0
+        with self._cond:
+            self._paused += 1
+            while self._active > own:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._paused -= 1
+                self._cond.notify_all()
+
+    def submit(self, key, line, session, allowed = None):
+        '''
+            queue a line of connection key and wait for it to be executed
+
+            lines of the same connection are executed in order, as the caller
+            waits for each of them.
+        '''
+        job = CommandExecutor.Job(line, session, allowed)
+        with self._cond:
+            queue = self._queues.setdefault(key, collections.deque())
+            if not queue:
+                # an idle connection does not accumulate credit
+                self._pass[key] = max(self._pass.get(key, 0.), self._vtime)
+            queue.append(job)
+            self._depth[job.priority] += 1
+            self._cond.notify()
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def close(self, key):
+        ''' forget a connection that has been closed '''
+        with self._cond:
+            if not self._queues.get(key):
+                self._queues.pop(key, None)
+                self._pass.pop(key, None)
+
+    def _next(self):
+        ''' remove the next job from the queues, must be called with the lock held '''
+        if self._paused:
+            return None
+        best_key, best_rank = None, None
+        for key, queue in self._queues.items():
+            if queue:
+                job = queue[0]
+                if job.priority == SCPIBase.PRIORITY_CRITICAL:
+                    rank = (0, job.submitted)
+                else:
+                    rank = (1, self._pass[key])
+                if (best_rank is None) or (rank < best_rank):
+                    best_key, best_rank = key, rank
+        if best_key is None:
+            return None
+        job = self._queues[best_key].popleft()
+        self._depth[job.priority] -= 1
+        if job.priority != SCPIBase.PRIORITY_CRITICAL:
+            self._vtime = self._pass[best_key]
+            self._pass[best_key] += 1./self.WEIGHTS[job.priority]
+        return job
+
+    def _loop(self):
+        _worker.executor = self
+        while True:
+            with self._cond:
+                if self._running > self._workers:
+                    self._running -= 1
+                    return
+                job = self._next()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next()
+                self._active += 1
+                now = time.perf_counter()
+                wait = now - job.submitted
+                self._executed[job.priority] += 1
+                self._wait[job.priority] += wait
+                self._max_wait[job.priority] = max(self._max_wait[job.priority], wait)
+            if tracer.enabled:
+                tracer.record('queue', 'scpi', int(job.submitted*1e9), int(now*1e9), {'line': job.line})
+            try:
+                job.result = self._process(job.line, job.session, job.allowed)
+            except Exception as err:
+                job.error = err
+            with self._cond:
+                self._active -= 1
+                if self._paused:
+                    self._cond.notify_all()
+            job.done.set()
+
+    def stats(self, priority = None):
+        '''
+            return queued lines, executed lines, mean and longest wait in seconds
+            of a priority level or of all levels if priority is None
+        '''
+        with self._cond:
+            priorities = list(self._depth) if priority is None else [priority]
+            executed = sum(self._executed[p] for p in priorities)
+            total_wait = sum(self._wait[p] for p in priorities)
+            return (sum(self._depth[p] for p in priorities), executed,
+                    total_wait/executed if executed else 0., max(self._max_wait[p] for p in priorities))
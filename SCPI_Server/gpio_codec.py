@@ -0,0 +1,52 @@
+#Run-length/delta encoding of sampled GPIO bank states
+
+import struct
+
+# magic, sample period in seconds
+HEADER = struct.Struct('<4sd')
+MAGIC = b'GPRL'
+
+def _varint(value, out):
+    ''' append value as an unsigned LEB128 varint '''
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def encode_transitions(samples, first = 0, period = 0.):
+    '''
+        encode a sequence of bank states as transitions with delta timestamps
+
+        slowly changing digital lines produce long runs of identical samples. only
+        the initial state and the transitions are stored: for every transition, the
+        number of samples since the previous transition and the XOR of the old and
+        new state (the toggled pins). all numbers are unsigned LEB128 varints.
+
+        layout:
+            HEADER (magic, sample period)
+            varints: index of the first sample, number of samples, initial state
+            varint pairs: samples since the previous transition, toggled pins
+
+        Input:
+            samples (sequence of int) - bank states as bit masks
+            first (int) - index of the first sample
+            period (float) - time between samples in seconds
+        Output:
+            bytes
+    '''
+    out = bytearray(HEADER.pack(MAGIC, period))
+    _varint(first, out)
+    _varint(len(samples), out)
+    if not len(samples):
+        _varint(0, out)
+        return bytes(out)
+    state = samples[0]
+    _varint(state, out)
+    last = 0
+    for idx, sample in enumerate(samples):
+        if sample != state:
+            _varint(idx-last, out)
+            _varint(sample ^ state, out)
+            state = sample
+            last = idx
+    return bytes(out)
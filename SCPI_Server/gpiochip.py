@@ -0,0 +1,432 @@
+#GPIO backend built on the Linux GPIO character device (gpiochip v2 uAPI)
+#
+#Offers the subset of the RPi.GPIO interface used by interface_gpio, so PiGPIO can
+#run on it unchanged. Select it with pi_server.py --backend chardev.
+
+import ctypes
+import fcntl
+import os
+import select
+import threading
+import time
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+HIGH = 1
+LOW = 0
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+SERIAL = 40
+SPI = 41
+I2C = 42
+HARD_PWM = 43
+UNKNOWN = -1
+
+# linux/gpio.h
+GPIO_MAX_NAME_SIZE = 32
+GPIO_V2_LINES_MAX = 64
+GPIO_V2_LINE_NUM_ATTRS_MAX = 10
+GPIO_V2_LINE_FLAG_INPUT = 1<<2
+GPIO_V2_LINE_FLAG_OUTPUT = 1<<3
+GPIO_V2_LINE_FLAG_EDGE_RISING = 1<<4
+GPIO_V2_LINE_FLAG_EDGE_FALLING = 1<<5
+GPIO_V2_LINE_FLAG_BIAS_PULL_UP = 1<<8
+GPIO_V2_LINE_FLAG_BIAS_PULL_DOWN = 1<<9
+GPIO_V2_LINE_FLAG_BIAS_DISABLED = 1<<10
+GPIO_V2_LINE_ATTR_ID_FLAGS = 1
+GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES = 2
+GPIO_V2_LINE_EVENT_RISING_EDGE = 1
+GPIO_V2_LINE_EVENT_FALLING_EDGE = 2
+
+class gpiochip_info(ctypes.Structure):
+    _fields_ = [('name', ctypes.c_char*GPIO_MAX_NAME_SIZE),
+                ('label', ctypes.c_char*GPIO_MAX_NAME_SIZE),
+                ('lines', ctypes.c_uint32)]
+
+class gpio_v2_line_attribute(ctypes.Structure):
+    class _Value(ctypes.Union):
+        _fields_ = [('flags', ctypes.c_uint64),
+                    ('values', ctypes.c_uint64),
+                    ('debounce_period_us', ctypes.c_uint32)]
+    _anonymous_ = ('value',)
+    _fields_ = [('id', ctypes.c_uint32),
+                ('padding', ctypes.c_uint32),
+                ('value', _Value)]
+
+class gpio_v2_line_config_attribute(ctypes.Structure):
+    _fields_ = [('attr', gpio_v2_line_attribute),
+                ('mask', ctypes.c_uint64)]
+
+class gpio_v2_line_config(ctypes.Structure):
+    _fields_ = [('flags', ctypes.c_uint64),
+                ('num_attrs', ctypes.c_uint32),
+                ('padding', ctypes.c_uint32*5),
+                ('attrs', gpio_v2_line_config_attribute*GPIO_V2_LINE_NUM_ATTRS_MAX)]
+
+class gpio_v2_line_request(ctypes.Structure):
+    _fields_ = [('offsets', ctypes.c_uint32*GPIO_V2_LINES_MAX),
+                ('consumer', ctypes.c_char*GPIO_MAX_NAME_SIZE),
+                ('config', gpio_v2_line_config),
+                ('num_lines', ctypes.c_uint32),
+                ('event_buffer_size', ctypes.c_uint32),
+                ('padding', ctypes.c_uint32*5),
+                ('fd', ctypes.c_int32)]
+
+class gpio_v2_line_values(ctypes.Structure):
+    _fields_ = [('bits', ctypes.c_uint64),
+                ('mask', ctypes.c_uint64)]
+
+class gpio_v2_line_event(ctypes.Structure):
+    _fields_ = [('timestamp_ns', ctypes.c_uint64),
+                ('id', ctypes.c_uint32),
+                ('offset', ctypes.c_uint32),
+                ('seqno', ctypes.c_uint32),
+                ('line_seqno', ctypes.c_uint32),
+                ('padding', ctypes.c_uint32*6)]
+
+def _ioc(direction, nr, struct):
+    return (direction<<30) | (ctypes.sizeof(struct)<<16) | (0xB4<<8) | nr
+
+GPIO_GET_CHIPINFO_IOCTL = _ioc(2, 0x01, gpiochip_info)
+GPIO_V2_GET_LINE_IOCTL = _ioc(3, 0x07, gpio_v2_line_request)
+GPIO_V2_LINE_SET_CONFIG_IOCTL = _ioc(3, 0x0D, gpio_v2_line_config)
+GPIO_V2_LINE_GET_VALUES_IOCTL = _ioc(3, 0x0E, gpio_v2_line_values)
+GPIO_V2_LINE_SET_VALUES_IOCTL = _ioc(3, 0x0F, gpio_v2_line_values)
+
+class LineRequest(object):
+    '''
+        a set of lines of a gpiochip requested with a single ioctl
+
+        values are read and written as bit maps over all lines of the request,
+        so any number of lines is updated atomically with one ioctl.
+    '''
+    def __init__(self, chip_fd, offsets, flags, values = 0, consumer = 'PiGPIO', event_buffer_size = 0, ioctl = fcntl.ioctl):
+        '''
+            Input:
+                chip_fd (int) - open file descriptor of /dev/gpiochipN
+                offsets (list of int) - line offsets, at most 64
+                flags (list of int) - GPIO_V2_LINE_FLAG_* of every line
+                values (int) - initial levels of the output lines, bit n belongs to offsets[n]
+                ioctl (function) - replaces fcntl.ioctl, e.g. to test without hardware
+        '''
+        if len(offsets) > GPIO_V2_LINES_MAX:
+            raise ValueError('at most %d lines can be requested at once.'%GPIO_V2_LINES_MAX)
+        self.offsets = list(offsets)
+        self.index = dict((offset, idx) for idx, offset in enumerate(self.offsets))
+        self._ioctl = ioctl
+        request = gpio_v2_line_request()
+        for idx, offset in enumerate(self.offsets):
+            request.offsets[idx] = offset
+        request.consumer = consumer.encode()[:GPIO_MAX_NAME_SIZE-1]
+        request.num_lines = len(self.offsets)
+        request.event_buffer_size = event_buffer_size
+        self._build_config(request.config, flags, values)
+        self._ioctl(chip_fd, GPIO_V2_GET_LINE_IOCTL, request, True)
+        self.fd = request.fd
+
+    def _build_config(self, config, flags, values):
+        ''' lines sharing the most common flags use the default, all others get attributes '''
+        groups = {}
+        for idx, line_flags in enumerate(flags):
+            groups[line_flags] = groups.get(line_flags, 0) | (1<<idx)
+        ordered = sorted(groups.items(), key=lambda item: -bin(item[1]).count('1'))
+        if len(ordered) > GPIO_V2_LINE_NUM_ATTRS_MAX:
+            raise ValueError('too many different line configurations.')
+        config.flags = ordered[0][0]
+        attrs = []
+        for line_flags, mask in ordered[1:]:
+            attrs.append((GPIO_V2_LINE_ATTR_ID_FLAGS, line_flags, mask))
+        outputs = sum(1<<idx for idx, line_flags in enumerate(flags) if line_flags & GPIO_V2_LINE_FLAG_OUTPUT)
+        if outputs:
+            attrs.append((GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES, values & outputs, outputs))
+        for idx, (attr_id, value, mask) in enumerate(attrs):
+            config.attrs[idx].attr.id = attr_id
+            config.attrs[idx].attr.values = value
+            config.attrs[idx].mask = mask
+        config.num_attrs = len(attrs)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def reconfigure(self, flags, values = 0):
+        ''' change direction, bias and edge detection of all lines with one ioctl '''
+        config = gpio_v2_line_config()
+        self._build_config(config, flags, values)
+        self._ioctl(self.fd, GPIO_V2_LINE_SET_CONFIG_IOCTL, config, True)
+
+    def get_values(self, mask):
+        ''' return the levels of the lines selected by mask (bit n is offsets[n]) '''
+        values = gpio_v2_line_values(0, mask)
+        self._ioctl(self.fd, GPIO_V2_LINE_GET_VALUES_IOCTL, values, True)
+        return values.bits & mask
+
+    def set_values(self, mask, bits):
+        ''' write the lines selected by mask (bit n is offsets[n]) '''
+        self._ioctl(self.fd, GPIO_V2_LINE_SET_VALUES_IOCTL, gpio_v2_line_values(bits, mask), True)
+
+    def read_events(self, timeout = 0.):
+        '''
+            return the queued edge events as (timestamp in ns, offset, level) tuples
+
+            timestamps are taken by the kernel when the edge is detected
+            (CLOCK_MONOTONIC). waits up to timeout seconds for the first event.
+        '''
+        size = ctypes.sizeof(gpio_v2_line_event)
+        events = []
+        while select.select([self.fd], [], [], timeout)[0]:
+            data = os.read(self.fd, 16*size)
+            for pos in range(0, len(data)-size+1, size):
+                event = gpio_v2_line_event.from_buffer_copy(data, pos)
+                events.append((event.timestamp_ns, event.offset, int(event.id == GPIO_V2_LINE_EVENT_RISING_EDGE)))
+            timeout = 0.
+        return events
+
+class Chip(object):
+    '''
+        a /dev/gpiochipN device holding a single request for all lines in use
+
+        the RPi.GPIO style functions of this module set lines up one at a time.
+        adding a line replaces the request by one covering all lines, changing
+        the configuration of lines already requested is done in place.
+    '''
+    def __init__(self, path = '/dev/gpiochip0', consumer = 'PiGPIO', ioctl = fcntl.ioctl):
+        self.path = path
+        self.consumer = consumer
+        self._ioctl = ioctl
+        self._lock = threading.RLock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+        info = gpiochip_info()
+        self._ioctl(self.fd, GPIO_GET_CHIPINFO_IOCTL, info, True)
+        self.name = info.name.decode()
+        self.label = info.label.decode()
+        self.lines = info.lines
+        # line offset: [flags, level]
+        self._config = {}
+        self._request = None
+
+    def close(self):
+        with self._lock:
+            if self._request is not None:
+                self._request.close()
+                self._request = None
+            os.close(self.fd)
+
+    def _flags_values(self, offsets):
+        flags = [self._config[offset][0] for offset in offsets]
+        values = sum(1<<idx for idx, offset in enumerate(offsets) if self._config[offset][1])
+        return flags, values
+
+    def configure(self, offsets, flags):
+        ''' set the GPIO_V2_LINE_FLAG_* of several lines '''
+        with self._lock:
+            for offset in offsets:
+                if (offset < 0) or (offset >= self.lines):
+                    raise ValueError('line %d is not available on %s.'%(offset, self.path))
+                self._config.setdefault(offset, [0, 0])[0] = flags
+            request = self._request
+            if (request is not None) and all(offset in request.index for offset in offsets):
+                request.reconfigure(*self._flags_values(request.offsets))
+                return
+            # the kernel refuses lines that are still held by a request (EBUSY), so the
+            # old request is released first. the new one drives the outputs to the
+            # levels in _config right away.
+            if request is not None:
+                request.close()
+                self._request = None
+            lines = sorted(self._config)
+            try:
+                self._request = self._line_request(lines)
+            except OSError:
+                if request is not None:
+                    # take the lines that were in use before back
+                    for offset in offsets:
+                        if offset not in request.index:
+                            del self._config[offset]
+                    self._request = self._line_request(request.offsets)
+                raise
+
+    def _line_request(self, lines):
+        return LineRequest(self.fd, lines, *self._flags_values(lines), consumer = self.consumer,
+                           event_buffer_size = 16*len(lines), ioctl = self._ioctl)
+
+    def _mask(self, offsets, flag = None):
+        request = self._request
+        mask = 0
+        for offset in offsets:
+            idx = None if request is None else request.index.get(offset)
+            if (idx is None) or ((flag is not None) and not (self._config[offset][0] & flag)):
+                raise RuntimeError('The GPIO channel has not been set up as an %s'%('OUTPUT' if flag else 'INPUT or OUTPUT'))
+            mask |= 1<<idx
+        return request, mask
+
+    def write(self, levels):
+        ''' write a {offset: level} dict with one ioctl '''
+        with self._lock:
+            request, mask = self._mask(levels, GPIO_V2_LINE_FLAG_OUTPUT)
+            bits = 0
+            for offset, level in levels.items():
+                self._config[offset][1] = int(bool(level))
+                if level:
+                    bits |= 1<<request.index[offset]
+            request.set_values(mask, bits)
+
+    def read(self, offsets):
+        ''' return the levels of several lines read with one ioctl '''
+        with self._lock:
+            request, mask = self._mask(offsets)
+            bits = request.get_values(mask)
+        return [(bits >> request.index[offset]) & 1 for offset in offsets]
+
+    def read_events(self, timeout = 0.):
+        ''' see LineRequest.read_events '''
+        request = self._request
+        return [] if request is None else request.read_events(timeout)
+
+_chip = None
+_chip_lock = threading.Lock()
+_edges = {}
+
+def chip():
+    ''' return the chip selected by the GPIO_CHIP environment variable, /dev/gpiochip0 by default '''
+    global _chip
+    with _chip_lock:
+        if _chip is None:
+            _chip = Chip(os.environ.get('GPIO_CHIP', '/dev/gpiochip0'))
+        return _chip
+
+def _channels(channel):
+    return list(channel) if isinstance(channel, (list, tuple)) else [channel]
+
+def setmode(mode):
+    if mode != BCM:
+        raise ValueError('only BCM numbering is supported, BCM numbers are line offsets.')
+
+def setwarnings(flag):
+    pass
+
+def setup(channel, direction, pull_up_down = PUD_OFF, initial = -1):
+    ''' configure one or several lines, see RPi.GPIO.setup '''
+    channels = _channels(channel)
+    if direction == OUT:
+        flags = GPIO_V2_LINE_FLAG_OUTPUT
+    elif direction == IN:
+        flags = GPIO_V2_LINE_FLAG_INPUT | {PUD_UP: GPIO_V2_LINE_FLAG_BIAS_PULL_UP,
+                                           PUD_DOWN: GPIO_V2_LINE_FLAG_BIAS_PULL_DOWN,
+                                           PUD_OFF: GPIO_V2_LINE_FLAG_BIAS_DISABLED}[pull_up_down]
+        for offset in channels:
+            flags |= _edges.get(offset, 0)
+    else:
+        raise ValueError('direction must be IN or OUT.')
+    device = chip()
+    if (direction == OUT) and (initial != -1):
+        with device._lock:
+            for offset in channels:
+                device._config.setdefault(offset, [0, 0])[1] = int(bool(initial))
+    device.configure(channels, flags)
+
+def output(channel, value):
+    ''' write one or several lines with a single ioctl, see RPi.GPIO.output '''
+    channels = _channels(channel)
+    values = _channels(value) if isinstance(value, (list, tuple)) else [value]*len(channels)
+    if len(values) != len(channels):
+        raise RuntimeError('Number of channels != number of values')
+    chip().write(dict(zip(channels, values)))
+
+def input(channel):
+    return chip().read([channel])[0]
+
+def inputs(channels):
+    ''' read several lines with a single ioctl '''
+    return chip().read(list(channels))
+
+def add_event_detect(channel, edge):
+    '''
+        enable kernel edge detection on an input line, events are fetched with read_events
+    '''
+    _edges[channel] = {RISING: GPIO_V2_LINE_FLAG_EDGE_RISING, FALLING: GPIO_V2_LINE_FLAG_EDGE_FALLING,
+                       BOTH: GPIO_V2_LINE_FLAG_EDGE_RISING | GPIO_V2_LINE_FLAG_EDGE_FALLING}[edge]
+    device = chip()
+    with device._lock:
+        flags = device._config.get(channel, [GPIO_V2_LINE_FLAG_INPUT])[0]
+        if not flags & GPIO_V2_LINE_FLAG_INPUT:
+            raise RuntimeError('You must setup() the GPIO channel as an input first')
+        device.configure([channel], (flags & ~(GPIO_V2_LINE_FLAG_EDGE_RISING | GPIO_V2_LINE_FLAG_EDGE_FALLING)) | _edges[channel])
+
+def remove_event_detect(channel):
+    _edges.pop(channel, None)
+    device = chip()
+    with device._lock:
+        if channel in device._config:
+            flags = device._config[channel][0]
+            device.configure([channel], flags & ~(GPIO_V2_LINE_FLAG_EDGE_RISING | GPIO_V2_LINE_FLAG_EDGE_FALLING))
+
+def read_events(timeout = 0.):
+    ''' return kernel-timestamped (timestamp in ns, channel, level) edge events '''
+    return chip().read_events(timeout)
+
+def cleanup(*args):
+    global _chip
+    with _chip_lock:
+        if _chip is not None:
+            _chip.close()
+            _chip = None
+
+class PWM(object):
+    '''
+        software PWM on a line set up as output, see RPi.GPIO.PWM
+    '''
+    def __init__(self, channel, frequency):
+        self.channel = channel
+        self.frequency = float(frequency)
+        self.duty_cycle = 0.
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, duty_cycle):
+        self.ChangeDutyCycle(duty_cycle)
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='PWM%d'%self.channel, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        output(self.channel, 0)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        if (duty_cycle < 0.) or (duty_cycle > 100.):
+            raise ValueError('dutycycle must have a value from 0.0 to 100.0')
+        self.duty_cycle = float(duty_cycle)
+
+    def ChangeFrequency(self, frequency):
+        if frequency <= 0.:
+            raise ValueError('frequency must be greater than 0.0')
+        self.frequency = float(frequency)
+
+    def _loop(self):
+        next_edge = time.perf_counter()
+        while not self._stop.is_set():
+            period = 1./self.frequency
+            on = period*self.duty_cycle/100.
+            if on > 0.:
+                output(self.channel, 1)
+            next_edge += on
+            self._stop.wait(max(next_edge-time.perf_counter(), 0.))
+            if on < period:
+                output(self.channel, 0)
+            next_edge += period-on
+            self._stop.wait(max(next_edge-time.perf_counter(), 0.))
@@ -4,22 +4,139 @@
 
 import time
 import os
+import json
+import hashlib
+import inspect
+import contextlib
+import tempfile
+import threading
 import subprocess
 
-from scpi_base import SCPIBase
-from scpi_event import SCPIDeviceError, SCPIQueryError
-import RPi.GPIO as GPIO
+from scpi_base import SCPIBase, block_pack, ArgBool, ArgEnum, ArgFloat, ArgInt
+from switch_group import SwitchGroup
+from pulse_scheduler import EdgeScheduler
+from watchdog import Watchdog
+from sampler import InputSampler, FrameWriter, FORMAT_RAW, FORMAT_RLE
+from gpio_codec import encode_transitions
+from pwm_output import PWMOutput, SysfsPWM, HARDWARE_CHANNELS, SYSFS_CHIP
+from scpi_event import SCPICommandError, SCPIDeviceError, SCPIExecutionError, SCPIQueryError
+from tracing import tracer
+from executor import blocking
+# pi_server.py --backend selects the GPIO library
+if os.environ.get('GPIO_BACKEND', 'rpigpio') == 'chardev':
+    import gpiochip as GPIO
+else:
+    import RPi.GPIO as GPIO
+
+def user_dir(variable, default):
+    '''
+        return the sqd_gpio folder in the XDG base directory named by variable,
+        e.g. $XDG_STATE_HOME/sqd_gpio or ~/.local/state/sqd_gpio if it is not set
+    '''
+    return os.path.join(os.environ.get(variable) or os.path.join(os.path.expanduser('~'), default), 'sqd_gpio')
 
 def dict_from_strings(strings):
     ''' take a list of key:value pairs and return them as a dictionary '''
     return dict([s.strip() for s in kv.split(':', 1)] for kv in strings if ':' in kv)
 
+def load_pin_map(path):
+    '''
+        read and validate a pin map file
+
+        the file is a JSON document with the keys
+            pins - list of pin entries. each entry requires the BCM number "gpio" and
+                accepts "mode" (IN/OUT), "value" (0/1), "pull" (UP/DOWN/NONE),
+                "setup", "mode_fix", "val_fix", "pud_fix" (bool), "description",
+                "safe" (0/1, the level driven when the watchdog trips, defaults to "value")
+                and "max_on" (maximum time in seconds the pin may deviate from "safe")
+            defaults - values used for keys missing from a pin entry (optional)
+            aliases - maps additional command names such as "GPIO:SW1:POSition"
+                to BCM pin numbers (optional)
+            switches - list of switch groups, see SwitchGroup for the keys (optional)
+
+        Output:
+            list of keyword argument dicts for PiGPIO.Pin, dict of aliases, list of SwitchGroup
+    '''
+    with open(path) as pin_map_file:
+        pin_map = json.load(pin_map_file)
+    mode_map = {'IN': GPIO.IN, 'OUT': GPIO.OUT}
+    pud_map = {'UP': GPIO.PUD_UP, 'DOWN': GPIO.PUD_DOWN, 'NONE': GPIO.PUD_OFF}
+    keys = {'gpio', 'mode', 'value', 'pull', 'setup', 'mode_fix', 'val_fix', 'pud_fix', 'description', 'safe', 'max_on'}
+    defaults = {'mode': 'OUT', 'value': 0, 'pull': 'NONE', 'setup': True,
+                'mode_fix': False, 'val_fix': False, 'pud_fix': False, 'description': None,
+                'safe': None, 'max_on': None}
+    defaults.update(pin_map.get('defaults', {}))
+    pin_specs = []
+    for entry in pin_map['pins']:
+        unknown = set(entry) - keys
+        if unknown:
+            raise ValueError('%s: unknown keys %s in pin entry %s.'%(path, ', '.join(sorted(unknown)), entry))
+        entry = dict(defaults, **entry)
+        gpio = entry.get('gpio')
+        if (not isinstance(gpio, int)) or (gpio < 0) or (gpio > 40):
+            raise ValueError('%s: invalid gpio number in pin entry %s.'%(path, entry))
+        if gpio in [spec['gpio'] for spec in pin_specs]:
+            raise ValueError('%s: gpio %d is defined more than once.'%(path, gpio))
+        if (entry['mode'] not in mode_map) or (entry['pull'] not in pud_map) or (entry['value'] not in (0, 1)):
+            raise ValueError('%s: invalid mode, pull or value in pin entry %s.'%(path, entry))
+        if (entry['safe'] not in (None, 0, 1)) or ((entry['max_on'] is not None) and not (isinstance(entry['max_on'], (int, float)) and (entry['max_on'] > 0))):
+            raise ValueError('%s: invalid safe level or maximum on-time in pin entry %s.'%(path, entry))
+        pin_specs.append({
+            'gpio': gpio,
+            'mode_rst': mode_map[entry['mode']],
+            'val_rst': bool(entry['value']),
+            'pud_rst': pud_map[entry['pull']],
+            'setup': bool(entry['setup']),
+            'mode_fix': bool(entry['mode_fix']),
+            'val_fix': bool(entry['val_fix']),
+            'pud_fix': bool(entry['pud_fix']),
+            'description': entry['description'],
+            'safe': None if entry['safe'] is None else bool(entry['safe']),
+            'max_on': entry['max_on']
+        })
+    aliases = pin_map.get('aliases', {})
+    for name, gpio in aliases.items():
+        if gpio not in [spec['gpio'] for spec in pin_specs]:
+            raise ValueError('%s: alias %s refers to undefined gpio %s.'%(path, name, gpio))
+    switches = []
+    used_pins = set()
+    for entry in pin_map.get('switches', []):
+        switch = SwitchGroup(**entry)
+        for gpio in switch.pins:
+            spec = ([spec for spec in pin_specs if spec['gpio'] == gpio] or [None])[0]
+            if (spec is None) or (spec['mode_rst'] != GPIO.OUT) or spec['val_fix']:
+                raise ValueError('%s: switch %s requires gpio %s to be a writable output.'%(path, switch.name, gpio))
+            if gpio in used_pins:
+                raise ValueError('%s: gpio %s is used by more than one switch.'%(path, gpio))
+            used_pins.add(gpio)
+        switches.append(switch)
+    return pin_specs, aliases, switches
+
 class PiGPIO(SCPIBase):    
     _REVISION = 1
+    TRANSACTION_EXEMPT = SCPIBase.TRANSACTION_EXEMPT + ('GPIO:SAFE',)
     tunes_path = ''
+    # pi_server.py --state-dir replaces the folder
+    states_path = os.path.join(user_dir('XDG_STATE_HOME', os.path.join('.local', 'state')), 'gpio_states.json')
+    pin_map_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'pinmap.json')
+    # pi_server.py --cache-dir replaces the folder
+    command_cache_path = os.path.join(user_dir('XDG_CACHE_HOME', '.cache'), 'command_cache.pickle')
+    pwm_chip_path = SYSFS_CHIP
+    NUM_STATE_SLOTS = 10
+    _MODE_NAMES = {GPIO.IN: 'IN', GPIO.OUT: 'OUT'}
+    _PUD_NAMES = {GPIO.PUD_UP: 'UP', GPIO.PUD_DOWN: 'DOWN', GPIO.PUD_OFF: 'NONE'}
+    _MODE_VALUES = dict((name, mode) for mode, name in _MODE_NAMES.items())
+    _PUD_VALUES = dict((name, pud) for pud, name in _PUD_NAMES.items())
+    _DIRECTION_NAMES = {GPIO.IN: 'IN', GPIO.OUT: 'OUT', GPIO.I2C: 'I2C', GPIO.PWM: 'PWM', GPIO.SERIAL: 'SERIAL'}
+    # argument types shared by several commands
+    _SECONDS = {'S': 1., 'MS': 1e-3, 'US': 1e-6}
+    _LEVEL = ArgBool({'HIGH': True, 'LOW': False, 'TRUE': True, 'FALSE': False})
+    _DELAY = ArgFloat(200e-6, 2., units = _SECONDS)
+    _MASK = ArgInt(0, base = 0)
+    _INT = ArgInt()
     
     class Pin:
-        def __init__(self, gpio, mode_rst, val_rst, pud_rst, setup = True, mode_fix = False, val_fix = False, pud_fix = False, description = None):
+        def __init__(self, gpio, mode_rst, val_rst, pud_rst, setup = True, mode_fix = False, val_fix = False, pud_fix = False, description = None, safe = None, max_on = None):
             '''
                 pin description
 
@@ -28,6 +145,8 @@ class PiGPIO(SCPIBase):
                     setup (bool) - indicates if the pin can be setup. False implies mode_fix, val_fix and pud_fix
                     mode_fix, val_fix, pud_fix (bool) -- indicates that mode/val/pud can not be changed
                     description - user-friendly pin information
+                    safe - output value in the safe state, defaults to val_rst
+                    max_on - maximum time in seconds the value may differ from safe (optional)
             '''
             self.id = gpio
             self.mode_rst = mode_rst
@@ -43,105 +162,296 @@ class PiGPIO(SCPIBase):
                 self.val_fix = val_fix
                 self.pud_fix = pud_fix
             self.description = description
-            self.reset()
+            self.safe = val_rst if safe is None else safe
+            self.max_on = max_on
+            # called with the pin after each value change if set
+            self.watch = None
+            # the hardware is only set up when the pin is first used
+            self.mode = self.mode_rst
+            self.pud = self.pud_rst
+            self.val = self.val_rst
+            self._configured = False
+            # PWMOutput while the pin is in PWM mode
+            self.pwm = None
+            # guards the shadow state and the hardware of this pin. bulk writes
+            # acquire the locks of all involved pins in order of their BCM numbers.
+            self.lock = threading.Lock()
         
         def _setup(self):
-            if self.setup:
-                if self.mode == GPIO.OUT:
+            self._configured = True
+            left_pwm = (self.pwm is not None) and (self.mode != GPIO.PWM)
+            if left_pwm:
+                self.pwm.close()
+                self.pwm = None
+            if not self.setup:
+                return
+            with tracer.span('GPIO.setup', 'io', pin = self.id):
+                if self.mode == GPIO.PWM:
+                    GPIO.setup(self.id, GPIO.OUT)
+                elif self.mode == GPIO.OUT:
                     GPIO.setup(self.id, self.mode) #, pull_up_down=self.pud, initial=self.val)  <--- Causes issues with Pin3/GPIO2 - check later why?!
+                    if left_pwm:
+                        # the PWM output stopped low, restore the last set level
+                        GPIO.output(self.id, self.val)
                 else:  
                     GPIO.setup(self.id, self.mode, pull_up_down=self.pud)
+
+        def _ensure_setup(self):
+            ''' set up the pin in its current mode if this has not happened yet '''
+            if not self._configured:
+                self._setup()
                 
         def reset(self):
-            self.mode = self.mode_rst
-            self.pud = self.pud_rst
-            self.val = self.val_rst
-            self._setup()
+            with self.lock:
+                self.mode = self.mode_rst
+                self.pud = self.pud_rst
+                self.val = self.val_rst
+                self._setup()
             
         def set_mode(self, mode):
-            if self.mode_fix:
-                if self.mode != mode:
-                    raise ValueError('mode of pin %d is fixed.'%self.id)
-            else:
-                self.mode = mode
-                self._setup()
+            with self.lock:
+                if self.mode_fix:
+                    if (self.pwm is not None) and self.pwm.hardware and (mode == self.mode_rst):
+                        # hand a hardware PWM pin back, _setup disables the pwm channel
+                        self.mode = mode
+                        self._setup()
+                    elif self.mode != mode:
+                        raise ValueError('mode of pin %d is fixed.'%self.id)
+                else:
+                    self.mode = mode
+                    self._setup()
         
+        def configure(self, mode, pud):
+            '''
+                change mode and pull-up/down state with a single hardware setup call
+            '''
+            with self.lock:
+                if (self.mode_fix and (self.mode != mode)) or (self.pud_fix and (self.pud != pud)):
+                    raise ValueError('configuration of pin %d is fixed.'%self.id)
+                if (self.mode != mode) or (self.pud != pud) or not self._configured:
+                    self.mode = mode
+                    self.pud = pud
+                    self._setup()
+
         def set_pud(self, pud):
-            if self.pud_fix:
-                if self.pud != pud:
-                    raise ValueError('pull-up/down resistor of pin %d is fixed.'%self.id)
-            else:
-                self.pud = pud
-                self._setup()
+            with self.lock:
+                if self.pud_fix:
+                    if self.pud != pud:
+                        raise ValueError('pull-up/down resistor of pin %d is fixed.'%self.id)
+                else:
+                    self.pud = pud
+                    self._setup()
 
         def set_val(self, val):
             #if self.mode != GPIO.OUT:
             #    raise ValueError('unable to set value of input pin %d.'%self.id)
-            if self.val_fix:
-                if self.val != val:
-                    raise ValueError('value of pin %d is fixed.'%self.id)
-            else:
-                self.val = val
-                if self.mode == GPIO.OUT:
-                    GPIO.output(self.id, val)
+            with self.lock:
+                if self.val_fix:
+                    if self.val != val:
+                        raise ValueError('value of pin %d is fixed.'%self.id)
+                else:
+                    self.val = val
+                    if self.mode == GPIO.OUT:
+                        self._ensure_setup()
+                        with tracer.span('GPIO.output', 'io', pin = self.id):
+                            GPIO.output(self.id, val)
+                    if self.watch is not None:
+                        self.watch(self)
                 
         def get_val(self):
             ''' read pin value from hardware. value is not stored in self.val '''
             if self.val_fix:
                 return self.val_rst
             else:
-                return GPIO.input(self.id)
+                with self.lock:
+                    self._ensure_setup()
+                    with tracer.span('GPIO.input', 'io', pin = self.id):
+                        return GPIO.input(self.id)
             
     def __init__(self):
+        # reuse the parsed command names of the last start if neither the parser,
+        # this module nor the pin map have changed since
+        cache_key = self._command_table_key()
+        self.load_command_table(self.command_cache_path, cache_key)
         super(PiGPIO, self).__init__()
-        # set pin numbering to 'board', reset all pins to their default values
+        # set pin numbering to 'board', build the pin table from the pin map.
+        # pins are set up lazily when they are first used.
         GPIO.setmode(GPIO.BCM)
-        self._gpio_ids = [
-            None, # pin counting starts from 1
-            None, # pin counting starts from 2
-            PiGPIO.Pin(2, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(3, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(4, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(5, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(6, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(7, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(8, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(9, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(10, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(11, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(12, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(13, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(14, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(15, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(16, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(17, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(18, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(19, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(20, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(21, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(22, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(23, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(24, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(25, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(26, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO'),
-            PiGPIO.Pin(27, GPIO.OUT, False, GPIO.PUD_OFF, description='GPIO')
-        ]
+        self._lock = threading.RLock()
+        self._scheduler = EdgeScheduler(self._write_levels, lock = self._lock)
+        # cancel functions of the running pulses, called by safe_state
+        self._pulses = set()
+        self._watchdog = Watchdog(self._watchdog_trip)
+        self._keepalive = {}
+        self.watchdog_reason = ''
+        # set by the server, called by SYSTem:RELoad to replace this instance
+        self.reload_handler = None
+        # set by the server, returns the statistics of its command queues
+        self.queue_stats = None
+        self._sampler = InputSampler(self.read_port, self._publish_frame)
+        self._subscribers = {}
+        pin_specs, aliases, self._switches = load_pin_map(self.pin_map_path)
+        self._gpio_ids = [None]*(max(spec['gpio'] for spec in pin_specs)+1)
+        for spec in pin_specs:
+            self._gpio_ids[spec['gpio']] = PiGPIO.Pin(**spec)
+            if spec['max_on'] is not None:
+                self._gpio_ids[spec['gpio']].watch = self._watch_pin
         # add commands to the SCPI parser
         nch = 40
         self.add_command('GPIO:MEASure:DIGital:DATA', getter=self.read_pin_value, channels=(None,None,None,nch))
-        self.add_command('GPIO:MEASure:DIGital:PULL', getter=self.get_pin_pullupdown, setter=self.set_pin_pullupdown, channels=(None,None,None,nch))
-        self.add_command('GPIO:SOURce:DIGital:DATA', getter=self.get_pin_value, setter=self.set_pin_value, channels=(None,None,None,nch))
-        self.add_command('GPIO:SOURce:DIGital:IO', getter=self.get_pin_direction, setter=self.set_pin_direction, channels=(None,None,None,nch))
-        self.add_command('GPIO:SOURce:DIGital:PULSe', setter=self.pulse_pin_value, channels=(None,None,None,nch))
-        self.add_command('GPIO:BUZZ', setter=self.buzz)
-
-    def _check_arg(self, info, value, options):
-        if isinstance(value, str):
-            value = value.upper()
-        if value not in options:
-            raise SCPIQueryError(info='%s must be one of [%s].'%(info, ', '.join([str(o) for o in options])))
-        if isinstance(options, dict):
-            return options[value]
+        self.add_command('GPIO:MEASure:DIGital:PULL', getter=self.get_pin_pullupdown, setter=self.set_pin_pullupdown, channels=(None,None,None,nch),
+                         args=[ArgEnum({'UP': GPIO.PUD_UP, 'DOWN': GPIO.PUD_DOWN, 'NONE': GPIO.PUD_OFF})])
+        self.add_command('GPIO:SOURce:DIGital:DATA', getter=self.get_pin_value, setter=self.set_pin_value, channels=(None,None,None,nch), args=[self._LEVEL],
+                         vector_setter=self.set_pin_values, stage=self.stage_pin_value)
+        self.add_command('GPIO:SOURce:DIGital:IO', getter=self.get_pin_direction, setter=self.set_pin_direction, channels=(None,None,None,nch),
+                         args=[ArgEnum({'IN': GPIO.IN, 'OUT': GPIO.OUT})])
+        self.add_command('GPIO:SOURce:DIGital:PULSe', setter=self.pulse_pin_value, channels=(None,None,None,nch), args=[self._LEVEL, self._DELAY])
+        self.add_command('GPIO:SOURce:DIGital:PULSe:BATCh', setter=self.pulse_pin_values)
+        self.add_command('GPIO:SOURce:DIGital:PORT', getter=self.get_port_value, setter=self.set_port_value, args=[self._MASK, self._MASK],
+                         stage=self.stage_port_value)
+        self.add_command('GPIO:MEASure:DIGital:PORT', getter=self.read_port_value, query_args=[self._MASK])
+        self.add_command('GPIO:SOURce:PWM:FREQuency', getter=self.get_pwm_frequency, setter=self.set_pwm_frequency, channels=(None,None,nch,None),
+                         args=[ArgFloat(0.1, 1e6, units = {'HZ': 1., 'KHZ': 1e3, 'MHZ': 1e6})])
+        self.add_command('GPIO:SOURce:PWM:DCYCle', getter=self.get_pwm_duty_cycle, setter=self.set_pwm_duty_cycle, channels=(None,None,nch,None),
+                         args=[ArgFloat(0., 100., units = {'PCT': 1.})])
+        self.add_command('GPIO:SOURce:PWM:STATe', getter=self.get_pwm_state, setter=self.set_pwm_state, channels=(None,None,nch,None), args=[ArgBool()])
+        self.add_command('GPIO:BUZZ', setter=self.buzz, args=[ArgInt(0, 27), None])
+        self.add_command('GPIO:SAFE', setter=self.safe_state)
+        self.add_command('GPIO:KEEPalive', getter=self.get_keepalive, setter=self.set_keepalive, args=[ArgFloat(0., 3600., units = self._SECONDS)])
+        self.add_command('GPIO:WATChdog:REASon', getter=self.get_watchdog_reason)
+        self.add_command('GPIO:STReam', getter=self.get_stream_subscription, setter=self.set_stream_subscription, args=[ArgBool()])
+        self.add_command('GPIO:STReam:STATe', getter=self.get_stream_state, setter=self.set_stream_state, args=[ArgBool()])
+        self.add_command('GPIO:STReam:MASK', getter=self.get_stream_mask, setter=self.set_stream_mask, args=[self._MASK])
+        self.add_command('GPIO:STReam:RATE', getter=self.get_stream_rate, setter=self.set_stream_rate,
+                         args=[ArgFloat(InputSampler.MIN_RATE, InputSampler.MAX_RATE, units = {'HZ': 1., 'KHZ': 1e3})])
+        self.add_command('GPIO:STReam:DECimation', getter=self.get_stream_decimation, setter=self.set_stream_decimation, args=[ArgInt(1, 65535)])
+        self.add_command('GPIO:STReam:FORMat', getter=self.get_stream_format, setter=self.set_stream_format,
+                         args=[ArgEnum({'RAW': FORMAT_RAW, 'RLE': FORMAT_RLE})])
+        self.add_command('GPIO:STReam:COUNt', getter=self.get_stream_count)
+        self.add_command('GPIO:STReam:DATA', getter=self.get_stream_data, query_args=[ArgInt(default = None)])
+        self.add_command('GPIO:FORMat:DATA', getter=self.get_data_format, setter=self.set_data_format, args=[ArgEnum({'ASCii': 'ASCII', 'RLE': 'RLE'})])
+        self.add_command('GPIO:STATe', getter=self.get_state)
+        self.add_command('GPIO:STATe:SAVE', setter=self.save_state, args=[ArgInt(0, self.NUM_STATE_SLOTS-1)])
+        self.add_command('GPIO:STATe:RECall', setter=self.recall_state, args=[ArgInt(0, self.NUM_STATE_SLOTS-1)])
+        self.add_command('GPIO:STATe:CATalog', getter=self.get_state_catalog)
+        self.add_command('SYSTem:RELoad', setter=self.reload)
+        self.add_command('SYSTem:COMMunicate:QUEue', getter=self.get_queue_stats, query_args=[ArgEnum(self.PRIORITY_NAMES, default = None)])
+        self._add_aliases(aliases)
+        if self._switches:
+            nsw = len(self._switches)
+            self.add_command('GPIO:SWITch:POSition', getter=self.get_switch_position, setter=self.set_switch_position, channels=[None,nsw,None], args=[self._INT])
+            self.add_command('GPIO:SWITch:APPLy', setter=self.set_switch_positions)
+            self.add_command('GPIO:SWITch:BUSY', getter=self.get_switch_busy, channels=[None,nsw,None])
+            self.add_command('GPIO:SWITch:DWELl', getter=self.get_switch_dwell, setter=self.set_switch_dwell, channels=[None,nsw,None],
+                             args=[ArgFloat(0., 10., units = self._SECONDS)])
+            self.add_command('GPIO:SWITch:PULSe', getter=self.get_switch_pulse, setter=self.set_switch_pulse, channels=[None,nsw,None],
+                             args=[self._DELAY])
+        self._state_slots = self._load_state_slots()
+        self.save_command_table(self.command_cache_path, cache_key)
+
+    def _command_table_key(self):
+        ''' hash of the files the command table is built from '''
+        digest = hashlib.sha1()
+        for path in (inspect.getfile(SCPIBase), __file__, self.pin_map_path):
+            try:
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+            except OSError:
+                digest.update(path.encode())
+        return digest.hexdigest()
+
+    def reload(self):
+        '''
+            re-import the interface modules and replace this instance with a new one
+
+            the new instance takes over the hardware state, see adopt. clients stay connected.
+        '''
+        if self.reload_handler is None:
+            raise SCPIDeviceError(info = 'reload is not supported by this server.')
+        try:
+            self.reload_handler()
+        except Exception as err:
+            raise SCPIExecutionError(info = 'reload failed: %s'%err)
+
+    def get_queue_stats(self, priority):
+        '''
+            return queued commands, executed commands, mean and longest wait in seconds
+            of a priority level, or of all levels if priority is omitted
+        '''
+        if self.queue_stats is None:
+            raise SCPIDeviceError(info = 'command queues are not used by this server.')
+        return '%d,%d,%g,%g'%self.queue_stats(priority)
+
+    def adopt(self, old):
+        '''
+            take over the state of the instance old that has been driving the hardware
+
+            pending pin edges of old are written first, then its background threads
+            are stopped. the shadow state of all pins that are still defined is copied
+            without touching the hardware, as are switch positions, status registers,
+            keepalives, remaining watchdog deadlines and the sampler configuration.
+        '''
+        running = old._sampler.running
+        old._sampler.stop()
+        old._scheduler.stop()
+        old._watchdog.stop()
+        pending = old._watchdog.pending()
+        with old._lock:
+            for pin in self._gpio_ids:
+                if (pin is None) or (pin.id >= len(old._gpio_ids)) or (old._gpio_ids[pin.id] is None):
+                    continue
+                old_pin = old._gpio_ids[pin.id]
+                pin.mode, pin.pud, pin.val, pin._configured = old_pin.mode, old_pin.pud, old_pin.val, old_pin._configured
+                pin.pwm = old_pin.pwm
+            old_switches = dict((switch.name, switch) for switch in old._switches)
+            for switch in self._switches:
+                if switch.name in old_switches:
+                    old_switch = old_switches[switch.name]
+                    switch.position = switch.target = old_switch.position
+                    switch.dwell, switch.pulse = old_switch.dwell, old_switch.pulse
+            for name in ('_operation_status', '_operation_summary_mask', '_questionable_status', '_questionable_summary_mask', 'watchdog_reason',
+                         '_transaction_epoch'):
+                setattr(self, name, getattr(old, name))
+            self._operation_status &= ~self.OPER_SETTLING
+            self._keepalive = dict(old._keepalive)
+            self._subscribers = dict(old._subscribers)
+            for name in ('mask', 'rate', 'decimation', 'format', 'frame_samples'):
+                setattr(self._sampler, name, getattr(old._sampler, name))
+        for (kind, source), remaining in pending.items():
+            if (kind == 'connection') and (source in self._keepalive):
+                self._watchdog.arm((kind, source), remaining)
+            elif (kind == 'pin') and (source < len(self._gpio_ids)) and (self._gpio_ids[source] is not None) \
+                    and (self._gpio_ids[source].max_on is not None):
+                self._watchdog.arm((kind, source), remaining)
+        for pin in self._gpio_ids:
+            if (pin is not None) and (pin.watch is not None):
+                self._watch_pin(pin)
+        if running:
+            self._sampler.start()
+
+    def initialise(self):
+        '''
+            set up every pin in its reset configuration
+
+            pins are otherwise set up on first use. the server calls this in the
+            background after it has started listening. pins sharing a configuration
+            are set up with one call, so the chardev backend requests all lines at once.
+        '''
+        pins = [pin for pin in self._gpio_ids if pin is not None]
+        with contextlib.ExitStack() as stack:
+            for pin in pins:
+                stack.enter_context(pin.lock)
+            groups = {}
+            for pin in pins:
+                if pin.setup and not pin._configured:
+                    groups.setdefault((pin.mode, None if pin.mode == GPIO.OUT else pin.pud), []).append(pin)
+            for (mode, pud), group in groups.items():
+                if pud is None:
+                    GPIO.setup([pin.id for pin in group], mode)
+                else:
+                    GPIO.setup([pin.id for pin in group], mode, pull_up_down=pud)
+            for pin in pins:
+                pin._configured = True
 
     def buzz(self, pwm_channel, file_name):
         #Don't include path in CSV
@@ -149,13 +459,11 @@ class PiGPIO(SCPIBase):
         if os.path.exists(file_path):
             subprocess.Popen([f'python', f'{os.path.dirname(os.path.realpath(__file__))}/buzzer.py', str(pwm_channel), file_path])
 
-    def set_pin_pullupdown(self, value, channels):
+    def set_pin_pullupdown(self, pud, channels):
         '''
             control pull-up and pull-down resistors of a pin
         '''
-        pin = self._gpio_ids[channels[-1]]
-        pud_map = {'UP': GPIO.PUD_UP, 'DOWN': GPIO.PUD_DOWN, 'NONE': GPIO.PUD_OFF}
-        pud = self._check_arg('PULL', value, pud_map)
+        pin = self._pin(channels[-1])
         try:
             pin.set_pud(pud)
         except ValueError as err:
@@ -165,17 +473,14 @@ class PiGPIO(SCPIBase):
         '''
             retrieve setting of the pull-up and pull-down resistors of a pin
         '''
-        pin = self._gpio_ids[channels[-1]]
-        pud_map = {GPIO.PUD_UP: 'UP', GPIO.PUD_DOWN: 'DOWN', GPIO.PUD_OFF: 'NONE'}
-        return pud_map[pin.pud]
+        pin = self._pin(channels[-1])
+        return self._PUD_NAMES[pin.pud]
 
-    def set_pin_direction(self, value, channels):
+    def set_pin_direction(self, mode, channels):
         '''
             switch pin between input and output
         '''
-        pin = self._gpio_ids[channels[-1]]
-        mode_map = {'IN': GPIO.IN, 'OUT': GPIO.OUT}
-        mode = self._check_arg('direction', value, mode_map)
+        pin = self._pin(channels[-1])
         try:
             pin.set_mode(mode)
         except ValueError as err:
@@ -185,15 +490,79 @@ class PiGPIO(SCPIBase):
         '''
             return direction setting of a pin
         '''
-        pin = self._gpio_ids[channels[-1]]
-        mode_map = {GPIO.IN: 'IN', GPIO.OUT: 'OUT', GPIO.I2C: 'I2C', GPIO.PWM: 'PWM', GPIO.SERIAL: 'SERIAL'}
-        return mode_map[pin.mode]
+        pin = self._pin(channels[-1])
+        return self._DIRECTION_NAMES[pin.mode]
+
+    def _pwm_output(self, pin):
+        '''
+            return the PWM output of a pin, switching the pin to PWM mode on first use
+
+            hardware PWM is used on GPIO12/13/18/19 if the pwm chip exists and the pin
+            is left to the overlay (setup false in the pin map), software PWM otherwise.
+            GPIO12/18 and GPIO13/19 share a channel, only one pin of a pair can use it.
+        '''
+        if pin.pwm is None:
+            channel = HARDWARE_CHANNELS.get(pin.id)
+            try:
+                if (not pin.setup) and (channel is not None) and SysfsPWM.available(channel, self.pwm_chip_path):
+                    for other in self._gpio_ids:
+                        if (other is not None) and (other is not pin) and (other.pwm is not None) and other.pwm.hardware and (HARDWARE_CHANNELS.get(other.id) == channel):
+                            raise SCPIDeviceError(info = 'pwm channel %d is used by pin %d.'%(channel, other.id))
+                    pwm = PWMOutput(SysfsPWM(channel, PWMOutput.DEFAULT_FREQUENCY, self.pwm_chip_path), hardware = True)
+                elif pin.mode_fix or pin.val_fix:
+                    raise SCPIDeviceError(info = 'pin %d can not be used for PWM.'%pin.id)
+                else:
+                    pin.mode = GPIO.PWM
+                    pin._setup()
+                    pwm = PWMOutput(GPIO.PWM(pin.id, PWMOutput.DEFAULT_FREQUENCY))
+            except (OSError, RuntimeError) as err:
+                raise SCPIExecutionError(info = 'unable to start PWM on pin %d: %s'%(pin.id, err))
+            pin.mode = GPIO.PWM
+            pin.pwm = pwm
+        return pin.pwm
+
+    def set_pwm_frequency(self, frequency, channels):
+        '''
+            set the PWM frequency of a pin in Hz
+        '''
+        pin = self._pin(channels[-2])
+        with pin.lock:
+            self._pwm_output(pin).set_frequency(frequency)
+
+    def get_pwm_frequency(self, channels):
+        pin = self._pin(channels[-2])
+        return PWMOutput.DEFAULT_FREQUENCY if pin.pwm is None else pin.pwm.frequency
+
+    def set_pwm_duty_cycle(self, duty_cycle, channels):
+        '''
+            set the PWM duty cycle of a pin in percent
+        '''
+        pin = self._pin(channels[-2])
+        with pin.lock:
+            self._pwm_output(pin).set_duty_cycle(duty_cycle)
+
+    def get_pwm_duty_cycle(self, channels):
+        pin = self._pin(channels[-2])
+        return 0. if pin.pwm is None else pin.pwm.duty_cycle
+
+    def set_pwm_state(self, enabled, channels):
+        '''
+            start or stop the PWM output of a pin. the pin stays in PWM mode until
+            its direction is set with GPIO:SOURce:DIGital:IO.
+        '''
+        pin = self._pin(channels[-2])
+        with pin.lock:
+            self._pwm_output(pin).set_enabled(enabled)
+
+    def get_pwm_state(self, channels):
+        pin = self._pin(channels[-2])
+        return int((pin.pwm is not None) and pin.pwm.enabled)
 
     def read_pin_value(self, channels):
         '''
             read pin state
         '''
-        pin = self._gpio_ids[channels[-1]]
+        pin = self._pin(channels[-1])
         return pin.get_val() 
         
     
@@ -201,44 +570,580 @@ class PiGPIO(SCPIBase):
         '''
             return last set pin state
         '''
-        pin = self._gpio_ids[channels[-1]]
+        pin = self._pin(channels[-1])
         return pin.val 
     
     def set_pin_value(self, value, channels):
         '''
             write pin state
         '''
-        pin = self._gpio_ids[channels[-1]]
-        value_map = {'0': False, '1': True, 'LOW': False, 'HIGH': True, 'FALSE': False, 'TRUE': True}
-        value = self._check_arg('DATA', value, value_map)
+        pin = self._pin(channels[-1])
         try:
             pin.set_val(value)
         except ValueError as err:
             raise SCPIDeviceError(info = err)
 
+    def stage_pin_value(self, transaction, value, channels):
+        '''
+            check that a pin is a writable output and record its new value in a transaction
+        '''
+        pin = self._pin(channels[-1])
+        if (pin.mode != GPIO.OUT) or (pin.val_fix and (bool(pin.val) != value)):
+            raise SCPIDeviceError(info = 'pin %d is not a writable output.'%pin.id)
+        transaction.changes[pin.id] = value
+
+    def commit_transaction(self, transaction):
+        '''
+            write the pins staged by a transaction with a single hardware call
+
+            only pins whose value changes are written. the pins are checked again
+            before the write, nothing is written if one of them is no longer a
+            writable output.
+        '''
+        with self._lock:
+            if self.transaction_discarded(transaction):
+                raise SCPIExecutionError(info = 'transaction discarded by a reset or safe state.')
+            changed = [gpio for gpio, value in transaction.changes.items() if bool(self._pin(gpio).val) != value]
+            mask = sum(1<<gpio for gpio in changed)
+            if mask:
+                self.set_port_value(mask, sum(1<<gpio for gpio in changed if transaction.changes[gpio]))
+
+    def set_pin_values(self, value, channels):
+        '''
+            write the same state to all pins of a channel list with a single hardware call
+        '''
+        mask = 0
+        for pin_id in channels[-1]:
+            mask |= 1<<self._pin(pin_id).id
+        try:
+            self.write_port(mask, mask if value else 0)
+        except ValueError as err:
+            raise SCPIDeviceError(info = err)
+
     def pulse_pin_value(self, value, delay, channels):
         '''
             pulse pin from current value to target value and return to current value after a set delay
+
+            the pin is not restored if the safe state was driven during the pulse.
         '''
-        pin = self._gpio_ids[channels[-1]]
-        value_map = {'0': False, '1': True, 'LOW': False, 'HIGH': True, 'FALSE': False, 'TRUE': True}
-        value = self._check_arg('DATA', value, value_map)
+        pin = self._pin(channels[-1])
         DELAY_CORRECTION = -190e-6
+        cancelled = threading.Event()
+        cancel = cancelled.set
         try:
-            delay = float(delay)
-            if(delay<200e-6) or (delay>2.):
-                raise SCPIQueryError(info='delay must be between 200us and 2s.')
-        except ValueError:
-            raise SCPIQueryError(info='unable to convert "%s" to float.'%delay)
-        try:
-            cur = pin.val
-            pin.set_val(value)
-            time.sleep(delay+DELAY_CORRECTION)
-            pin.set_val(cur)
+            with self._lock:
+                cur = pin.val
+                pin.set_val(value)
+                self._pulses.add(cancel)
+            try:
+                with blocking(), tracer.span('sleep', 'io'):
+                    time.sleep(delay+DELAY_CORRECTION)
+            finally:
+                with self._lock:
+                    self._pulses.discard(cancel)
+                    if not cancelled.is_set():
+                        pin.set_val(cur)
         except ValueError as err:
             raise SCPIDeviceError(info = err)
         
 
+    def pulse_pin_values(self, *args):
+        '''
+            pulse several pins at once
+
+            the arguments are pin,value,delay triples. all pulses start with a single
+            write and run on a common timeline, so the command takes as long as the
+            longest pulse. the pins must be distinct outputs.
+        '''
+        if (not args) or (len(args)%3):
+            raise SCPIQueryError(info='arguments must be pin,value,delay triples.')
+        steps_list = []
+        pin_ids = set()
+        with self._lock:
+            for idx in range(0, len(args), 3):
+                pin = self._pin(self._INT(args[idx]))
+                value = self._LEVEL(args[idx+1])
+                delay = self._DELAY(args[idx+2])
+                if pin.id in pin_ids:
+                    raise SCPIQueryError(info='pin %d is pulsed more than once.'%pin.id)
+                if (pin.mode != GPIO.OUT) or pin.val_fix:
+                    raise SCPIDeviceError(info='pin %d is not a writable output.'%pin.id)
+                pin_ids.add(pin.id)
+                steps_list.append([(0., {pin.id: value}), (delay, {pin.id: pin.val})])
+            start = time.perf_counter()
+            jobs = [self._scheduler.submit(steps, start = start) for steps in steps_list]
+            cancel = lambda: [self._scheduler.cancel(job) for job in jobs]
+            self._pulses.add(cancel)
+        try:
+            with blocking():
+                for job in jobs:
+                    job.finished.wait()
+        finally:
+            with self._lock:
+                self._pulses.discard(cancel)
+
+    def _pin(self, pin_id):
+        ''' return the pin with BCM number pin_id '''
+        pin = self._gpio_ids[pin_id] if pin_id < len(self._gpio_ids) else None
+        if pin is None:
+            raise SCPIDeviceError(info = 'pin %d is not available.'%pin_id)
+        return pin
+
+    def _add_aliases(self, aliases):
+        '''
+            add commands for the aliases of the pin map
+
+            aliases sharing the same mnemonics, e.g. GPIO:SW1:POS and GPIO:SW2:POS, 
+            are registered as a single command with channel numbers. the pin is
+            looked up from the mnemonics and channel numbers at execution time.
+        '''
+        self._aliases = {}
+        alias_channels = {}
+        for name, gpio in aliases.items():
+            for mnemonics, channels, _, _ in self.parse(name):
+                key = tuple(mnemonics)
+                self._aliases[(key, tuple(channels))] = gpio
+                max_channels = alias_channels.setdefault(key, [None]*len(channels))
+                for idx, channel in enumerate(channels):
+                    if channel is not None:
+                        max_channels[idx] = max(channel, max_channels[idx] or 0)
+        for key, max_channels in alias_channels.items():
+            getter = lambda channels, key=key: self.get_alias_value(key, channels)
+            setter = lambda value, channels, key=key: self.set_alias_value(key, value, channels)
+            stage = lambda transaction, value, channels, key=key: self.stage_pin_value(transaction, value, [self._alias_pin(key, channels)])
+            self.add_command(':'.join(key), getter=getter, setter=setter, channels=max_channels, args=[self._LEVEL], stage=stage)
+
+    def _alias_pin(self, key, channels):
+        gpio = self._aliases.get((key, tuple(channels)))
+        if gpio is None:
+            raise SCPICommandError(info = 'undefined alias %s with channels %s.'%(':'.join(key), channels))
+        return gpio
+
+    def get_alias_value(self, key, channels):
+        '''
+            read an aliased pin. inputs are read from the hardware, outputs return the last set value
+        '''
+        gpio = self._alias_pin(key, channels)
+        if self._pin(gpio).mode == GPIO.IN:
+            return self.read_pin_value(channels=[gpio])
+        return self.get_pin_value(channels=[gpio])
+
+    def set_alias_value(self, key, value, channels):
+        ''' write an aliased pin '''
+        self.set_pin_value(value, channels=[self._alias_pin(key, channels)])
+
+    def _switch(self, channels):
+        return self._switches[channels[1]-1]
+
+    def _write_levels(self, levels):
+        ''' write a {pin: level} dict with a single hardware call '''
+        with self._lock:
+            self._write_pins([self._pin(gpio) for gpio in levels], list(levels.values()))
+
+    def _switch_done(self, switch, job):
+        ''' clear the settling flag once no switch is moving '''
+        with self._lock:
+            switch.complete(job)
+            if not any(s.busy for s in self._switches):
+                self._operation_status &= ~self.OPER_SETTLING
+
+    def set_switch_position(self, value, channels):
+        '''
+            move a switch to a new position
+
+            the break-before-make or pulse sequence runs in the background. the
+            SETTLING bit of the operation status register is set until all
+            switches have reached their positions.
+        '''
+        self._start_switches([(self._switch(channels), value)])
+
+    def set_switch_positions(self, *args):
+        '''
+            move several switches at once
+
+            the arguments are switch,position pairs. the sequences of all switches
+            share a common timeline, so coincident edges are written together and
+            the command takes as long as the slowest switch.
+        '''
+        if (not args) or (len(args)%2):
+            raise SCPIQueryError(info='arguments must be switch,position pairs.')
+        moves = []
+        for idx in range(0, len(args), 2):
+            number = self._INT(args[idx])
+            if (number < 1) or (number > len(self._switches)):
+                raise SCPIQueryError(info='switch number must be between 1 and %d.'%len(self._switches))
+            moves.append((self._switches[number-1], args[idx+1]))
+        self._start_switches(moves)
+
+    def _start_switches(self, moves):
+        ''' validate all (switch, position) moves, then start them with a common start time '''
+        positions = []
+        for switch, position in moves:
+            if isinstance(position, str):
+                position = self._INT(position)
+            if position not in switch.positions:
+                raise SCPIQueryError(info='position of switch %s must be one of [%s].'%(switch.name, ', '.join(str(p) for p in sorted(switch.positions))))
+            positions.append(position)
+        if len(set(switch for switch, _ in moves)) != len(moves):
+            raise SCPIQueryError(info='a switch is moved more than once.')
+        with self._lock:
+            self._operation_status |= self.OPER_SETTLING
+            start = time.perf_counter()
+            for (switch, _), position in zip(moves, positions):
+                levels = [self._pin(gpio).val for gpio in switch.pins]
+                switch.start(position, levels, self._scheduler, self._switch_done, start)
+
+    def get_switch_position(self, channels):
+        '''
+            return the last position reached by a switch, 0 if unknown
+        '''
+        return self._switch(channels).position
+
+    def get_switch_busy(self, channels):
+        '''
+            return True while a switch is moving
+        '''
+        return self._switch(channels).busy
+
+    def set_switch_dwell(self, value, channels):
+        '''
+            set the settling time after each break, make or pulse of a switch
+        '''
+        try:
+            self._switch(channels).set_dwell(value)
+        except ValueError as err:
+            raise SCPIQueryError(info = err)
+
+    def get_switch_dwell(self, channels):
+        return self._switch(channels).dwell
+
+    def set_switch_pulse(self, value, channels):
+        '''
+            set the coil pulse length of a latching switch
+        '''
+        try:
+            self._switch(channels).set_pulse(value)
+        except ValueError as err:
+            raise SCPIQueryError(info = err)
+
+    def get_switch_pulse(self, channels):
+        return self._switch(channels).pulse
+
+    def _write_pins(self, pins, values):
+        '''
+            write the values of several output pins with a single hardware call
+            and update their shadow state
+        '''
+        if not pins:
+            return
+        with contextlib.ExitStack() as stack:
+            for pin in sorted(pins, key=lambda pin: pin.id):
+                stack.enter_context(pin.lock)
+            for pin in pins:
+                pin._ensure_setup()
+            with tracer.span('GPIO.output', 'io', pins = len(pins)):
+                GPIO.output([pin.id for pin in pins], [int(value) for value in values])
+            for pin, value in zip(pins, values):
+                pin.val = value
+                if pin.watch is not None:
+                    pin.watch(pin)
+
+    def _port_pins(self, mask):
+        ''' return the pins selected by a bit mask of BCM numbers '''
+        pins = [pin for pin in self._gpio_ids if (pin is not None) and (mask & (1<<pin.id))]
+        if mask >> len(self._gpio_ids) or (sum(1<<pin.id for pin in pins) != mask):
+            raise ValueError('mask 0x%x selects unavailable pins.'%mask)
+        return pins
+
+    def write_port(self, mask, bits):
+        '''
+            write the output pins selected by mask with a single hardware call
+
+            Input:
+                mask, bits (int) - bit n selects/sets GPIOn
+        '''
+        pins = self._port_pins(mask)
+        for pin in pins:
+            if (pin.mode != GPIO.OUT) or pin.val_fix:
+                raise ValueError('pin %d is not a writable output.'%pin.id)
+        self._write_pins(pins, [bool(bits & (1<<pin.id)) for pin in pins])
+
+    def read_port(self, mask):
+        '''
+            read the pins selected by mask from the hardware
+
+            Output:
+                int - bit n holds the level of GPIOn
+        '''
+        pins = self._port_pins(mask)
+        bits = sum(1<<pin.id for pin in pins if pin.val_fix and pin.val_rst)
+        pins = [pin for pin in pins if not pin.val_fix]
+        if hasattr(GPIO, 'inputs'):
+            # the chardev backend reads all lines with a single ioctl
+            with contextlib.ExitStack() as stack:
+                for pin in sorted(pins, key=lambda pin: pin.id):
+                    stack.enter_context(pin.lock)
+                for pin in pins:
+                    pin._ensure_setup()
+                with tracer.span('GPIO.inputs', 'io', pins = len(pins)):
+                    values = GPIO.inputs([pin.id for pin in pins]) if pins else []
+        else:
+            values = [pin.get_val() for pin in pins]
+        for pin, value in zip(pins, values):
+            if value:
+                bits |= 1<<pin.id
+        return bits
+
+    def set_port_value(self, mask, bits):
+        '''
+            write several output pins at once, mask and bits are bit masks of BCM numbers
+        '''
+        try:
+            self.write_port(mask, bits)
+        except ValueError as err:
+            raise SCPIDeviceError(info = err)
+
+    def stage_port_value(self, transaction, mask, bits):
+        ''' record the new values of the output pins selected by mask in a transaction '''
+        try:
+            pins = self._port_pins(mask)
+        except ValueError as err:
+            raise SCPIDeviceError(info = err)
+        for pin in pins:
+            self.stage_pin_value(transaction, bool(bits & (1<<pin.id)), [pin.id])
+
+    def get_port_value(self):
+        '''
+            return the last set values of all output pins as a bit mask
+        '''
+        return sum(1<<pin.id for pin in self._gpio_ids if (pin is not None) and pin.val)
+
+    def read_port_value(self, mask):
+        '''
+            read several pins at once, mask is a bit mask of BCM numbers
+        '''
+        try:
+            return self.read_port(mask)
+        except ValueError as err:
+            raise SCPIDeviceError(info = err)
+
+    def _publish_frame(self, frame):
+        ''' queue a sampler frame for all subscribed clients, dropping clients that have gone or stalled '''
+        data = block_pack(frame) + b'\n'
+        for connection, writer in list(self._subscribers.items()):
+            if not writer.send(data):
+                self._subscribers.pop(connection, None)
+
+    def _stream_config(self, setter):
+        ''' change a setting of the sampler, which is restarted if it is running '''
+        running = self._sampler.running
+        self._sampler.stop()
+        try:
+            setter()
+        finally:
+            if running:
+                self._sampler.start()
+
+    def set_stream_subscription(self, value):
+        '''
+            subscribe the current client to the frames of the input sampler
+
+            frames are pushed to the client as definite length binary blocks followed
+            by a line feed, so a separate connection should be used for streaming.
+            every subscriber has its own writer thread, see FrameWriter.
+        '''
+        writer = self._subscribers.pop(self.session.connection, None)
+        if writer is not None:
+            writer.close()
+        if value:
+            if self.session.push is None:
+                raise SCPIDeviceError(info = 'streaming is not supported by this transport.')
+            self._subscribers[self.session.connection] = FrameWriter(self.session.push)
+
+    def get_stream_subscription(self):
+        return self.session.connection in self._subscribers
+
+    def set_stream_state(self, value):
+        '''
+            start or stop the input sampler
+        '''
+        if value:
+            self._sampler.start()
+        else:
+            self._sampler.stop()
+
+    def get_stream_state(self):
+        return self._sampler.running
+
+    def set_stream_mask(self, mask):
+        '''
+            select the sampled pins via a bit mask of BCM numbers
+        '''
+        try:
+            InputSampler.check_mask(mask)
+            self._port_pins(mask)
+        except ValueError as err:
+            raise SCPIDeviceError(info = err)
+        self._stream_config(lambda: setattr(self._sampler, 'mask', mask))
+
+    def get_stream_mask(self):
+        return self._sampler.mask
+
+    def set_stream_rate(self, rate):
+        '''
+            set the sample rate in Hz
+        '''
+        self._stream_config(lambda: setattr(self._sampler, 'rate', rate))
+
+    def get_stream_rate(self):
+        return self._sampler.rate
+
+    def set_stream_decimation(self, decimation):
+        '''
+            keep only every n-th sample
+        '''
+        self._stream_config(lambda: setattr(self._sampler, 'decimation', decimation))
+
+    def get_stream_decimation(self):
+        return self._sampler.decimation
+
+    def set_stream_format(self, fmt):
+        '''
+            select raw samples or run-length encoded samples for the stream frames
+        '''
+        self._stream_config(lambda: setattr(self._sampler, 'format', fmt))
+
+    def get_stream_format(self):
+        return 'RLE' if self._sampler.format == FORMAT_RLE else 'RAW'
+
+    def get_stream_count(self):
+        '''
+            return the total number of samples taken by the sampler
+        '''
+        return self._sampler.count
+
+    def get_stream_data(self, start = None):
+        '''
+            return the samples from index start up to the latest one
+
+            only the samples still held by the ring buffer are returned. without
+            start, the whole ring buffer is returned. the transfer format is
+            selected via GPIO:FORMat:DATA.
+        '''
+        stop = self._sampler.count
+        if start is None:
+            start = stop - self._sampler.capacity
+        start = min(max(start, stop - self._sampler.capacity, 0), stop)
+        samples = self._sampler.samples(start, stop)
+        if self.session.data_format == 'RLE':
+            return block_pack(encode_transitions(samples, start, self._sampler.decimation/self._sampler.rate))
+        return '%d,%s'%(start, ','.join(str(sample) for sample in samples))
+
+    def set_data_format(self, value):
+        '''
+            select the transfer format of buffer queries
+
+            ASCii returns the index of the first sample followed by comma-separated
+            samples, RLE returns the transitions of gpio_codec in a binary block.
+        '''
+        self.session.data_format = value
+
+    def get_data_format(self):
+        return 'ASC' if self.session.data_format == 'ASCII' else self.session.data_format
+
+    def _snapshot(self):
+        ''' return mode, pull-up/down and value of all pins from the shadow state '''
+        return dict((str(pin.id), [self._MODE_NAMES[pin.mode], self._PUD_NAMES[pin.pud], int(pin.val)])
+                    for pin in self._gpio_ids if (pin is not None) and (pin.mode in self._MODE_NAMES))
+
+    def _load_state_slots(self):
+        ''' read saved state slots from disk, ignoring a missing or corrupt file '''
+        try:
+            with open(self.states_path) as state_file:
+                slots = json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+        return slots if isinstance(slots, dict) else {}
+
+    def _store_state_slots(self):
+        '''
+            write state slots to disk atomically
+
+            the slots are written to a temporary file in the same directory which
+            then replaces the slot file, so a crash never leaves a truncated file behind.
+        '''
+        directory = os.path.dirname(self.states_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.gpio_states', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(self._state_slots, tmp_file)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, self.states_path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    def get_state(self):
+        '''
+            return the current state of the bank as pin,mode,pull,value quadruples
+        '''
+        snapshot = self._snapshot()
+        return ','.join('%s,%s,%s,%d'%(pin_id, mode, pud, val) for pin_id, (mode, pud, val) in sorted(snapshot.items(), key=lambda item: int(item[0])))
+
+    def get_state_catalog(self):
+        '''
+            return the numbers of all occupied state slots
+        '''
+        return ','.join(sorted(self._state_slots, key=int))
+
+    def save_state(self, slot):
+        '''
+            store mode, pull-up/down and value of all pins in a state slot
+        '''
+        slot = str(slot)
+        self._state_slots[slot] = self._snapshot()
+        try:
+            self._store_state_slots()
+        except OSError as err:
+            raise SCPIDeviceError(info = err)
+
+    def recall_state(self, slot):
+        '''
+            restore the state of all pins from a state slot
+
+            only differences between the stored and the current shadow state are
+            applied. pins are reconfigured with one setup call each and all output
+            values are written with a single call. nothing is changed if the
+            stored state conflicts with a fixed pin.
+        '''
+        slot = str(slot)
+        if slot not in self._state_slots:
+            raise SCPIDeviceError(info = 'state slot %s is empty.'%slot)
+        # validate the complete snapshot before touching any hardware
+        changes = []
+        for pin_id, (mode, pud, val) in self._state_slots[slot].items():
+            pin_id = int(pin_id)
+            pin = self._pin(pin_id)
+            mode, pud, val = self._MODE_VALUES[mode], self._PUD_VALUES[pud], bool(val)
+            if (pin.mode_fix and (pin.mode != mode)) or (pin.pud_fix and (pin.pud != pud)) or (pin.val_fix and (pin.val != val)):
+                raise SCPIDeviceError(info = 'state slot %s conflicts with fixed pin %d.'%(slot, pin_id))
+            changes.append((pin, mode, pud, val))
+        # reconfigure pins, then write all changed output values at once
+        with self._lock:
+            out_pins, out_values = [], []
+            for pin, mode, pud, val in changes:
+                reconfigured = (pin.mode != mode) or (pin.pud != pud)
+                if reconfigured:
+                    pin.configure(mode, pud)
+                if (mode == GPIO.OUT) and (reconfigured or (pin.val != val)) and not pin.val_fix:
+                    out_pins.append(pin)
+                    out_values.append(val)
+                else:
+                    pin.val = val
+            self._write_pins(out_pins, out_values)
+
     def get_serial(self):
         serial = '?'
         try:
@@ -255,9 +1160,93 @@ class PiGPIO(SCPIBase):
         '''
             reset the instrument
             
-            set all pins to input (high impedance), so no power is sourced or sunk
+            drive all outputs into their safe state, so no coil stays energised
+        '''
+        self.safe_state()
+
+    def safe_state(self):
+        '''
+            stop all pulses, switch moves and PWM outputs and write the safe level
+            of every output with a single call
+
+            discards the open transactions of all clients, their commits would undo
+            the safe state.
         '''
-        pass
+        with self._lock:
+            self.discard_transactions()
+            for cancel in list(self._pulses):
+                cancel()
+            for switch in self._switches:
+                switch.cancel(self._scheduler)
+            self._operation_status &= ~self.OPER_SETTLING
+            for pin in self._gpio_ids:
+                if (pin is not None) and (pin.pwm is not None):
+                    pin.pwm.set_enabled(False)
+            pins = [pin for pin in self._gpio_ids if (pin is not None) and pin.setup and pin._configured
+                    and (pin.mode == GPIO.OUT) and not pin.val_fix]
+            self._write_pins(pins, [pin.safe for pin in pins])
+
+    def _watch_pin(self, pin):
+        ''' start the on-time deadline when a pin leaves its safe level '''
+        if pin.val != pin.safe:
+            self._watchdog.arm(('pin', pin.id), pin.max_on, restart = False)
+        else:
+            self._watchdog.disarm(('pin', pin.id))
+
+    def _watchdog_trip(self, key):
+        '''
+            drive the safe state and report the trip in the questionable status register
+        '''
+        kind, source = key
+        if kind == 'pin':
+            reason = 'pin %d exceeded its maximum on-time'%source
+        else:
+            name = ':'.join(str(part) for part in source) if isinstance(source, tuple) else str(source)
+            reason = 'keepalive of connection %s %s'%(name, 'closed' if source not in self._keepalive else 'expired')
+        with self._lock:
+            self.safe_state()
+            self.watchdog_reason = reason
+            self._questionable_status |= self.QUES_USER0
+
+    def set_keepalive(self, timeout):
+        '''
+            enable the keepalive of the current connection
+
+            the safe state is driven if the connection is closed or sends no
+            command for timeout seconds. a timeout of 0 disables the keepalive.
+        '''
+        if self.session.connection is None:
+            raise SCPIDeviceError(info = 'keepalive requires a network connection.')
+        if timeout:
+            self._keepalive[self.session.connection] = timeout
+            self._watchdog.arm(('connection', self.session.connection), timeout)
+        else:
+            self._keepalive.pop(self.session.connection, None)
+            self._watchdog.disarm(('connection', self.session.connection))
+
+    def get_keepalive(self):
+        return self._keepalive.get(self.session.connection, 0.)
+
+    def get_watchdog_reason(self):
+        '''
+            return the cause of the last watchdog trip
+        '''
+        return '"%s"'%self.watchdog_reason
+
+    def connection_active(self, connection):
+        ''' restart the keepalive of a connection, called for every command line received '''
+        timeout = self._keepalive.get(connection)
+        if timeout is not None:
+            self._watchdog.arm(('connection', connection), timeout)
+
+    def connection_closed(self, connection):
+        ''' trip the watchdog if a connection with an active keepalive is closed '''
+        writer = self._subscribers.pop(connection, None)
+        if writer is not None:
+            writer.close()
+        if self._keepalive.pop(connection, None) is not None:
+            self._watchdog.disarm(('connection', connection))
+            self._watchdog_trip(('connection', connection))
     
     
 if __name__ == '__main__':
@@ -0,0 +1,336 @@
+#SCPI gateway that fans the commands of a line out to the servers of several Pis
+
+from scpi_base import SCPIBase, ChannelList, _mnemonic_forms
+from socketserver import TCPServer, ThreadingTCPServer
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import socket
+import threading
+import scpi_event as se
+from pi_server import PiGPIOHandler
+from tracing import tracer
+
+class BackendLink(object):
+    '''
+        persistent connection of one gateway client to one backend server
+
+        all lines of a batch are sent with a single write and the replies are read
+        afterwards (pipelining). the backend answers every line containing a '?',
+        so replies are matched to the queries in order.
+    '''
+    def __init__(self, name, address, timeout = 5.):
+        '''
+            Input:
+                name (string) - backend name used in error messages
+                address (tuple) - host and port of the backend server
+                timeout (float) - seconds to wait for the connection and each reply
+        '''
+        self.name = name
+        self.address = address
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._file = sock.makefile('rb')
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = None
+            self._file = None
+
+    def _read_reply(self):
+        ''' read one reply line, definite length blocks may contain line feeds '''
+        reply = self._file.readline()
+        if reply[:1] == b'#':
+            try:
+                digits = int(reply[1:2])
+                end = 2+digits+int(reply[2:2+digits])
+            except ValueError:
+                end = 0
+            while reply and (len(reply) <= end):
+                more = self._file.readline()
+                if not more:
+                    break
+                reply += more
+        if not reply.endswith(b'\n'):
+            raise ConnectionError('connection closed')
+        return reply[:-1].rstrip(b'\r').decode('latin-1')
+
+    def run(self, lines):
+        '''
+            send lines to the backend and return the replies to the queries and
+            the errors the lines raised on the backend
+
+            Input:
+                lines (list of string) - command lines, executed in order
+            Output:
+                list of string - replies in order of the lines containing a '?'
+                list of SCPIEvent - errors taken from the error queue of the backend
+        '''
+        with tracer.span('backend', 'net', backend = self.name, lines = len(lines)):
+            try:
+                if self._sock is None:
+                    self._connect()
+                # the error query goes out with the batch, so a batch without errors
+                # costs a single round trip
+                self._sock.sendall(''.join(line+'\n' for line in lines+['SYSTem:ERRor?']).encode('latin-1'))
+                replies = [self._read_reply() for line in lines if '?' in line]
+                errors = []
+                error = self._read_reply()
+                while not error.startswith('0,'):
+                    code, message = error.split(',', 1)
+                    errors.append(se.SCPIEvent.factory(int(code), message.strip('"'), 'on %s'%self.name))
+                    self._sock.sendall(b'SYSTem:ERRor?\n')
+                    error = self._read_reply()
+            except (OSError, ValueError) as err:
+                # reconnect on the next batch, the session state of the backend is lost
+                self.close()
+                raise se.SCPIEvent.factory(se.CODE_HARDWARE_MISSING, info = 'backend %s %s:%d failed: %s'%((self.name,)+self.address+(err,)))
+        return replies, errors
+
+class PiGateway(SCPIBase):
+    '''
+        SCPI server that passes commands on to the servers of several Pis
+
+        the routes map the leading mnemonics of a command and optionally a range of
+        channel numbers to a backend. the channel is the last channel number of the
+        command or the channel list argument, it is shifted by the offset of the
+        route, so e.g. GPIO:SOURce:DIGital:DATA30 can be sent to DATA2 of a second
+        Pi. a channel list that covers several routes is split and the replies are
+        joined. routes are checked in order, a route without channels matches
+        any channel number and passes it on unchanged. commands without a route are
+        executed by the gateway if it has them (common commands, SYSTem:ERRor, ...).
+
+        the commands of a line are sent as one batch per backend, the backends run
+        their batches concurrently and the replies are merged in the order of the
+        line. commands the gateway executes itself separate the batches. since all
+        commands of a batch are in flight, a failing command does not stop the
+        following ones on the same backend. its error is added to the error queue
+        of the gateway.
+
+        every client gets its own connections to the backends, opened on first use
+        and kept until the client disconnects, so error queues, priorities and
+        transactions of the backends stay per client.
+    '''
+    class Route:
+        def __init__(self, command, backend, channels = None, offset = 0):
+            # short and long forms of every mnemonic of the command prefix
+            self.command = [_mnemonic_forms(part) for part in command.split(':')]
+            self.backend = backend
+            self.channels = channels
+            self.offset = offset
+
+        def matches(self, mnemonics, channel):
+            if len(mnemonics) < len(self.command):
+                return False
+            for forms, mnemonic in zip(self.command, mnemonics):
+                if mnemonic.upper() not in forms:
+                    return False
+            if self.channels is None:
+                return True
+            return (channel is not None) and (self.channels[0] <= channel <= self.channels[1])
+
+    def __init__(self, backends, routes, timeout = 5.):
+        '''
+            Input:
+                backends (dict) - name: (host, port) of the backend servers
+                routes (list of dict) - command, backend, optional channels [first, last]
+                    and offset, see gateway.json
+                timeout (float) - seconds to wait for a backend
+        '''
+        super(PiGateway, self).__init__()
+        self.backends = backends
+        self.routes = []
+        for route in routes:
+            if route['backend'] not in backends:
+                raise ValueError('route %s refers to an unknown backend %s.'%(route['command'], route['backend']))
+            self.routes.append(PiGateway.Route(route['command'], route['backend'], route.get('channels'), route.get('offset', 0)))
+        self.timeout = timeout
+        self._links = {}
+        self._links_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers = max(1, len(backends)), thread_name_prefix = 'PiGateway')
+
+    @staticmethod
+    def load(path, timeout = 5.):
+        ''' create a gateway from a json file, see gateway.json '''
+        with open(path) as f:
+            config = json.load(f)
+        backends = {}
+        for name, address in config['backends'].items():
+            host, port = address.rsplit(':', 1)
+            backends[name] = (host, int(port))
+        return PiGateway(backends, config['routes'], timeout)
+
+    def get_identification(self):
+        return 'SQDLab, PiGateway, ?, ?'
+
+    def _route(self, mnemonics, channel):
+        for route in self.routes:
+            if route.matches(mnemonics, channel):
+                return route
+        return None
+
+    def _format_line(self, mnemonics, channels, query, args):
+        ''' build a fully qualified command line from a parsed command '''
+        line = ':'.join(mnemonic if channel is None else '%s%d'%(mnemonic, channel)
+                        for mnemonic, channel in zip(mnemonics, channels))
+        if query:
+            line += '?'
+        if args:
+            args = [str(arg) if isinstance(arg, ChannelList) else
+                    ('"%s"'%arg if (arg == '') or any(c in arg for c in ' ,;') else arg) for arg in args]
+            line += ' ' + ','.join(args)
+        return line
+
+    def route(self, mnemonics, channels, query, args):
+        '''
+            return the (backend, line) parts of a parsed command, None if the
+            command has no route
+        '''
+        if args and isinstance(args[-1], ChannelList):
+            # split the list where the route changes, keeping the order of the channels
+            parts = []
+            for channel in args[-1]:
+                route = self._route(mnemonics, channel)
+                if route is None:
+                    raise se.SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = 'no backend for channel %d of %s.'%(channel, ':'.join(mnemonics)))
+                if parts and (parts[-1][0] is route):
+                    parts[-1][1].append(channel-route.offset)
+                else:
+                    parts.append((route, [channel-route.offset]))
+            return [(route.backend, self._format_line(mnemonics, channels, query,
+                     args[:-1]+[ChannelList('(@%s)'%','.join(str(channel) for channel in part))]))
+                    for route, part in parts]
+        levels = [idx for idx, channel in enumerate(channels) if channel is not None]
+        route = self._route(mnemonics, channels[levels[-1]] if levels else None)
+        if route is None:
+            return None
+        if levels and route.offset:
+            channels = list(channels)
+            channels[levels[-1]] -= route.offset
+        return [(route.backend, self._format_line(mnemonics, channels, query, args))]
+
+    def _link(self, backend):
+        key = (self.session.connection, backend)
+        with self._links_lock:
+            link = self._links.get(key)
+            if link is None:
+                link = self._links[key] = BackendLink(backend, self.backends[backend], self.timeout)
+        return link
+
+    def dispatch(self, commands):
+        '''
+            send routed commands to their backends, one batch per backend, and
+            return the replies to the queries in the order of commands
+
+            Input:
+                commands (list of (bool, list)) - query flag and (backend, line) parts
+        '''
+        batches = {}
+        for query, parts in commands:
+            for backend, line in parts:
+                batches.setdefault(backend, []).append(line)
+        links = [self._link(backend) for backend in batches]
+        # a single batch is run by the calling thread
+        futures = [self._pool.submit(link.run, batches[link.name]) for link in links[1:]]
+        results = []
+        for run in [lambda: links[0].run(batches[links[0].name])] + [future.result for future in futures]:
+            try:
+                results.append(run())
+            except se.SCPIEvent as err:
+                self.errors.append(err)
+                results.append(None)
+        replies = {}
+        for link, result in zip(links, results):
+            if result is not None:
+                replies[link.name] = iter(result[0])
+                self.errors.extend(result[1])
+        outputs = []
+        for query, parts in commands:
+            if query:
+                # a backend that failed contributes empty replies
+                outputs.append(','.join(next(replies[backend], '') if backend in replies else ''
+                                        for backend, _ in parts))
+        return outputs
+
+    def process(self, text, session = None, allowed = None):
+        '''
+            parse client input, execute the commands without a route and pass the
+            others on to the backends, return the outputs of all commands in order
+
+            allowed is not supported by the gateway.
+        '''
+        previous = getattr(self._local, 'session', None)
+        if session is not None:
+            self._local.session = session
+        outputs = []
+        try:
+            with tracer.span('parse', line = text):
+                tokens = self.parse(text)
+            routes = [self.route(*token) for token in tokens]
+            idx = 0
+            while idx < len(tokens):
+                if routes[idx] is None:
+                    with tracer.span('execute', command = ':'.join(tokens[idx][0])):
+                        output = self.execute(*tokens[idx])
+                    if output is not None:
+                        outputs.append(self.format_output(output))
+                    idx += 1
+                else:
+                    # consecutive routed commands form one batch per backend
+                    end = idx
+                    while (end < len(tokens)) and (routes[end] is not None):
+                        end += 1
+                    outputs.extend(self.dispatch([(tokens[pos][2], routes[pos]) for pos in range(idx, end)]))
+                    idx = end
+        except se.SCPIEvent as err:
+            self.errors.append(err)
+        finally:
+            self._local.session = previous
+        return outputs
+
+    def connection_closed(self, connection):
+        ''' close the backend connections of a client '''
+        with self._links_lock:
+            links = [self._links.pop(key) for key in list(self._links) if key[0] == connection]
+        for link in links:
+            link.close()
+
+class PiGatewayHandler(PiGPIOHandler):
+    # set to the PiGateway instance before the server is started
+    gateway = None
+
+    def handle(self):
+        ''' pass requests to the gateway '''
+        for line, separator in self.splitter(self.request):
+            result = PiGatewayHandler.gateway.process(line, self.session)
+            if result or ('?' in line):
+                self.reply((';'.join(result)+separator).encode('latin-1'))
+
+    def finish(self):
+        PiGatewayHandler.gateway.connection_closed(self.connection)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SCPI gateway to the servers of several Raspberry Pis')
+    parser.add_argument('config', nargs='?', default=os.path.join(os.path.dirname(os.path.realpath(__file__)), 'gateway.json'),
+                        help='backends and routes (default: gateway.json next to this script)')
+    parser.add_argument('--port', type=int, default=4000, help='TCP port of the gateway (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=5., help='seconds to wait for a backend (default: %(default)s)')
+    parser.add_argument('--threaded', action='store_true', help='serve every client in its own thread')
+    args = parser.parse_args()
+
+    PiGatewayHandler.gateway = PiGateway.load(args.config, args.timeout)
+    server = (ThreadingTCPServer if args.threaded else TCPServer)(('', args.port), PiGatewayHandler, bind_and_activate = False)
+    server.daemon_threads = True
+    server.allow_reuse_address = True
+    server.server_bind()
+    server.server_activate()
+    server.serve_forever()
@@ -2,21 +2,206 @@
 #Created approximately: 29/09/2014
 #Modified by Prasanna Pakkiam to make it compatible with Python3 and the new Raspberry Pi OS
 
-from interface_gpio import PiGPIO
-from socketserver import TCPServer, BaseRequestHandler
+from scpi_base import SCPIBase
+from socketserver import ThreadingTCPServer, UDPServer, ThreadingUnixStreamServer, BaseRequestHandler
+import argparse
+import collections
+import contextlib
+import importlib
 import os
+import signal
+import socket
 import subprocess
 import sys
+import threading
+import scpi_event as se
+from executor import CommandExecutor
+from tracing import tracer
+
+# modules re-imported by reload_gpio, dependencies first
+RELOAD_MODULES = ['scpi_event', 'scpi_base', 'gpio_codec', 'switch_group', 'pulse_scheduler', 'watchdog', 'sampler', 'pwm_output', 'interface_gpio']
+reload_lock = threading.Lock()
+
+class PendingGPIO(SCPIBase):
+    '''
+        stands in for PiGPIO while the server starts up
+
+        the common commands and the error queue work as usual, all other commands
+        fail with a hardware missing error until the hardware has been initialised.
+    '''
+    failure = None
+
+    def not_ready(self):
+        ''' return the error reported for commands that need the hardware '''
+        if self.failure is not None:
+            return se.SCPIEvent.factory(se.CODE_HARDWARE_MISSING, info = 'GPIO initialisation failed: %s'%self.failure)
+        return se.SCPIEvent.factory(se.CODE_HARDWARE_MISSING, info = 'GPIO initialisation in progress, retry later.')
+
+    def process(self, text, session = None, allowed = None):
+        if allowed is not None:
+            # the allow list names commands of PiGPIO, so restricted clients
+            # can not use any command until the hardware has been initialised
+            (session or self.session).errors.append(self.not_ready())
+            return []
+        return super(PendingGPIO, self).process(text, session)
+
+    def execute(self, name, channels, query, args):
+        if self.find(':'.join(name)) is None:
+            raise self.not_ready()
+        return super(PendingGPIO, self).execute(name, channels, query, args)
+
+    def get_identification(self):
+        return 'SQDLab, PiGPIO (initialising), ?, ?'
+
+    def connection_active(self, connection):
+        pass
+
+    def connection_closed(self, connection):
+        pass
+
+def start_gpio(tunes = None, pinmap = None, shm = None, state_dir = None, cache_dir = None):
+    '''
+        import and initialise the GPIO interface, then hand it to the request handlers
+
+        runs in the background so the server accepts connections right away.
+    '''
+    try:
+        from interface_gpio import PiGPIO
+        if tunes:
+            PiGPIO.tunes_path = tunes
+        if pinmap:
+            PiGPIO.pin_map_path = pinmap
+        if state_dir:
+            PiGPIO.states_path = os.path.join(state_dir, 'gpio_states.json')
+        if cache_dir:
+            PiGPIO.command_cache_path = os.path.join(cache_dir, 'command_cache.pickle')
+        device = PiGPIO()
+        device.reload_handler = reload_gpio
+        device.queue_stats = PiGPIOHandler.executor().stats
+        device.initialise()
+        if shm:
+            from shm_mailbox import ShmMailbox
+            PiGPIOHandler.mailbox = ShmMailbox(shm, device)
+    except Exception as err:
+        # keep serving the error queue, so clients can find out what went wrong
+        PiGPIOHandler.hGPIO.failure = err
+        raise
+    PiGPIOHandler.hGPIO = device
+
+def reload_gpio():
+    '''
+        re-import the interface modules and swap in a new PiGPIO instance
+
+        the new instance is fully built and has taken over the hardware state of
+        the old one before it replaces it, so every command is executed by either
+        the old or the new instance. the state is taken over once the commands
+        running on the old instance, e.g. pulses, are complete, and no command
+        starts until the new instance is in place. sockets and client sessions are kept.
+    '''
+    with reload_lock:
+        old = PiGPIOHandler.hGPIO
+        if isinstance(old, PendingGPIO):
+            raise RuntimeError('GPIO initialisation has not completed.')
+        for name in RELOAD_MODULES:
+            if name in sys.modules:
+                importlib.reload(sys.modules[name])
+        PiGPIO = sys.modules['interface_gpio'].PiGPIO
+        PiGPIO.tunes_path = type(old).tunes_path
+        PiGPIO.pin_map_path = type(old).pin_map_path
+        PiGPIO.states_path = type(old).states_path
+        PiGPIO.command_cache_path = type(old).command_cache_path
+        device = PiGPIO()
+        device.reload_handler = reload_gpio
+        device.queue_stats = old.queue_stats
+        mailbox = PiGPIOHandler.mailbox
+        with PiGPIOHandler.executor().pause(), (contextlib.nullcontext() if mailbox is None else mailbox.lock):
+            device.adopt(old)
+            if mailbox is not None:
+                mailbox.device = device
+            PiGPIOHandler.hGPIO = device
+
+def reload_on_signal(signum, frame):
+    ''' SIGHUP handler, reloads in a separate thread so the signalled thread is not blocked '''
+    def run():
+        try:
+            reload_gpio()
+        except Exception as err:
+            print('reload failed: %s'%err, file = sys.stderr)
+    threading.Thread(target = run, name = 'reload_gpio', daemon = True).start()
+
+def dump_trace_on_signal(signum, frame):
+    ''' SIGUSR1 handler, writes the recorded spans to tracer.dump_path '''
+    def run():
+        try:
+            print('trace written to %s'%tracer.dump(), file = sys.stderr)
+        except Exception as err:
+            print('trace dump failed: %s'%err, file = sys.stderr)
+    threading.Thread(target = run, name = 'dump_trace', daemon = True).start()
 
 class PiGPIOHandler(BaseRequestHandler):
-    hGPIO = PiGPIO()
+    # replaced by the PiGPIO instance once it has been initialised, see start_gpio
+    hGPIO = PendingGPIO()
+    mailbox = None
+    # runs the command lines of all clients in order of their priority, see executor.
+    # created on first use, so importing this module starts no threads
+    _executor = None
+    _executor_lock = threading.Lock()
+    # command lines starting with one of these are passed to hGPIO
+    ROUTED = ('GPIO', 'SYST', 'SYSTEM')
+
+    @staticmethod
+    def executor():
+        ''' return the CommandExecutor shared by all handlers '''
+        with PiGPIOHandler._executor_lock:
+            if PiGPIOHandler._executor is None:
+                PiGPIOHandler._executor = CommandExecutor(lambda line, session, allowed: PiGPIOHandler.hGPIO.process(line, session, allowed))
+            return PiGPIOHandler._executor
+
+    def setup(self):
+        ''' every connection gets its own error queue and status masks '''
+        if self.request.family == socket.AF_UNIX:
+            # unix domain clients have no address
+            self.connection = 'unix-%x'%id(self)
+        else:
+            self.connection = self.client_address
+            # send replies immediately, pipelined requests would otherwise stall on Nagle's algorithm
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # replies and pushed stream frames may be sent from different threads
+        self.send_lock = threading.Lock()
+        self.session = SCPIBase.Session(connection = self.connection, push = self.push)
+        # replies to the lines received so far, see flush
+        self.replies = []
+
+    def push(self, data):
+        ''' send data to the client outside of a reply '''
+        with self.send_lock, tracer.span('send', 'net', bytes = len(data)):
+            self.request.sendall(data)
+
+    def reply(self, data):
+        ''' queue the reply to a line, it is sent by flush '''
+        self.replies.append(data)
+
+    def flush(self):
+        '''
+            send the queued replies with a single write
+
+            called once all received lines have been executed, so the replies to
+            pipelined lines share a packet instead of sending one packet each.
+        '''
+        if self.replies:
+            data = b''.join(self.replies)
+            self.replies = []
+            self.push(data)
     
     def splitter(self, request, separators = ['\r\n', '\n']):
         ''' split data received from a socket into lines '''
         data = ''
         while True:
+            # all complete lines have been executed, answer them before waiting for more
+            self.flush()
             # receive input data
-            data_block = self.request.recv(1024)
+            with tracer.span('recv', 'net'):
+                data_block = self.request.recv(1024)
             if not data_block:
                 # the connection has been closed and all data has been received
                 # any unterminated lines in data are ignored
@@ -37,24 +222,126 @@ class PiGPIOHandler(BaseRequestHandler):
         ''' pass requests to PiGPIO to handle '''
         lines = self.splitter(self.request)
         for line, separator in lines:
+            PiGPIOHandler.hGPIO.connection_active(self.connection)
             head = line.split(':')[0]
-            #Let the GPIO handler take care of general * commands and GPIO: commands...
-            if head == 'GPIO' or line[0] == '*':
-                result = PiGPIOHandler.hGPIO.process(line)
-                if result:
-                    self.request.send((';'.join(result)+separator).encode())
+            result = []
+            #Let the GPIO handler take care of general * commands, GPIO: and SYSTem: commands...
+            if head.upper() in PiGPIOHandler.ROUTED or line[:1] == '*':
+                result = PiGPIOHandler.executor().submit(self.connection, line, self.session)
+            # lines containing a query are always answered, even if the query failed,
+            # so clients can pipeline requests and match the replies in order
+            if result or ('?' in line):
+                self.reply((';'.join(result)+separator).encode('latin-1'))
+
+    def finish(self):
+        ''' let the watchdog know that the client has gone '''
+        PiGPIOHandler.executor().close(self.connection)
+        PiGPIOHandler.hGPIO.connection_closed(self.connection)
     
+class PiGPIOUDPHandler(BaseRequestHandler):
+    '''
+        single-shot commands via UDP datagrams
+
+        every datagram carries a sequence number and one command line separated by a
+        space, e.g. "17 GPIO:SOUR:DIG:DATA5 1". the reply carries the same sequence
+        number followed by the results, or by "!" and the error if the line failed.
+        a repeated datagram is answered from a cache of recent replies instead of
+        being executed again. only the commands in allowed can be used.
+    '''
+    allowed = {
+        '*IDN',
+        'GPIO:SOURce:DIGital:DATA',
+        'GPIO:MEASure:DIGital:DATA',
+        'GPIO:SOURce:DIGital:PULSe',
+        'GPIO:SOURce:DIGital:PULSe:BATCh',
+        'GPIO:SWITch:POSition',
+        'GPIO:SWITch:APPLy'
+    }
+    # sessions and recent replies of the most recent senders
+    MAX_SENDERS = 64
+    MAX_REPLIES = 16
+    senders = collections.OrderedDict()
+
+    def handle(self):
+        data, sock = self.request
+        try:
+            seq, line = data.decode().strip().split(' ', 1)
+            seq = int(seq)
+        except ValueError:
+            return
+        senders = PiGPIOUDPHandler.senders
+        if self.client_address in senders:
+            senders.move_to_end(self.client_address)
+        else:
+            senders[self.client_address] = (SCPIBase.Session(connection = self.client_address), collections.OrderedDict())
+            if len(senders) > PiGPIOUDPHandler.MAX_SENDERS:
+                senders.popitem(last = False)
+        session, replies = senders[self.client_address]
+        if seq not in replies:
+            result = PiGPIOHandler.executor().submit(self.client_address, line, session, PiGPIOUDPHandler.allowed)
+            PiGPIOHandler.executor().close(self.client_address)
+            if session.errors:
+                reply = '%d !%s'%(seq, session.errors.popleft())
+                session.errors.clear()
+            else:
+                reply = '%d %s'%(seq, ';'.join(result))
+            replies[seq] = reply.encode('latin-1')
+            if len(replies) > PiGPIOUDPHandler.MAX_REPLIES:
+                replies.popitem(last = False)
+        sock.sendto(replies[seq], self.client_address)
+
 if __name__ == '__main__':
     # start server on all interfaces, port 4000
     HOST = ''
     PORT = 4000
 
-    if len(sys.argv) > 1:
-        tune_folder = sys.argv[1]
-        file_path = f'{tune_folder}/intro.csv'
+    parser = argparse.ArgumentParser(description='SCPI server for the Raspberry Pi GPIO bank')
+    parser.add_argument('tunes', nargs='?', help='folder with buzzer tunes')
+    parser.add_argument('--pinmap', help='pin map file (default: pinmap.json next to this script)')
+    parser.add_argument('--port', type=int, default=PORT, help='TCP port (default: %(default)s)')
+    parser.add_argument('--state-dir', help='folder of the saved bank states (default: $XDG_STATE_HOME/sqd_gpio or ~/.local/state/sqd_gpio)')
+    parser.add_argument('--cache-dir', help='folder of the parsed command cache (default: $XDG_CACHE_HOME/sqd_gpio or ~/.cache/sqd_gpio)')
+    # clients are always served in their own thread, the executor needs concurrent connections to share
+    parser.add_argument('--threaded', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--udp', type=int, metavar='PORT', help='also accept single-shot commands via UDP on PORT')
+    parser.add_argument('--unix', metavar='PATH', help='also listen on the unix domain socket PATH')
+    parser.add_argument('--shm', metavar='PATH', help='serve bulk port reads/writes through a shared-memory mailbox at PATH, e.g. /dev/shm/sqd_gpio')
+    parser.add_argument('--trace', nargs='?', const=tracer.dump_path, metavar='PATH',
+                        help='record request spans from the start, SIGUSR1 writes them as Chrome trace JSON to PATH (default: %(const)s)')
+    parser.add_argument('--backend', choices=['rpigpio', 'chardev'], default='rpigpio',
+                        help='GPIO library: RPi.GPIO or the Linux GPIO character device (gpiochip v2 uAPI)')
+    parser.add_argument('--chip', default='/dev/gpiochip0', help='GPIO chip used by the chardev backend (Pi 5: /dev/gpiochip4)')
+    args = parser.parse_args()
+    # read by interface_gpio on import, also when it is reloaded
+    os.environ['GPIO_BACKEND'] = args.backend
+    os.environ['GPIO_CHIP'] = args.chip
+    if args.trace:
+        tracer.dump_path = args.trace
+        tracer.enabled = True
+
+    # bind all sockets first, clients connecting during start-up get a defined
+    # error instead of a timeout
+    server = ThreadingTCPServer((HOST, args.port), PiGPIOHandler, bind_and_activate = False)
+    server.daemon_threads = True
+    # rebind right after a restart, even while old connections linger in TIME_WAIT
+    server.allow_reuse_address = True
+    server.server_bind()
+    server.server_activate()
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)
+        unix_server = ThreadingUnixStreamServer(args.unix, PiGPIOHandler)
+        unix_server.daemon_threads = True
+        threading.Thread(target=unix_server.serve_forever, daemon=True).start()
+    if args.udp:
+        udp_server = UDPServer((HOST, args.udp), PiGPIOUDPHandler)
+        threading.Thread(target=udp_server.serve_forever, daemon=True).start()
+
+    if args.tunes:
+        file_path = f'{args.tunes}/intro.csv'
         if os.path.exists(file_path):
             subprocess.Popen([f'python', f'{os.path.dirname(os.path.realpath(__file__))}/buzzer.py', '13', file_path])
-        PiGPIO.tunes_path = tune_folder
-
-    server = TCPServer((HOST, PORT), PiGPIOHandler)
+    threading.Thread(target=start_gpio, args=(args.tunes, args.pinmap, args.shm, args.state_dir, args.cache_dir), name='start_gpio', daemon=True).start()
+    signal.signal(signal.SIGHUP, reload_on_signal)
+    signal.signal(signal.SIGUSR1, dump_trace_on_signal)
     server.serve_forever()
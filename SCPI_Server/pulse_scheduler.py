@@ -0,0 +1,133 @@
+#Timeline scheduler merging timed pin edges of independent sequences
+
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+class EdgeScheduler(object):
+    '''
+        background thread firing timed pin edges
+
+        sequences of (time offset, {pin: level}) steps are merged into a single
+        timeline. all edges that are due at the same time are written with one
+        call to the write function, and the thread sleeps until the next edge is
+        due, so N independent sequences take about as long as the longest one.
+    '''
+    class Job:
+        def __init__(self, remaining, done):
+            self.remaining = remaining
+            self.done = done
+            self.cancelled = False
+            self.finished = threading.Event()
+
+    def __init__(self, write, tolerance = 50e-6, lock = None):
+        '''
+            Input:
+                write (function) - called with a {pin: level} dict for each set of coincident edges
+                tolerance (float) - edges due within tolerance seconds are written together
+                lock - held while edges are written. jobs cancelled by a holder of the
+                    lock write nothing afterwards, even if their edges are already due.
+        '''
+        self._write = write
+        self._lock = contextlib.nullcontext() if lock is None else lock
+        self._tolerance = tolerance
+        self.error = None
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, name='EdgeScheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, steps, done = None, start = None):
+        '''
+            add a sequence of steps to the timeline
+
+            Input:
+                steps (list of (float, dict)) - time offsets in seconds relative to
+                    start and the pin levels to set at that time
+                done (function) - called with the job from the scheduler thread after the last step
+                start (float) - time.perf_counter() value of offset zero, defaults to now.
+                    sequences submitted with the same start fire coincident edges together.
+            Output:
+                Job that can be passed to cancel or waited for via Job.finished
+        '''
+        if start is None:
+            start = time.perf_counter()
+        job = EdgeScheduler.Job(len(steps), done)
+        with self._cond:
+            for offset, levels in steps:
+                heapq.heappush(self._queue, (start+offset, next(self._counter), job, levels))
+            self._cond.notify()
+        if not steps:
+            self._finish(job)
+        return job
+
+    def run(self, steps_list):
+        '''
+            run several sequences on a common timeline and wait until all are complete
+        '''
+        start = time.perf_counter()
+        jobs = [self.submit(steps, start=start) for steps in steps_list]
+        for job in jobs:
+            job.finished.wait()
+
+    def cancel(self, job):
+        ''' drop the pending steps of a job. steps already written are not undone. '''
+        with self._cond:
+            job.cancelled = True
+        job.finished.set()
+
+    def stop(self):
+        ''' end the scheduler thread once all pending edges have been written '''
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _finish(self, job):
+        job.finished.set()
+        if job.done is not None:
+            job.done(job)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._queue:
+                        if self._stopped:
+                            return
+                        self._cond.wait()
+                        continue
+                    delay = self._queue[0][0] - time.perf_counter()
+                    if delay <= self._tolerance:
+                        break
+                    self._cond.wait(delay)
+                # collect all edges due now
+                deadline = time.perf_counter() + self._tolerance
+                due = []
+                finished = []
+                while self._queue and (self._queue[0][0] <= deadline):
+                    _, _, job, step_levels = heapq.heappop(self._queue)
+                    if job.cancelled:
+                        continue
+                    due.append((job, step_levels))
+                    job.remaining -= 1
+                    if not job.remaining:
+                        finished.append(job)
+            with self._lock:
+                # later submissions override earlier ones
+                levels = {}
+                for job, step_levels in due:
+                    if not job.cancelled:
+                        levels.update(step_levels)
+                if levels:
+                    try:
+                        self._write(levels)
+                    except Exception as err:
+                        # keep the timeline running, the owner may inspect the last error
+                        self.error = err
+            for job in finished:
+                self._finish(job)
@@ -0,0 +1,104 @@
+#Long-lived PWM outputs: hardware PWM through the kernel pwm sysfs, software PWM otherwise
+
+import os
+import time
+
+# BCM number: channel of the pwm chip. GPIO12/18 and GPIO13/19 share a channel,
+# the pins are routed to the PWM block by dtoverlay=pwm-2chan (or pwm).
+HARDWARE_CHANNELS = {12: 0, 13: 1, 18: 0, 19: 1}
+SYSFS_CHIP = '/sys/class/pwm/pwmchip0'
+
+class SysfsPWM(object):
+    '''
+        hardware PWM channel of the kernel pwm sysfs interface
+
+        has the methods of RPi.GPIO.PWM, so both can be used interchangeably.
+    '''
+    def __init__(self, channel, frequency, chip_path = SYSFS_CHIP):
+        self.path = os.path.join(chip_path, 'pwm%d'%channel)
+        if not os.path.isdir(self.path):
+            self._write(os.path.join(chip_path, 'export'), channel)
+        # udev may fix the permissions of a newly exported channel with a delay
+        for _ in range(20):
+            if os.access(os.path.join(self.path, 'period'), os.W_OK):
+                break
+            time.sleep(0.05)
+        self._period = 0
+        self._duty = 0
+        self.duty_cycle = 0.
+        self.ChangeFrequency(frequency)
+
+    @staticmethod
+    def available(channel, chip_path = SYSFS_CHIP):
+        ''' check if the pwm chip exists, i.e. the overlay is loaded '''
+        try:
+            with open(os.path.join(chip_path, 'npwm')) as f:
+                return channel < int(f.read())
+        except (OSError, ValueError):
+            return False
+
+    def _write(self, path, value):
+        with open(path, 'w') as f:
+            f.write(str(value))
+
+    def _set(self, period, duty):
+        # the duty cycle may never exceed the period, so the order of the writes matters
+        if period < self._duty:
+            self._write(os.path.join(self.path, 'duty_cycle'), duty)
+            self._write(os.path.join(self.path, 'period'), period)
+        else:
+            if period != self._period:
+                self._write(os.path.join(self.path, 'period'), period)
+            self._write(os.path.join(self.path, 'duty_cycle'), duty)
+        self._period, self._duty = period, duty
+
+    def start(self, duty_cycle):
+        self.ChangeDutyCycle(duty_cycle)
+        self._write(os.path.join(self.path, 'enable'), 1)
+
+    def stop(self):
+        self._write(os.path.join(self.path, 'enable'), 0)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        self._set(self._period, int(round(self._period*duty_cycle/100.)))
+
+    def ChangeFrequency(self, frequency):
+        period = int(round(1e9/frequency))
+        self._set(period, int(round(period*self.duty_cycle/100.)))
+
+class PWMOutput(object):
+    '''
+        PWM output of a pin, frequency and duty cycle are kept while it is disabled
+
+        Input:
+            driver - RPi.GPIO.PWM compatible object
+            hardware (bool) - True if driver is a hardware channel
+    '''
+    DEFAULT_FREQUENCY = 1000.
+
+    def __init__(self, driver, frequency = DEFAULT_FREQUENCY, hardware = False):
+        self.driver = driver
+        self.hardware = hardware
+        self.frequency = frequency
+        self.duty_cycle = 0.
+        self.enabled = False
+
+    def set_frequency(self, frequency):
+        self.driver.ChangeFrequency(frequency)
+        self.frequency = frequency
+
+    def set_duty_cycle(self, duty_cycle):
+        if self.enabled:
+            self.driver.ChangeDutyCycle(duty_cycle)
+        self.duty_cycle = duty_cycle
+
+    def set_enabled(self, enabled):
+        if enabled and not self.enabled:
+            self.driver.start(self.duty_cycle)
+        elif self.enabled and not enabled:
+            self.driver.stop()
+        self.enabled = enabled
+
+    def close(self):
+        self.set_enabled(False)
@@ -0,0 +1,175 @@
+#Background sampler streaming the input bank to subscribed clients
+
+import array
+import queue
+import struct
+import threading
+import time
+
+from gpio_codec import encode_transitions
+
+FORMAT_RAW = 0
+FORMAT_RLE = 1
+# magic, format, reserved, decimation, index of the first sample, sample period, mask
+FRAME_HEADER = struct.Struct('<4sBBHQdQ')
+FRAME_MAGIC = b'GPST'
+
+class FrameWriter(object):
+    '''
+        sends the frames of one subscriber from its own thread
+
+        frames are queued without blocking, so a stalled subscriber does not hold
+        up the sampler or the other subscribers. a subscriber that falls more than
+        depth frames behind, or whose connection fails, is closed.
+    '''
+    def __init__(self, push, depth = 16):
+        '''
+            Input:
+                push (function) - sends a frame (bytes) to the subscriber
+                depth (int) - number of frames that may be queued
+        '''
+        self._push = push
+        self._queue = queue.Queue(depth)
+        self.closed = False
+        threading.Thread(target=self._loop, name='FrameWriter', daemon=True).start()
+
+    def send(self, data):
+        ''' queue a frame, returns False if the subscriber has been closed '''
+        if not self.closed:
+            try:
+                self._queue.put_nowait(data)
+            except queue.Full:
+                self.close()
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            # the writer checks closed after every frame
+            pass
+
+    def _loop(self):
+        while not self.closed:
+            data = self._queue.get()
+            if (data is None) or self.closed:
+                return
+            try:
+                self._push(data)
+            except OSError:
+                self.closed = True
+
+class InputSampler(object):
+    '''
+        thread reading a bank of pins at a fixed rate
+
+        samples are written into a preallocated ring buffer. every FRAME_INTERVAL
+        seconds, or whenever frame_samples samples have been collected, the new
+        samples are packed into a binary frame and handed to the publish function.
+
+        frame layout (little endian):
+            header - FRAME_HEADER
+            RAW - one uint32 bit mask of pin levels per sample
+            RLE - transitions encoded by gpio_codec.encode_transitions
+    '''
+    FRAME_INTERVAL = 0.1
+    MIN_RATE = 1.
+    MAX_RATE = 10000.
+    # samples are uint32 bit masks
+    MASK_BITS = 32
+
+    def __init__(self, read, publish, capacity = 65536):
+        '''
+            Input:
+                read (function) - called with the mask, returns the levels as a bit mask
+                publish (function) - called with every frame (bytes)
+                capacity (int) - number of samples held by the ring buffer
+        '''
+        self._read = read
+        self._publish = publish
+        self.capacity = capacity
+        self._buffer = array.array('I', bytes(4*capacity))
+        self.mask = 0
+        self.rate = 100.
+        self.decimation = 1
+        self.format = FORMAT_RAW
+        self.frame_samples = 4096
+        self.overruns = 0
+        # total number of samples stored, the ring holds the last capacity of them
+        self.count = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def check_mask(mask):
+        ''' raise ValueError if mask selects pins that do not fit into a sample '''
+        if mask >> InputSampler.MASK_BITS:
+            raise ValueError('pins %d and above can not be sampled.'%InputSampler.MASK_BITS)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='InputSampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def samples(self, start, stop):
+        ''' return samples start to stop-1 from the ring buffer as an array '''
+        start = max(start, stop-self.capacity, 0)
+        first, last = start % self.capacity, stop % self.capacity
+        if (stop - start) and (last <= first):
+            return self._buffer[first:] + self._buffer[:last]
+        return self._buffer[first:first+stop-start]
+
+    def _frame(self, start, stop):
+        samples = self.samples(start, stop)
+        header = FRAME_HEADER.pack(FRAME_MAGIC, self.format, 0, self.decimation, start,
+                                   self.decimation/self.rate, self.mask)
+        if self.format == FORMAT_RLE:
+            return header + encode_transitions(samples, start, self.decimation/self.rate)
+        return header + samples.tobytes()
+
+    def _loop(self):
+        period = 1./self.rate
+        mask = self.mask
+        decimation = self.decimation
+        capacity = self.capacity
+        buffer = self._buffer
+        read = self._read
+        next_time = time.perf_counter()
+        next_frame = next_time + self.FRAME_INTERVAL
+        sent = self.count
+        tick = 0
+        while not self._stop.is_set():
+            if not tick % decimation:
+                buffer[self.count % capacity] = read(mask)
+                self.count += 1
+            tick += 1
+            now = time.perf_counter()
+            if (now >= next_frame) or (self.count - sent >= self.frame_samples):
+                if self.count > sent:
+                    self._publish(self._frame(sent, self.count))
+                    sent = self.count
+                next_frame = now + self.FRAME_INTERVAL
+            next_time += period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                # fell behind by more than one sample, skip ahead instead of bursting
+                self.overruns += 1
+                next_time = time.perf_counter()
+        if self.count > sent:
+            self._publish(self._frame(sent, self.count))
@@ -3,16 +3,232 @@
 #Modified by Prasanna Pakkiam to make it compatible with Python3 and the new Raspberry Pi OS
 
 import collections
+import os
+import pickle
 import re
 import math
+import tempfile
+import threading
 
 from scpi_event import SCPINoError, SCPIError, SCPIEvent
 import scpi_event as se
+from tracing import tracer
 
 def block_pack(data):
-    ''' generate a definite length arbitrary block response from data '''
+    ''' generate a definite length arbitrary block response from data (string or bytes) '''
+    if isinstance(data, bytes):
+        return b'#%d%d'%(len(str(len(data))), len(data)) + data
     return '#%d%d%s'%(len(str(len(data))), len(data), data)
 
+# default of validators whose argument must be given
+REQUIRED = object()
+
+def _mnemonic_forms(name):
+    ''' return the upper-case short and long form of a mnemonic such as ASCii '''
+    short = ''.join(c for c in name if not c.islower())
+    return set([short, name.upper()])
+
+class ArgBool(object):
+    '''
+        boolean argument, accepts ON, OFF, 1 and 0 and optionally further names
+    '''
+    _VALUES = {'ON': True, 'OFF': False, '1': True, '0': False}
+
+    def __init__(self, names = None, default = REQUIRED):
+        '''
+            Input:
+                names (dict) - additional names mapped to True or False, e.g. {'HIGH': True}
+                default - value used if the argument is omitted, the argument is required if REQUIRED
+        '''
+        self.default = default
+        self._values = dict(self._VALUES)
+        for name, value in (names or {}).items():
+            for form in _mnemonic_forms(name):
+                self._values[form] = bool(value)
+
+    def __call__(self, value):
+        try:
+            return self._values[value.upper()]
+        except KeyError:
+            raise SCPIEvent.factory(se.CODE_DATA_TYPE_ERROR, info = '"%s" is not a boolean.'%value)
+
+class ArgEnum(object):
+    '''
+        argument taking one of a set of names, returns the value the name is mapped to
+
+        names are given in SCPI notation (e.g. ASCii), both short and long form are accepted.
+    '''
+    def __init__(self, options, default = REQUIRED):
+        '''
+            Input:
+                options (dict) - maps names to the values passed to the handler
+                default - value used if the argument is omitted, the argument is required if REQUIRED
+        '''
+        self.default = default
+        self._values = {}
+        for name, value in options.items():
+            for form in _mnemonic_forms(name):
+                self._values[form] = value
+        self._info = 'must be one of [%s].'%', '.join(options)
+
+    def __call__(self, value):
+        try:
+            return self._values[value.upper()]
+        except KeyError:
+            raise SCPIEvent.factory(se.CODE_ILLEGAL_PARAMETER_VALUE, info = '"%s" %s'%(value, self._info))
+
+class ArgFloat(object):
+    '''
+        numeric argument with optional unit suffix and range check
+
+        MINimum and MAXimum select the limits of the range.
+    '''
+    _SUFFIX = re.compile(r'\A(.*?)\s*([A-Za-z]+)\Z')
+
+    def __init__(self, min = None, max = None, units = None, default = REQUIRED):
+        '''
+            Input:
+                min, max (float) - range of valid values (optional)
+                units (dict) - maps unit suffixes to scale factors, e.g. {'S': 1., 'MS': 1e-3}
+                default - value used if the argument is omitted, the argument is required if REQUIRED
+        '''
+        self.min = min
+        self.max = max
+        self.default = default
+        self._units = dict((unit.upper(), scale) for unit, scale in (units or {}).items())
+        self._limits = {}
+        if min is not None:
+            self._limits.update(dict.fromkeys(('MIN', 'MINIMUM'), min))
+        if max is not None:
+            self._limits.update(dict.fromkeys(('MAX', 'MAXIMUM'), max))
+        unit = next((unit for unit, scale in self._units.items() if scale == 1.), '')
+        self._info = 'must be between %s%s and %s%s.'%('-inf' if min is None else '%g'%min, unit, 'inf' if max is None else '%g'%max, unit)
+
+    def convert(self, value):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        upper = value.upper()
+        if upper in self._limits:
+            return self._limits[upper]
+        m = self._SUFFIX.match(value)
+        if (m is not None) and (m.group(2).upper() in self._units):
+            try:
+                return float(m.group(1))*self._units[m.group(2).upper()]
+            except ValueError:
+                pass
+        raise SCPIEvent.factory(se.CODE_DATA_TYPE_ERROR, info = '"%s" is not a number.'%value)
+
+    def __call__(self, value):
+        value = self.convert(value)
+        if not math.isfinite(value):
+            raise SCPIEvent.factory(se.CODE_DATA_OUT_OF_RANGE, info = '%s is not a finite number.'%value)
+        if ((self.min is not None) and (value < self.min)) or ((self.max is not None) and (value > self.max)):
+            raise SCPIEvent.factory(se.CODE_DATA_OUT_OF_RANGE, info = '%s %s'%(value, self._info))
+        return value
+
+class ArgInt(ArgFloat):
+    '''
+        integer argument with range check, accepts hexadecimal values (0x..) if base is 0
+    '''
+    def __init__(self, min = None, max = None, base = 10, default = REQUIRED):
+        ArgFloat.__init__(self, min, max, default = default)
+        self.base = base
+
+    def convert(self, value):
+        try:
+            return int(value, self.base)
+        except ValueError:
+            pass
+        upper = value.upper()
+        if upper in self._limits:
+            return self._limits[upper]
+        raise SCPIEvent.factory(se.CODE_DATA_TYPE_ERROR, info = '"%s" is not an integer.'%value)
+
+class ArgBlock(object):
+    '''
+        definite length arbitrary block argument (#<digits><length><data>), returns the data
+    '''
+    def __init__(self, default = REQUIRED):
+        self.default = default
+
+    def __call__(self, value):
+        try:
+            if value[:1] != '#':
+                raise ValueError()
+            digits = int(value[1])
+            length = int(value[2:2+digits])
+        except (ValueError, IndexError):
+            raise SCPIEvent.factory(se.CODE_DATA_TYPE_ERROR, info = 'expected a definite length block.')
+        if len(value) != 2+digits+length:
+            raise SCPIEvent.factory(se.CODE_DATA_TYPE_ERROR, info = 'block length does not match its header.')
+        return value[2+digits:]
+
+class ChannelList(object):
+    '''
+        SCPI channel list such as (@1,3,5:8), stored as a list of (first, last) ranges
+    '''
+    _ENTRY = re.compile(r'\A\s*([0-9]+)\s*(?::\s*([0-9]+)\s*)?\Z')
+
+    def __init__(self, text):
+        if not (text.startswith('(@') and text.endswith(')')):
+            raise SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = 'invalid channel list %s.'%text)
+        self.ranges = []
+        for entry in text[2:-1].split(','):
+            m = self._ENTRY.match(entry)
+            if m is None:
+                raise SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = 'invalid channel list %s.'%text)
+            first = int(m.group(1))
+            last = first if m.group(2) is None else int(m.group(2))
+            self.ranges.append((first, last))
+
+    def __iter__(self):
+        for first, last in self.ranges:
+            step = 1 if last >= first else -1
+            for channel in range(first, last+step, step):
+                yield channel
+
+    def __len__(self):
+        return sum(abs(last-first)+1 for first, last in self.ranges)
+
+    def bounds(self):
+        ''' return the smallest and largest channel number '''
+        return min(min(r) for r in self.ranges), max(max(r) for r in self.ranges)
+
+    def __str__(self):
+        return '(@%s)'%','.join(str(first) if first == last else '%d:%d'%(first, last) for first, last in self.ranges)
+
+class Arguments(object):
+    '''
+        argument list of a command, compiled once when the command is added
+
+        converts the arguments received from the client with one validator per
+        position. None accepts any string. validators with a default make the
+        argument optional, they must follow all required arguments.
+    '''
+    def __init__(self, validators):
+        self.validators = tuple(validators)
+        self.required = 0
+        for validator in self.validators:
+            if getattr(validator, 'default', REQUIRED) is not REQUIRED:
+                break
+            self.required += 1
+        for validator in self.validators[self.required:]:
+            if getattr(validator, 'default', REQUIRED) is REQUIRED:
+                raise ValueError('required arguments must precede optional arguments.')
+        self.defaults = [validator.default for validator in self.validators[self.required:]]
+
+    def __call__(self, args):
+        if len(args) > len(self.validators):
+            raise SCPIEvent.factory(se.CODE_PARAMETER_NOT_ALLOWED, info = 'expected at most %d argument%s.'%(len(self.validators), '' if len(self.validators) == 1 else 's'))
+        if len(args) < self.required:
+            raise SCPIEvent.factory(se.CODE_MISSING_PARAMETER, info = 'expected %d argument%s.'%(self.required, '' if self.required == 1 else 's'))
+        values = [arg if validator is None else validator(arg) for validator, arg in zip(self.validators, args)]
+        if len(values) < len(self.validators):
+            values.extend(self.defaults[len(values)-self.required:])
+        return values
+
 class SCPIBase(object):
     '''
         
@@ -67,14 +283,86 @@ class SCPIBase(object):
     QUES_USER3  = 1<<12
     QUES_INSTRUMENT_SUMMARY = 1<<13
     QUES_COMMAND_WARNING = 1<<14
+    # scheduling priority of a session, see SYSTem:COMMunicate:PRIority
+    PRIORITY_LOW = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_HIGH = 2
+    PRIORITY_CRITICAL = 3
+    PRIORITY_NAMES = {'LOW': PRIORITY_LOW, 'NORMal': PRIORITY_NORMAL, 'HIGH': PRIORITY_HIGH, 'CRITical': PRIORITY_CRITICAL}
+    # setters starting with one of these run immediately inside a transaction, so
+    # a client can always reset the device or change its session settings
+    TRANSACTION_EXEMPT = ('*', 'SYSTem:')
 
     class Command:
-        def __init__(self, name, getter, setter, channels, re):
+        def __init__(self, name, getter, setter, channels, pattern, args = None, query_args = None, vector_getter = None, vector_setter = None,
+                     stage = None):
             self.name = name
             self.get = getter
             self.set = setter
+            self.stage = stage
+            self.vector_get = vector_getter
+            self.vector_set = vector_setter
             self.channels = channels
-            self.re = re
+            self.pattern = pattern
+            self.args = args
+            self.query_args = query_args
+            self._re = None
+
+        @property
+        def re(self):
+            ''' regular expression matching the command, compiled on first use '''
+            if self._re is None:
+                self._re = re.compile(self.pattern, flags = re.IGNORECASE)
+            return self._re
+
+    class Session:
+        '''
+            state of the SCPI parser that belongs to a single client
+
+            the error queue, the standard event status register and the ESE/SRE
+            masks are kept per session, so clients connected at the same time do
+            not see each other's errors. device status registers are shared.
+        '''
+        def __init__(self, connection = None, push = None):
+            '''
+                Input:
+                    connection - identifies the client
+                    push (function) - sends unsolicited data (bytes) to the client, None if
+                        the transport does not support it
+            '''
+            self.connection = connection
+            self.push = push
+            # transfer format of buffer queries, ASCII or a device-specific binary format
+            self.data_format = 'ASCII'
+            # scheduling priority of the input of this client
+            self.priority = SCPIBase.PRIORITY_NORMAL
+            # Transaction opened by SYSTem:TRANsaction:BEGin
+            self.transaction = None
+            self.errors = collections.deque()
+            self.standard_event_status = 0
+            self.standard_event_status_mask = 0
+            self.status_byte_summary_mask = 0
+            self.service_request = False
+
+    class Transaction:
+        '''
+            changes staged by the setters of a transaction block
+
+            the stage functions of the commands record the changes in a device
+            specific way, e.g. as {pin: value}. failed is set if a command of the
+            block was rejected, the block is then discarded on commit.
+        '''
+        def __init__(self, line = False, epoch = 0):
+            '''
+                Input:
+                    line (bool) - commit at the end of the command line
+                    epoch (int) - transaction epoch of the device when the block was
+                        opened, see discard_transactions
+            '''
+            self.changes = collections.OrderedDict()
+            self.failed = False
+            self.line = line
+            self.epoch = epoch
     
     def __init__(self):
         '''
@@ -83,13 +371,24 @@ class SCPIBase(object):
         # add mandatory gpib commands
         if not hasattr(self, '_commands'):
             self._commands = {}
+        if not hasattr(self, '_command_index'):
+            self._command_index = {}
+        # parsed command names, may be preloaded by load_command_table
+        if not hasattr(self, '_command_table'):
+            self._command_table = {}
+            self._command_table_changed = False
+        # commands are executed in the session of the calling thread, see process
+        self._local = threading.local()
+        self._default_session = SCPIBase.Session()
+        # incremented by discard_transactions
+        self._transaction_epoch = 0
         self.add_command('*CLS', self.status_clear)
-        self.add_command('*ESE', self.set_standard_event_status_enable, self.get_standard_event_status_enable)
+        self.add_command('*ESE', self.set_standard_event_status_enable, self.get_standard_event_status_enable, args=[ArgInt(0, 2**7-1)])
         self.add_command('*ESR', getter=self.get_standard_event_status)
         self.add_command('*IDN', getter=self.get_identification)
         self.add_command('*OPC', self.set_operation_complete, self.get_operation_complete)
         self.add_command('*RST', self.reset)
-        self.add_command('*SRE', self.set_service_request_enable, self.get_service_request_enable)
+        self.add_command('*SRE', self.set_service_request_enable, self.get_service_request_enable, args=[ArgInt(0, 2**7-1)])
         self.add_command('*STB', getter=self.get_status_byte)
         self.add_command('*TST', getter=self.get_self_test)
         self.add_command('*WAI', self.wait)
@@ -97,26 +396,33 @@ class SCPIBase(object):
         self.add_command('SYSTem:ERRor', getter=self.get_error)
         self.add_command('SYSTem:ERRor:NEXT', getter=self.get_error) # same as SYST:ERR
         self.add_command('SYSTem:VERSion', getter=self.get_version)
+        self.add_command('SYSTem:TRANsaction:BEGin', self.transaction_begin, args=[ArgEnum({'BLOCk': False, 'LINE': True}, default = False)])
+        self.add_command('SYSTem:TRANsaction:COMMit', self.transaction_commit)
+        self.add_command('SYSTem:TRANsaction:ABORt', self.transaction_abort)
+        self.add_command('SYSTem:TRANsaction:STATe', getter=self.get_transaction_state)
+        self.add_command('SYSTem:TRACe:STATe', self.set_trace_state, self.get_trace_state, args=[ArgBool()])
+        self.add_command('SYSTem:TRACe:DUMP', getter=self.get_trace)
+        self.add_command('SYSTem:TRACe:CLEar', self.trace_clear)
+        self.add_command('SYSTem:COMMunicate:PRIority', self.set_priority, self.get_priority, args=[ArgEnum(self.PRIORITY_NAMES)])
         self.add_command('STATus:OPERation', getter=self.get_operation_event)
         self.add_command('STATus:OPERation:EVENT', getter=self.get_operation_event) # same as STAT:OPER
         self.add_command('STATus:OPERation:CONDition', getter=self.get_operation_condition)
-        self.add_command('STATus:OPERation:ENABle', self.set_operation_enable, self.get_operation_enable)
+        self.add_command('STATus:OPERation:ENABle', self.set_operation_enable, self.get_operation_enable, args=[ArgInt(0, 2**15-1)])
         self.add_command('QUEStionable', getter=self.get_questionable_event)
         self.add_command('QUEStionable:EVENt', getter=self.get_questionable_event) # same as QUES
         self.add_command('QUEStionable:CONDition', getter=self.get_questionable_condition)
-        self.add_command('QUEStionable:ENABle', self.set_questionable_enable, self.get_questionable_enable)
+        self.add_command('QUEStionable:ENABle', self.set_questionable_enable, self.get_questionable_enable, args=[ArgInt(0, 2**15-1)])
         self.add_command('PRESet', self.preset)
         # non-mandatory scpi commands
         self.add_command('SYSTem:HELP:HEADers', getter=self.get_headers)
         # reset status registers
         self.status_clear()
-        self._standard_event_status_mask = 0
-        self._status_byte_summary_mask = 0
         self._questionable_summary_mask = 0
         self._operation_summary_mask = 0
         
     
-    def add_command(self, name, setter = None, getter = None, channels = None):
+    def add_command(self, name, setter = None, getter = None, channels = None, args = None, query_args = None,
+                    vector_setter = None, vector_getter = None, stage = None):
         '''
             add a new command to the parser
             
@@ -133,9 +439,32 @@ class SCPIBase(object):
                     functions as a list via a channels keyword argument.
                     If channels is None, no such argument is passed and an Exception is
                     raised if the user specifies a channel number.
+                args (list of validators):
+                    types of the arguments of the setter, see Arguments. the converted
+                    values are passed to the setter. arguments are passed as strings
+                    without checks if args is None.
+                query_args (list of validators):
+                    types of the arguments of the getter
+                vector_setter, vector_getter (function):
+                    called instead of setter/getter when the client passes a channel list
+                    such as (@1,3,5:8) as the last argument. the channels keyword argument
+                    holds the list of all selected channel numbers at the lowest level with
+                    channels. the vector getter returns one result per channel. without
+                    them, setter/getter are called once per channel.
+                stage (function):
+                    called instead of the setter while a transaction is open, with the
+                    Transaction as the first argument. it validates the arguments and
+                    records the change in the transaction, see commit_transaction.
+                    setters without stage function are rejected inside transactions.
         '''
-        # call parser to check the command for validity
-        for name_parts, _, _, _ in self.parse(name):
+        args = None if args is None else Arguments(args)
+        query_args = None if query_args is None else Arguments(query_args)
+        entries = self._command_table.get(name)
+        if entries is None:
+            entries = self._compile_command(name)
+            self._command_table[name] = entries
+            self._command_table_changed = True
+        for name_parts, pattern, name_variants in entries:
             # ignore channels numbers and arguments if provided in name
             name = ':'.join(name_parts)
             # check number of channels
@@ -145,8 +474,31 @@ class SCPIBase(object):
                     raise ValueError('number of entries of channels is larger than the hierarchy level.')
                 elif channel_count_diff > 0:
                     channels.extend([None]*channel_count_diff)
+            # check if the command is already in the command list
+            for name_variant in name_variants:
+                command_conflicting = self.find(name_variant) 
+                if command_conflicting is not None:
+                    raise ValueError('command %s conflicts with previously defined command %s'%(name, command_conflicting.name))
+            # create command list entry and index all short/long form combinations
+            command = SCPIBase.Command(name = name, getter = getter, setter = setter, channels = channels, pattern = pattern,
+                                       args = args, query_args = query_args, vector_getter = vector_getter, vector_setter = vector_setter,
+                                       stage = stage)
+            self._commands[name] = command
+            for name_variant in name_variants:
+                self._command_index[name_variant] = command
+
+    def _compile_command(self, name):
+        '''
+            parse the name passed to add_command
 
-            # generate and compile regular expression matching command
+            Output:
+                list of (name_parts, pattern, name_variants) - mnemonics, regular expression
+                and all short/long form combinations of each command name
+        '''
+        entries = []
+        # call parser to check the command for validity
+        for name_parts, _, _, _ in self.parse(name):
+            # generate regular expression matching command
             regex_parts = []
             name_part_dicts = []
             for name_part in name_parts:
@@ -156,33 +508,111 @@ class SCPIBase(object):
                 name_part_dicts.append(name_part_dict)
                 name_part_dict = dict((key, re.escape(value)) for key, value in name_part_dict.items())
                 regex_parts.append('(%(short)s|%(long)s)'%name_part_dict)
-            regex = re.compile(r'\A%s\Z'%(':'.join(regex_parts)), flags = re.IGNORECASE) 
-            # check if the command is already in the command list
+            pattern = r'\A%s\Z'%(':'.join(regex_parts))
+            name_variants = []
             for variant_idx in range(1<<len(name_part_dicts)):
                 name_part_indices = [('long' if variant_idx&(1<<bit) else 'short') for bit in range(len(name_part_dicts))]
-                name_variant = ':'.join([d[i] for d, i in zip(name_part_dicts, name_part_indices)])
-                command_conflicting = self.find(name_variant) 
-                if command_conflicting is not None:
-                    raise ValueError('command %s conflicts with previously defined command %s'%(name, command_conflicting.name))
-            # create command list entry
-            self._commands[name] = SCPIBase.Command(name = name, getter = getter, setter = setter, channels = channels, re = regex)
+                name_variants.append(':'.join([d[i] for d, i in zip(name_part_dicts, name_part_indices)]).upper())
+            entries.append((name_parts, pattern, name_variants))
+        return entries
+
+    def load_command_table(self, path, key):
+        '''
+            preload parsed command names from a cache file written by save_command_table
+
+            must be called before the commands are added. the cache is ignored if
+            it was saved with a different key, e.g. a hash of the source files.
+            unpickling can run code, so the file is only read if it belongs to the
+            current user and nobody else can write to it.
+        '''
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if (stat.st_uid != os.getuid()) or (stat.st_mode & 0o022):
+                    return False
+                cached_key, table = pickle.load(f)
+        except Exception:
+            return False
+        if cached_key != key:
+            return False
+        self._command_table = table
+        self._command_table_changed = False
+        return True
+
+    def save_command_table(self, path, key):
+        ''' write the parsed command names to a cache file if they have changed '''
+        if not self._command_table_changed:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump((key, self._command_table), f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except OSError:
+            # the cache only speeds up start-up
+            return
+        self._command_table_changed = False
     
-    def process(self, text):
+    @property
+    def session(self):
+        ''' session of the client whose input is being processed by the current thread '''
+        return getattr(self._local, 'session', None) or self._default_session
+
+    @property
+    def errors(self):
+        ''' error queue of the current session '''
+        return self.session.errors
+
+    def process(self, text, session = None, allowed = None):
         '''
             parse and execute client input, return command output
+
+            Input:
+                text (string) - command line received from the client
+                session (Session) - state of the client. uses a default session shared
+                    by all callers if None. different threads may process input
+                    concurrently if each uses its own session.
+                allowed (set of string) - names of the commands the client may use.
+                    nothing is executed if the line contains any other command.
         '''
+        previous = getattr(self._local, 'session', None)
+        if session is not None:
+            self._local.session = session
         outputs = []
         try:
-            tokens = self.parse(text)
+            with tracer.span('parse', line = text):
+                tokens = self.parse(text)
+            if allowed is not None:
+                for name, _, _, _ in tokens:
+                    command = self.find(':'.join(name))
+                    if (command is None) or (command.name not in allowed):
+                        raise SCPIEvent.factory(se.CODE_COMMAND_ERROR, info = 'command %s not allowed.'%':'.join(name))
             for token in tokens:
-                output = self.execute(*token)
+                with tracer.span('execute', command = ':'.join(token[0])):
+                    output = self.execute(*token)
                 if output is not None:
                     output = self.format_output(output)
                     outputs.append(output)
+            transaction = self.session.transaction
+            if (transaction is not None) and transaction.line:
+                self.transaction_commit()
         except SCPIEvent as err:
             self.errors.append(err)
+            # any error inside a transaction block discards the block on commit
+            transaction = self.session.transaction
+            if transaction is not None:
+                transaction.failed = True
+                if transaction.line:
+                    self.session.transaction = None
         #except Exception as err:
         #    self.errors.append(se.SCPIExecutionError(info = str(err)))
+        finally:
+            self._local.session = previous
         return outputs
     
     def format_output(self, output):
@@ -194,6 +624,9 @@ class SCPIBase(object):
             return '1' if output else '0'
         elif isinstance(output, int):
             return str(output)
+        elif isinstance(output, bytes):
+            # binary blocks pass through byte by byte, see the latin-1 encoding of the server
+            return output.decode('latin-1')
         else:
             return str(output)
     
@@ -217,6 +650,7 @@ class SCPIBase(object):
                 line. a semicolon separates multiple commands on the same line.
             
             digits can be appended to mnemonics to indicate channel numbers.
+            a channel list such as (@1,3,5:8) in the argument list is returned as a ChannelList.
             strings are delimited by double quotes
             
             Input:
@@ -241,12 +675,13 @@ class SCPIBase(object):
             if ' ' in cmd:
                 cmd, arg_str = [s.strip() for s in cmd.split(' ', 1)]
                 # also split argument list
-                args = re.findall(r'( *"[^"]*"|[^",]+)(?:,|\Z)', arg_str)
+                args = re.findall(r'( *"[^"]*"| *\(@[^)]*\) *|[^",]+)(?:,|\Z)', arg_str)
                 # make sure every letter is accounted for
                 if sum(len(arg) for arg in args)+len(args)-1 != len(arg_str):
                     raise SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = 'in argument list')
                 # strip white-space and quotes (there are exactly zero or two quotes in each arg)
                 args = [arg.strip('" ') for arg in args]
+                args = [ChannelList(arg) if arg.startswith('(@') else arg for arg in args]
             else:
                 args = []
             # determine if the command is a set or get operation
@@ -291,11 +726,11 @@ class SCPIBase(object):
     def find(self, name):
         '''
             look up name in the command list and return the corresponding command list entry
+
+            the command index holds every short/long form combination of each
+            command name, so lookup is a single dictionary access.
         '''
-        for command in self._commands.values():
-            if command.re.match(name) is not None:
-                return command
-        return None
+        return self._command_index.get(name.upper())
         
         
     def execute(self, name, channels, query, args):
@@ -310,10 +745,25 @@ class SCPIBase(object):
         '''
         # find matching command
         name = ':'.join(name)
-        command = self.find(name)
+        with tracer.span('lookup'):
+            command = self.find(name)
         if command is None:
             raise SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = 'unsupported command %s.'%name)
         kwargs = {}
+        # a trailing channel list selects several channels at the lowest level with channels
+        channel_list = None
+        if args and isinstance(args[-1], ChannelList):
+            channel_list = args[-1]
+            args = args[:-1]
+            levels = [idx for idx, count in enumerate(command.channels or []) if count is not None]
+            if not levels:
+                raise SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = 'channel list unexpected.')
+            list_idx = levels[-1]
+            if channels[list_idx] is not None:
+                raise SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = 'channel list and channel index given at index %d'%list_idx)
+            first, last = channel_list.bounds()
+            if (first < 1) or (last > command.channels[list_idx]):
+                raise SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = 'channel list %s at index %d out of range'%(channel_list, list_idx))
         # check and mangle channel numbers
         if command.channels is not None:
             for idx in range(len(command.channels)):
@@ -332,8 +782,37 @@ class SCPIBase(object):
         func = command.get if query else command.set
         if func is None:
             raise SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = '%s not allowed.'%('GET' if query else 'SET'))
+        transaction = self.session.transaction
+        if (transaction is not None) and not query and not command.name.startswith(self.TRANSACTION_EXEMPT):
+            # stage the change, it is applied by SYSTem:TRANsaction:COMMit
+            if command.stage is None:
+                raise SCPIEvent.factory(se.CODE_SETTINGS_CONFLICT, info = '%s can not be used in a transaction.'%name)
+            if command.args is not None:
+                args = command.args(args)
+            for channel in ([None] if channel_list is None else channel_list):
+                if channel is not None:
+                    channels[list_idx] = channel
+                    kwargs['channels'] = list(channels)
+                command.stage(transaction, *args, **kwargs)
+            return
+        arg_types = command.query_args if query else command.args
+        if arg_types is not None:
+            args = arg_types(args)
         try:
-            result = func(*args, **kwargs)
+            if channel_list is None:
+                result = func(*args, **kwargs)
+            else:
+                vector_func = command.vector_get if query else command.vector_set
+                if vector_func is not None:
+                    channels[list_idx] = list(channel_list)
+                    result = vector_func(*args, **kwargs)
+                else:
+                    result = []
+                    for channel in channel_list:
+                        channels[list_idx] = channel
+                        result.append(func(*args, channels = list(channels)))
+                if query:
+                    result = ','.join(self.format_output(value) for value in result)
         except TypeError as e:
             raise SCPIEvent.factory(se.CODE_SYNTAX_ERROR, info = str(e))
         if query:
@@ -348,7 +827,7 @@ class SCPIBase(object):
             
             expected to clear SESR, OPER status, QUES status and error/event queue 
         '''
-        self._service_request = False
+        self.session.service_request = False
         self.standard_event_status_clear()
         self.questionable_clear()
         self.operation_clear()
@@ -356,22 +835,19 @@ class SCPIBase(object):
 
     def standard_event_status_clear(self):
         ''' clear standard event status register '''
-        self._standard_event_status = 0
+        self.session.standard_event_status = 0
     
     def set_standard_event_status_enable(self, mask):
         ''' standard event status enable command. '''
-        mask = int(mask)
-        if (mask < 0) or (mask >= 2**7):
-            raise ValueError('enable mask must be between 0 and 2**7-1.')
-        self._standard_event_status_mask = mask
+        self.session.standard_event_status_mask = mask
     
     def get_standard_event_status_enable(self):
         ''' standard event status enable query. '''
-        return self._standard_event_status_mask
+        return self.session.standard_event_status_mask
 
     def get_standard_event_status(self):
         ''' standard event status register query, destructive '''
-        status = self._standard_event_status
+        status = self.session.standard_event_status
         self.standard_event_status_clear()
         return status
     
@@ -382,7 +858,7 @@ class SCPIBase(object):
             assumes the device does not support overlapping commands
             sets the OPERATION_COMPLETE flag of the standard event status register immediately 
         '''
-        self._standard_event_status |= self.SESR_OPERATION_COMPLETE
+        self.session.standard_event_status |= self.SESR_OPERATION_COMPLETE
     
     def get_operation_complete(self):
         ''' 
@@ -414,14 +890,11 @@ class SCPIBase(object):
     
     def set_service_request_enable(self, mask):
         ''' define the mask defining which bits of the status byte are reported in the summary bit '''
-        mask = int(mask)
-        if (mask < 0) or (mask >= 2**7):
-            raise ValueError('enable mask must be between 0 and 2**7-1.')
-        self._status_byte_summary_mask = mask
+        self.session.status_byte_summary_mask = mask
     
     def get_service_request_enable(self):
         ''' return status byte summary mask '''
-        return self._status_byte_summary_mask
+        return self.session.status_byte_summary_mask
 
     def get_status_byte(self):
         ''' status byte query '''
@@ -432,11 +905,11 @@ class SCPIBase(object):
         if self.get_questionable_condition() & self.QUES_INSTRUMENT_SUMMARY:
             status |= self.STB_QUESTIONABLE
         # MESSAGE_AVAILABLE
-        if self.get_standard_event_status() & self._standard_event_status_mask:
+        if self.get_standard_event_status() & self.session.standard_event_status_mask:
             status |= self.STB_SESR
         if self.get_operation_condition() & self.OPER_INSTRUMENT_SUMMARY:
             status |= self.STB_OPERATION
-        if status & self._status_byte_summary_mask:
+        if status & self.session.status_byte_summary_mask:
             status |= self.STB_SERVICE_REQUEST
         return status
     
@@ -449,10 +922,7 @@ class SCPIBase(object):
     #
     def error_clear(self):
         ''' clear error queue '''
-        if hasattr(self, 'errors'):
-            self.errors.clear()
-        else:
-            self.errors = collections.deque()
+        self.errors.clear()
     
     def get_error(self):
         ''' return next error in the error queue '''
@@ -483,9 +953,6 @@ class SCPIBase(object):
     
     def set_operation_enable(self, mask):
         ''' define the mask defining which bits of questionable are reported in the summary bit '''
-        mask = int(mask)
-        if (mask < 0) or (mask >= 2**15):
-            raise ValueError('enable mask must be between 0 and 2**15-1.')
         self._operation_summary_mask = mask
     
     def get_operation_enable(self):
@@ -512,9 +979,6 @@ class SCPIBase(object):
         
     def set_questionable_enable(self, mask):
         ''' define the mask defining which bits of questionable are reported in the summary bit '''
-        mask = int(mask)
-        if (mask < 0) or (mask >= 2**15):
-            raise ValueError('enable mask must be between 0 and 2**15-1.')
         self._questionable_summary_mask = mask
     
     def get_questionable_enable(self):
@@ -538,6 +1002,92 @@ class SCPIBase(object):
     #
     # useful non-mandatory commands
     #
+    def transaction_begin(self, line):
+        '''
+            start a transaction block
+
+            setters are validated and staged until SYSTem:TRANsaction:COMMit, which
+            applies all staged changes at once. queries and the commands of
+            TRANSACTION_EXEMPT are executed immediately.
+            a LINE transaction is committed at the end of the command line, or
+            discarded if a command of the line failed.
+        '''
+        if self.session.transaction is not None:
+            raise SCPIEvent.factory(se.CODE_SETTINGS_CONFLICT, info = 'a transaction is already open.')
+        self.session.transaction = SCPIBase.Transaction(line, self._transaction_epoch)
+
+    def transaction_commit(self):
+        '''
+            apply the changes of the open transaction, or none if a command of it failed
+        '''
+        transaction = self.session.transaction
+        if transaction is None:
+            raise SCPIEvent.factory(se.CODE_SETTINGS_CONFLICT, info = 'no transaction is open.')
+        self.session.transaction = None
+        if transaction.failed:
+            raise SCPIEvent.factory(se.CODE_EXECUTION_ERROR, info = 'transaction discarded, one of its commands failed.')
+        if self.transaction_discarded(transaction):
+            raise SCPIEvent.factory(se.CODE_EXECUTION_ERROR, info = 'transaction discarded by a reset or safe state.')
+        if transaction.changes:
+            self.commit_transaction(transaction)
+
+    def transaction_abort(self):
+        ''' discard the open transaction '''
+        self.session.transaction = None
+
+    def discard_transactions(self):
+        '''
+            discard the open transactions of all clients
+
+            the transaction of the current client is closed, those of other clients
+            stay open but their commit fails without applying any change.
+        '''
+        self._transaction_epoch += 1
+        self.session.transaction = None
+
+    def transaction_discarded(self, transaction):
+        ''' return True if transaction was opened before the last discard_transactions '''
+        return transaction.epoch != self._transaction_epoch
+
+    def get_transaction_state(self):
+        return self.session.transaction is not None
+
+    def commit_transaction(self, transaction):
+        '''
+            apply the staged changes of a transaction, implemented by the device
+
+            must either apply all changes or raise an SCPIEvent without applying any.
+        '''
+        raise SCPIEvent.factory(se.CODE_SETTINGS_CONFLICT, info = 'transactions are not supported.')
+
+    def set_trace_state(self, enabled):
+        '''
+            start or stop recording spans of request processing, see tracing
+        '''
+        tracer.enabled = enabled
+
+    def get_trace_state(self):
+        return tracer.enabled
+
+    def get_trace(self):
+        ''' return the recorded spans as Chrome trace JSON in a definite-length block '''
+        return block_pack(tracer.dumps())
+
+    def trace_clear(self):
+        tracer.clear()
+
+    def set_priority(self, priority):
+        '''
+            set the scheduling priority of the commands of the current session
+        '''
+        self.session.priority = priority
+
+    def get_priority(self):
+        ''' return the short form of the scheduling priority of the current session '''
+        for name, value in self.PRIORITY_NAMES.items():
+            if value == self.session.priority:
+                return ''.join(c for c in name if c.isupper())
+
     def get_headers(self):
         '''
             return all supported commands
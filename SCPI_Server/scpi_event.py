@@ -12,6 +12,10 @@ CODE_MISSING_PARAMETER = -109
 # a lot more codes here
 CODE_EXECUTION_ERROR = -200
 CODE_PARAMETER_ERROR = -220
+CODE_SETTINGS_CONFLICT = -221
+CODE_DATA_OUT_OF_RANGE = -222
+CODE_ILLEGAL_PARAMETER_VALUE = -224
+CODE_HARDWARE_MISSING = -241
 # a lot more codes here
 CODE_DEVICE_ERROR = -300
 # a lot more codes here
@@ -29,7 +33,15 @@ CODE_OPERATION_COMPLETE_EVENT = -800
 MESSAGES = {
     CODE_NO_ERROR: 'No error',
     CODE_COMMAND_ERROR: 'Command error',
+    CODE_DATA_TYPE_ERROR: 'Data type error',
+    CODE_PARAMETER_NOT_ALLOWED: 'Parameter not allowed',
+    CODE_MISSING_PARAMETER: 'Missing parameter',
     CODE_EXECUTION_ERROR: 'Execution error',
+    CODE_PARAMETER_ERROR: 'Parameter error',
+    CODE_SETTINGS_CONFLICT: 'Settings conflict',
+    CODE_DATA_OUT_OF_RANGE: 'Data out of range',
+    CODE_ILLEGAL_PARAMETER_VALUE: 'Illegal parameter value',
+    CODE_HARDWARE_MISSING: 'Hardware missing',
     CODE_DEVICE_ERROR: 'Device-specific error',
     CODE_QUERY_ERROR: 'Query error',
     CODE_QUERY_INTERRUPTED: 'Query INTERRUPTED',
@@ -0,0 +1,188 @@
+#Shared-memory mailbox for bulk port reads and writes by processes running on the Pi
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+
+# file layout: header followed by a ring of request slots
+#   header - magic, version, number of slots, reserved, head (next ticket issued to a client),
+#       tail (next ticket executed by the server)
+#   slot - ticket, operation, status, mask, bits, done (ticket of the completed request)
+# a slot is reused after slots tickets. the ticket is cleared before a slot is
+# rewritten and done is written after the result, so a client checks both before
+# and after reading its result to detect a reused slot.
+HEADER = struct.Struct('<4sIII QQ')
+SLOT = struct.Struct('<QII QQQ')
+MAGIC = b'GPMB'
+VERSION = 1
+HEAD_OFFSET = 16
+TAIL_OFFSET = 24
+DONE_OFFSET = SLOT.size-8
+OP_READ = 1
+OP_WRITE = 2
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+def _slot_offset(ticket, slots):
+    return HEADER.size + (ticket % slots)*SLOT.size
+
+def _backoff(sleep, max_sleep):
+    ''' sleep, then return the next, longer poll interval '''
+    if sleep:
+        time.sleep(sleep)
+    return min(max(2*sleep, 10e-6), max_sleep)
+
+class ShmMailbox(object):
+    '''
+        server side of the mailbox
+
+        clients place bulk read/write requests into a ring buffer in a memory-mapped
+        file. a thread of the server polls the ring and executes the requests on the
+        single PiGPIO instance that owns the hardware. the thread spins briefly after
+        each request and backs off to sleeping up to max_sleep when the ring is idle.
+    '''
+    def __init__(self, path, device, slots = 64, max_sleep = 1e-3):
+        '''
+            Input:
+                path (string) - file backing the mailbox, e.g. in /dev/shm
+                device (PiGPIO) - executes the requests via read_port and write_port
+                slots (int) - number of requests that can be queued
+                max_sleep (float) - longest poll interval in seconds while idle
+        '''
+        self.path = path
+        self.device = device
+        # held while a request is executed, see pi_server.reload_gpio
+        self.lock = threading.Lock()
+        self.slots = slots
+        self.max_sleep = max_sleep
+        size = HEADER.size + slots*SLOT.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o660)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, slots, 0, 0, 0)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, name='ShmMailbox', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        ''' stop serving requests '''
+        self._stopped = True
+        self._thread.join()
+        self._map.close()
+
+    def _execute(self, op, mask, bits):
+        if op == OP_READ:
+            return self.device.read_port(mask)
+        elif op == OP_WRITE:
+            self.device.write_port(mask, bits)
+            return bits
+        raise ValueError('unknown operation %d.'%op)
+
+    def _loop(self):
+        tail = 0
+        sleep = 0.
+        while not self._stopped:
+            offset = _slot_offset(tail, self.slots)
+            ticket, op, _, mask, bits, _ = SLOT.unpack_from(self._map, offset)
+            if ticket != tail+1:
+                # no request pending, back off gradually
+                sleep = _backoff(sleep, self.max_sleep)
+                continue
+            sleep = 0.
+            try:
+                with self.lock:
+                    result, status = self._execute(op, mask, bits), STATUS_OK
+            except Exception:
+                result, status = 0, STATUS_ERROR
+            # the result first, done marks it complete
+            SLOT.pack_into(self._map, offset, ticket, op, status, mask, result, 0)
+            struct.pack_into('<Q', self._map, offset+DONE_OFFSET, ticket)
+            tail += 1
+            struct.pack_into('<Q', self._map, TAIL_OFFSET, tail)
+
+class ShmGPIO(object):
+    '''
+        client side of the mailbox for processes running on the Pi
+
+        clients serialise the allocation of tickets with a lock on the mailbox file,
+        then poll their slot until the server marks it done, backing off to sleeping
+        up to max_sleep between polls.
+    '''
+    def __init__(self, path, timeout = 1., max_sleep = 1e-3):
+        self._fd = os.open(path, os.O_RDWR)
+        size = os.fstat(self._fd).st_size
+        self._map = mmap.mmap(self._fd, size)
+        magic, version, self.slots, _, _, _ = HEADER.unpack_from(self._map, 0)
+        if (magic != MAGIC) or (version != VERSION):
+            raise ValueError('%s is not a GPIO mailbox.'%path)
+        self.timeout = timeout
+        self.max_sleep = max_sleep
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _request(self, op, mask, bits):
+        deadline = time.monotonic() + self.timeout
+        sleep = 0.
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            head, = struct.unpack_from('<Q', self._map, HEAD_OFFSET)
+            while head - struct.unpack_from('<Q', self._map, TAIL_OFFSET)[0] >= self.slots:
+                # ring full
+                if time.monotonic() > deadline:
+                    raise TimeoutError('GPIO mailbox is not served.')
+                sleep = _backoff(sleep, self.max_sleep)
+            offset = _slot_offset(head, self.slots)
+            # clearing the ticket shows a previous owner of the slot that it is reused,
+            # writing it last publishes the request
+            SLOT.pack_into(self._map, offset, 0, op, 0, mask, bits, 0)
+            struct.pack_into('<Q', self._map, offset, head+1)
+            struct.pack_into('<Q', self._map, HEAD_OFFSET, head+1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        ticket = head+1
+        sleep = 0.
+        while True:
+            done, = struct.unpack_from('<Q', self._map, offset+DONE_OFFSET)
+            if done == ticket:
+                _, _, status, _, result, _ = SLOT.unpack_from(self._map, offset)
+                # the result is only valid if the slot still holds this request
+                if struct.unpack_from('<Q', self._map, offset)[0] == ticket:
+                    break
+            if struct.unpack_from('<Q', self._map, offset)[0] != ticket:
+                raise ConnectionError('GPIO mailbox reply was lost, the slot was reused before it was read.')
+            if time.monotonic() > deadline:
+                raise TimeoutError('GPIO mailbox is not served.')
+            sleep = _backoff(sleep, self.max_sleep)
+        if status != STATUS_OK:
+            raise ValueError('GPIO mailbox request failed, check the mask.')
+        return result
+
+    def read_port(self, mask):
+        ''' return the levels of the pins selected by mask as a bit mask of BCM numbers '''
+        return self._request(OP_READ, mask, 0)
+
+    def write_port(self, mask, bits):
+        ''' write the output pins selected by mask, bits holds their levels '''
+        self._request(OP_WRITE, mask, bits)
+
+    def read_pins(self, pins):
+        bits = self.read_port(sum(1<<pin for pin in pins))
+        return [(bits >> pin) & 1 for pin in pins]
+
+    def write_pins(self, values):
+        ''' write a {pin: level} dict '''
+        self.write_port(sum(1<<pin for pin in values), sum(1<<pin for pin, value in values.items() if value))
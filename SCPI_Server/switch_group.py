@@ -0,0 +1,141 @@
+#Switch groups for electro-mechanical switches driven by GPIO pins
+
+class SwitchGroup(object):
+    '''
+        a named set of pins driving the coils of an electro-mechanical switch
+
+        Two kinds of switches are supported:
+            bbm - failsafe switches whose coils stay energised. a position change
+                first de-energises the coils of the old position (break), waits for
+                the dwell time and then energises the coils of the new position (make).
+            latching - latching switches whose coils are pulsed. a position change
+                optionally pulses the reset coils, then pulses the coils of the new
+                position. all coils are de-energised after each pulse.
+    '''
+    TYPES = ('bbm', 'latching')
+
+    def __init__(self, name, pins, positions, type = 'bbm', dwell = 0.05, pulse = 0.05, reset = None, description = None):
+        '''
+            Input:
+                name (string) - user-friendly switch name
+                pins (list of int) - BCM numbers of the coil pins
+                positions (dict) - maps position numbers to lists of pin levels (0/1),
+                    one level per entry of pins
+                type (string) - 'bbm' or 'latching'
+                dwell (float) - settling time in seconds after each break, make or pulse
+                pulse (float) - pulse length in seconds for latching switches
+                reset (list of int) - pin levels pulsed before every position change of
+                    a latching switch (optional)
+        '''
+        if type not in self.TYPES:
+            raise ValueError('switch %s: type must be one of [%s].'%(name, ', '.join(self.TYPES)))
+        if not pins:
+            raise ValueError('switch %s: no pins given.'%name)
+        self.name = name
+        self.type = type
+        self.pins = list(pins)
+        self.positions = {}
+        for position, levels in positions.items():
+            if len(levels) != len(self.pins):
+                raise ValueError('switch %s: position %s must define %d pin levels.'%(name, position, len(self.pins)))
+            self.positions[int(position)] = [bool(level) for level in levels]
+        if not self.positions:
+            raise ValueError('switch %s: no positions given.'%name)
+        if (reset is not None) and (len(reset) != len(self.pins)):
+            raise ValueError('switch %s: reset must define %d pin levels.'%(name, len(self.pins)))
+        self.reset_levels = None if reset is None else [bool(level) for level in reset]
+        self.description = description
+        self.set_dwell(dwell)
+        self.set_pulse(pulse)
+        self.position = 0
+        self.target = 0
+        self.busy = False
+        self._job = None
+
+    def set_dwell(self, dwell):
+        dwell = float(dwell)
+        if (dwell < 0) or (dwell > 10.):
+            raise ValueError('dwell must be between 0s and 10s.')
+        self.dwell = dwell
+
+    def set_pulse(self, pulse):
+        pulse = float(pulse)
+        if (pulse < 200e-6) or (pulse > 2.):
+            raise ValueError('pulse must be between 200us and 2s.')
+        self.pulse = pulse
+
+    def sequence(self, position, levels):
+        '''
+            return the steps needed to move to position
+
+            Input:
+                position (int) - target position
+                levels (list of bool) - current pin levels
+            Output:
+                list of (time offset, {pin: level}) tuples. the last step carries
+                no pin changes and marks the end of the final dwell time.
+        '''
+        target = self.positions[position]
+        off = dict((pin, False) for pin in self.pins)
+        steps = []
+        t = 0.
+        if self.type == 'bbm':
+            # break all coils that are not part of the new position
+            breaks = dict((pin, False) for pin, cur, new in zip(self.pins, levels, target) if cur and not new)
+            if breaks:
+                steps.append((t, breaks))
+                t += self.dwell
+            steps.append((t, dict(zip(self.pins, target))))
+            t += self.dwell
+        else:
+            if any(levels):
+                steps.append((t, off))
+                t += self.dwell
+            if self.reset_levels is not None:
+                steps.append((t, dict(zip(self.pins, self.reset_levels))))
+                t += self.pulse
+                steps.append((t, off))
+                t += self.dwell
+            steps.append((t, dict(zip(self.pins, target))))
+            t += self.pulse
+            steps.append((t, off))
+            t += self.dwell
+        steps.append((t, {}))
+        return steps
+
+    def start(self, position, levels, scheduler, done, start = None):
+        '''
+            move the switch to a new position in the background
+
+            the steps are run by the edge scheduler, the call returns immediately. a move
+            in progress is cancelled and the new sequence starts from the current levels.
+
+            Input:
+                position (int) - target position
+                levels (list of bool) - current pin levels
+                scheduler (EdgeScheduler) - timeline the steps are submitted to
+                done (function) - called with the group and the job when the sequence is
+                    complete. it must call complete with the job.
+                start (float) - common start time when moving several switches at once
+        '''
+        if position not in self.positions:
+            raise ValueError('position of switch %s must be one of [%s].'%(self.name, ', '.join(str(p) for p in sorted(self.positions))))
+        self.cancel(scheduler)
+        self.target = position
+        self.busy = True
+        self._job = scheduler.submit(self.sequence(position, levels), lambda job: done(self, job), start)
+
+    def cancel(self, scheduler):
+        ''' stop a move in progress, leaving the pins in their current state '''
+        if self._job is not None:
+            scheduler.cancel(self._job)
+            self._job = None
+        self.target = self.position
+        self.busy = False
+
+    def complete(self, job):
+        ''' mark the move as complete unless job has been superseded by a newer move '''
+        if job is self._job:
+            self._job = None
+            self.position = self.target
+            self.busy = False
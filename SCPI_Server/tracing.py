@@ -0,0 +1,109 @@
+#Request tracing into an in-memory ring, exported as Chrome trace JSON
+
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+class _NullSpan(object):
+    ''' returned by Tracer.span while tracing is off '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class _Span(object):
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        self.tracer.record(self.name, self.cat, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+class Tracer(object):
+    '''
+        records timed spans of all threads into a fixed-size ring
+
+        while tracing is off, span returns a shared no-op context manager, so an
+        instrumented code path only pays for one attribute check and the with
+        statement. the ring keeps the last capacity spans. dump exports them in
+        the Chrome trace event format, which chrome://tracing and
+        https://ui.perfetto.dev display as a timeline per thread.
+    '''
+    _NULL = _NullSpan()
+
+    def __init__(self, capacity = 65536):
+        self.capacity = capacity
+        self.enabled = False
+        # written by SIGUSR1, see pi_server.py
+        self.dump_path = os.path.join(tempfile.gettempdir(), 'pi_server_trace.json')
+        self.clear()
+
+    def clear(self):
+        self._ring = [None]*self.capacity
+        # next() of a count is atomic, so threads never claim the same slot
+        self._counter = itertools.count()
+
+    def span(self, name, cat = 'scpi', **args):
+        '''
+            return a context manager timing the enclosed code
+
+            Input:
+                name (string) - shown on the timeline
+                cat (string) - category, e.g. net, scpi or io
+                args - details shown when a span is selected
+        '''
+        if not self.enabled:
+            return self._NULL
+        return _Span(self, name, cat, args)
+
+    def record(self, name, cat, start, stop, args = None):
+        ''' add a span, start and stop are perf_counter_ns values '''
+        self._ring[next(self._counter) % self.capacity] = (name, cat, start, stop, threading.get_ident(), args)
+
+    def events(self):
+        ''' return the recorded spans as Chrome trace events, oldest first '''
+        spans = [span for span in self._ring if span is not None]
+        spans.sort(key = lambda span: span[2])
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread.ident, 'args': {'name': thread.name}}
+                  for thread in threading.enumerate()]
+        for name, cat, start, stop, tid, args in spans:
+            event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': start/1e3, 'dur': (stop-start)/1e3}
+            if args:
+                event['args'] = dict((key, str(value)) for key, value in args.items())
+            events.append(event)
+        return events
+
+    def dumps(self):
+        ''' return the trace as Chrome trace JSON '''
+        return json.dumps({'traceEvents': self.events(), 'displayTimeUnit': 'ms'})
+
+    def dump(self, path = None):
+        ''' write the trace to path, dump_path by default, and return the path '''
+        path = path or self.dump_path
+        fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.dumps())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return path
+
+# shared by the server, the parser and the GPIO interface
+tracer = Tracer()
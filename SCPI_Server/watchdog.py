@@ -0,0 +1,95 @@
+#Deadline watchdog driving the GPIO bank into its safe state
+
+import heapq
+import itertools
+import threading
+import time
+
+class Watchdog(object):
+    '''
+        background thread tracking deadlines such as maximum on-times of pins
+        and connection keepalives
+
+        deadlines are kept in a heap and the thread sleeps until the earliest one,
+        so the cost of arming or disarming a deadline does not depend on the number
+        of pins or connections. disarmed deadlines are discarded lazily when they
+        reach the top of the heap.
+    '''
+    def __init__(self, trip):
+        '''
+            Input:
+                trip (function) - called with the key of an expired deadline from the
+                    watchdog thread
+        '''
+        self._trip = trip
+        self.error = None
+        self._heap = []
+        self._armed = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, name='Watchdog', daemon=True)
+        self._thread.start()
+
+    def arm(self, key, timeout, restart = True):
+        '''
+            start a deadline of timeout seconds for key
+
+            Input:
+                restart (bool) - if False, a running deadline of key is left untouched
+        '''
+        with self._cond:
+            if (not restart) and (key in self._armed):
+                return
+            deadline = time.monotonic() + timeout
+            token = next(self._counter)
+            self._armed[key] = token
+            heapq.heappush(self._heap, (deadline, token, key))
+            if self._heap[0][1] == token:
+                self._cond.notify()
+
+    def disarm(self, key):
+        ''' cancel the deadline of key '''
+        with self._cond:
+            self._armed.pop(key, None)
+
+    def armed(self, key):
+        return key in self._armed
+
+    def pending(self):
+        ''' return a {key: seconds remaining} dict of the armed deadlines '''
+        with self._cond:
+            now = time.monotonic()
+            return dict((key, max(deadline-now, 0.)) for deadline, token, key in self._heap
+                        if self._armed.get(key) == token)
+
+    def stop(self):
+        ''' end the watchdog thread, armed deadlines are dropped '''
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    # discard disarmed and restarted deadlines
+                    while self._heap and (self._armed.get(self._heap[0][2]) != self._heap[0][1]):
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                _, _, key = heapq.heappop(self._heap)
+                del self._armed[key]
+            try:
+                self._trip(key)
+            except Exception as err:
+                # keep watching, the owner may inspect the last error
+                self.error = err
@@ -1,6 +1,9 @@
 import RPi.GPIO as GPIO
 import time
 import os
+import sys
+
+from machine_mode import run_machine
 
 """
 Classes for Device Management
@@ -10,19 +13,23 @@ class Device() :
     Class that contains all functions to interface with a device
     over a serial port
     """
-    def __init__(self, pins = None) :
+    def __init__(self, pins = None, verbose = True) :
         """
         Class constructor
         @param pins: list of GPIO pins to setup, None if not initialising any
+        @param verbose: print debug output
         """
+        self.verbose = verbose
 
         # Setup how pins are referenced
         GPIO.setmode(GPIO.BCM)
-        print("PINS ARE: ", pins)
+        if verbose :
+            print("PINS ARE: ", pins)
         # Setup Pins
         if pins != None :
             for pin in pins :
-                print("SETTING UP PIN: ", pin)
+                if verbose :
+                    print("SETTING UP PIN: ", pin)
                 self.setup_pin(int(pin))
 
     
@@ -44,14 +51,16 @@ class Device() :
         Method to set output of GPIO pin
         """
         command = command.split(",")
-        print("SPLIT COMMAND IS: ", command)
+        if self.verbose :
+            print("SPLIT COMMAND IS: ", command)
         return GPIO.output(int(command[0]), int(command[1]))
 
     def read_command(self, command) :
         """
 
         """
-        print("READ COMMAND IS: ", command)
+        if self.verbose :
+            print("READ COMMAND IS: ", command)
         return GPIO.input(int(command))
         
 
@@ -79,6 +88,11 @@ def handle_input(devices) :
 Program
 """
 if __name__ == "__main__" :
+    if sys.argv[1:2] == ["--machine"] :
+        # python RPi_gpio_interface.py --machine [pin,pin,...]
+        pins = sys.argv[2].split(",") if len(sys.argv) > 2 else None
+        run_machine(Device(pins, verbose = False))
+        sys.exit()
     try :
         print("Please enter pins to setup")
         pins = input().split(",")
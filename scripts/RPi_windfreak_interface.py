@@ -1,6 +1,11 @@
 import serial
 import time
 import os
+import re
+import sys
+import threading
+
+from machine_mode import run_machine
 
 """
 Classes for Device Management
@@ -9,9 +14,26 @@ class Device() :
     """
     Class that contains all functions to interface with a device
     over a serial port
+
+    Settings that only change when they are written (frequency, power, output
+    and PLL state, channel) are cached: a query of a single cached parameter,
+    e.g. f?, is answered from memory if it was read less than cacheTTL seconds
+    ago. Writing a parameter drops it from the cache, so the next query reads
+    it from the device again. READRAW queries always go to the device.
     """
-    def __init__(self, comPort) :
+    # parameters cached per channel
+    CACHED_PARAMETERS = "fWErhC"
+
+    def __init__(self, comPort, cacheTTL = 60., verbose = True) :
+        self.verbose = verbose
         self._ser = self.setup_serial(comPort)
+        # the sweep thread and the console share the serial port
+        self._lock = threading.Lock()
+        self.sweep = Sweep(self)
+        self.cacheTTL = cacheTTL
+        # (channel, parameter): (reply, time read)
+        self._cache = {}
+        self._channel = None
     
     def setup_serial(self, com = "/dev/ttyACM0") :
         """
@@ -24,8 +46,14 @@ class Device() :
         """
         if cmdType == "READ" :
             return self.read_command(command)
+        elif cmdType == "READRAW" :
+            return self.read_command(command, useCache = False)
         elif cmdType == "WRITE" :
             return self.write_command(command)
+        elif cmdType == "SWEEP" :
+            return self.sweep.handle_command(command)
+        elif cmdType == "CACHE" :
+            return self.handle_cache_command(command)
         else :
             return "Invalid CMD Type"
         
@@ -34,21 +62,216 @@ class Device() :
         """
 
         """
-        return self._ser.write(bytes(command, 'utf-8'))
+        return self.write_bytes(bytes(command, 'utf-8'))
 
-    def read_command(self, command) :
+    def write_bytes(self, data, drain = False) :
         """
+        Write encoded command bytes, wait until they are sent if drain is set
+        """
+        with self._lock :
+            written = self._ser.write(data)
+            if drain :
+                self._ser.flush()
+            self._invalidate(data.decode('utf-8'))
+        return written
 
+    def _invalidate(self, command) :
+        """
+        Drop the parameters written by command from the cache and follow
+        channel changes (C<n>), for every command sent to the device
         """
-        self._ser.write(bytes(command, 'utf-8'))
-        retData = self._ser.readline().decode('utf-8').rstrip()
-        #time.sleep(0.2)
-        while (self._ser.in_waiting) :
+        for parameter, value in re.findall(r"([A-Za-z])([^A-Za-z]*)", command) :
+            if value.strip() == "?" :
+                continue
+            if parameter == "C" :
+                # parameters are cached per channel
+                self._channel = value.strip() or None
+            self._cache.pop((self._channel, parameter), None)
+
+    def handle_cache_command(self, command) :
+        """
+        CLEAR empties the cache and returns the number of removed entries,
+        TTL [seconds] returns or sets its lifetime (0: no caching)
+        """
+        name, _, args = command.strip().partition(" ")
+        name = name.upper()
+        if name == "CLEAR" :
+            with self._lock :
+                removed = len(self._cache)
+                self._cache.clear()
+            return removed
+        elif name == "TTL" :
+            if args.strip() :
+                try :
+                    self.cacheTTL = float(args)
+                except ValueError :
+                    return "Invalid CACHE arguments"
+            return self.cacheTTL
+        else :
+            return "Invalid CACHE command"
+
+    def read_command(self, command, useCache = True) :
+        """
+        Query the device, single cached parameters are answered from the cache
+        """
+        match = re.match(r"\A([A-Za-z])\?\Z", command.strip())
+        with self._lock :
+            # a query may set parameters as well, e.g. C1f? selects channel 1
+            self._invalidate(command)
+            key = None
+            if match and (match.group(1) in Device.CACHED_PARAMETERS) and (self.cacheTTL > 0) :
+                key = (self._channel, match.group(1))
+                entry = self._cache.get(key)
+                if useCache and (entry is not None) and (time.monotonic() - entry[1] < self.cacheTTL) :
+                    return entry[0]
+            self._ser.write(bytes(command, 'utf-8'))
             retData = self._ser.readline().decode('utf-8').rstrip()
-            print(retData)
+            #time.sleep(0.2)
+            while (self._ser.in_waiting) :
+                retData = self._ser.readline().decode('utf-8').rstrip()
+                if self.verbose :
+                    print(retData)
+            if key is not None :
+                self._cache[key] = (retData, time.monotonic())
         return retData
         
 
+class Sweep() :
+    """
+    Frequency/power list sweep stepped through by a thread on the Pi
+
+    The serial commands of all points are encoded once when the list is loaded.
+    Points are written at absolute deadlines, so the dwell per point is only
+    limited by the time it takes to send the command over the serial link.
+    Console commands (SWEEP:<command>):
+        LOAD f,p,d;f,p,d;... - frequency in MHz, power in dBm and dwell in s per point.
+            points may also be separated by spaces, as needed in machine mode
+        START [repeats[,pin]] - run the list repeats times (0: until stopped). with a
+            BCM pin number, every pass waits for a rising edge on that pin
+        STOP - stop after the current point
+        STATUS - operation status bits, current point, number of points, current pass
+    """
+    # bits of the SCPI operation status register, as used by the SCPI server
+    OPER_SWEEPING = 1 << 3
+    OPER_WAIT_TRIGGER = 1 << 5
+
+    def __init__(self, device) :
+        self._device = device
+        self._commands = []
+        self._dwells = []
+        self._thread = None
+        self._stop = threading.Event()
+        self.status = 0
+        self.point = 0
+        self.sweepPass = 0
+
+    def handle_command(self, command) :
+        """
+        """
+        name, _, args = command.strip().partition(" ")
+        name = name.upper()
+        if name == "LOAD" :
+            return self.load(args)
+        elif name == "START" :
+            try :
+                args = [int(arg) for arg in args.split(",") if arg.strip()]
+            except ValueError :
+                return "Invalid SWEEP arguments"
+            if len(args) > 2 :
+                return "Invalid SWEEP arguments"
+            return self.start(*args)
+        elif name == "STOP" :
+            return self.stop()
+        elif name == "STATUS" :
+            return "%d,%d,%d,%d" % (self.status, self.point, len(self._commands), self.sweepPass)
+        else :
+            return "Invalid SWEEP command"
+
+    def load(self, points) :
+        """
+        Parse and encode a list of frequency,power,dwell triples
+        @param points: triples separated by semicolons
+        @return: number of points
+        """
+        if self.running() :
+            return "Sweep running"
+        commands = []
+        dwells = []
+        lastPower = None
+        for point in re.split(r"[;\s]+", points) :
+            if not point.strip() :
+                continue
+            try :
+                freq, power, dwell = [float(value) for value in point.split(",")]
+            except ValueError :
+                return "Invalid sweep point: %s" % point
+            # the power is only sent when it changes, the first point always sets it
+            command = "f%.7f" % freq
+            if power != lastPower :
+                command += "W%.3f" % power
+                lastPower = power
+            commands.append(bytes(command, 'utf-8'))
+            dwells.append(dwell)
+        self._commands, self._dwells = commands, dwells
+        return len(commands)
+
+    def running(self) :
+        return (self._thread is not None) and self._thread.is_alive()
+
+    def start(self, repeats = 1, triggerPin = None) :
+        """
+        Start the sweep thread
+        """
+        if self.running() :
+            return "Sweep running"
+        if not self._commands :
+            return "No sweep loaded"
+        if triggerPin is not None :
+            import RPi.GPIO as GPIO
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setup(triggerPin, GPIO.IN)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(repeats, triggerPin), daemon=True)
+        self._thread.start()
+        return len(self._commands)
+
+    def stop(self) :
+        """
+        Stop the sweep thread and wait for it to finish
+        """
+        if self._thread is not None :
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.status
+
+    def _wait_trigger(self, triggerPin) :
+        import RPi.GPIO as GPIO
+        self.status |= Sweep.OPER_WAIT_TRIGGER
+        # poll with a timeout so the sweep can be stopped while waiting
+        while not self._stop.is_set() :
+            if GPIO.wait_for_edge(triggerPin, GPIO.RISING, timeout=100) is not None :
+                break
+        self.status &= ~Sweep.OPER_WAIT_TRIGGER
+
+    def _run(self, repeats, triggerPin) :
+        self.status = Sweep.OPER_SWEEPING
+        self.sweepPass = 0
+        while (not repeats or self.sweepPass < repeats) and not self._stop.is_set() :
+            if triggerPin is not None :
+                self._wait_trigger(triggerPin)
+            deadline = time.perf_counter()
+            for idx, command in enumerate(self._commands) :
+                if self._stop.is_set() :
+                    break
+                self.point = idx
+                self._device.write_bytes(command, drain = True)
+                deadline += self._dwells[idx]
+                self._stop.wait(max(deadline - time.perf_counter(), 0))
+            self.sweepPass += 1
+        self.status = 0
+
+
 
 """
 Helper functions
@@ -73,6 +296,10 @@ def handle_input(devices) :
 Program
 """
 if __name__ == "__main__" :
+    if sys.argv[1:2] == ["--machine"] :
+        # python RPi_windfreak_interface.py --machine <port>
+        run_machine(Device(sys.argv[2], verbose = False))
+        sys.exit()
     print(os.listdir("/dev/"))
     print("Please enter port")
     port = input()
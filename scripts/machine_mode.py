@@ -0,0 +1,50 @@
+import os
+import re
+import sys
+
+"""
+Machine mode shared by the SSH scripts: batched commands with framed replies
+"""
+def handle_batch(device, data, seq) :
+    """
+    Execute the commands of a batch separated by newlines or semicolons
+    @param device: object with a handle_command(cmdType, command) method
+    @return: one framed reply line per command ("<seq> OK <result>" or
+        "<seq> ERR <message>") and the next sequence number
+    """
+    replies = []
+    for command in re.split(r"[;\n]", data) :
+        command = command.strip()
+        if not command :
+            continue
+        try :
+            cmdType, _, command = command.partition(":")
+            replies.append("%d OK %s" % (seq, device.handle_command(cmdType, command)))
+        except Exception as e :
+            replies.append("%d ERR %s" % (seq, e))
+        seq += 1
+    return "".join(reply.replace("\n", " ") + "\n" for reply in replies), seq
+
+def run_machine(device, inFile = None, outFile = None) :
+    """
+    Machine mode: read whatever commands are waiting on stdin and answer them
+    with a single write, so a batch costs one SSH round trip
+    @param inFile, outFile: replace stdin and stdout
+    """
+    inFile = sys.stdin if inFile is None else inFile
+    outFile = sys.stdout if outFile is None else outFile
+    seq = 0
+    pending = ""
+    while True :
+        data = os.read(inFile.fileno(), 65536)
+        if data :
+            # an unterminated last line is kept for the next read
+            batch, _, pending = (pending + data.decode('utf-8')).rpartition("\n")
+        else :
+            batch = pending
+        replies, seq = handle_batch(device, batch, seq)
+        if replies :
+            outFile.write(replies)
+            outFile.flush()
+        if not data :
+            break
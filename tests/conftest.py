@@ -0,0 +1,182 @@
+#Shared fixtures of the tests
+#
+#The server modules are flat modules imported from their folders. PiGPIO is run
+#on the gpiochip backend, whose ioctls are answered by FakeGPIOKernel, so the
+#tests need neither a Pi nor RPi.GPIO.
+#
+#Tests marked bench measure throughput and latency and print their numbers. They
+#are skipped unless pytest is run with --bench, e.g.
+#    python -m pytest tests -m bench --bench -s
+
+import errno
+import json
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'SCPI_Server'), os.path.join(ROOT, 'SCPI_Client'), os.path.join(ROOT, 'scripts')]
+# read by interface_gpio on import
+os.environ['GPIO_BACKEND'] = 'chardev'
+
+import gpiochip
+
+def pytest_addoption(parser):
+    parser.addoption('--bench', action = 'store_true', help = 'run the benchmarks')
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'bench: benchmark, only run with --bench')
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--bench'):
+        return
+    skip = pytest.mark.skip(reason = 'benchmark, run with --bench')
+    for item in items:
+        if 'bench' in item.keywords:
+            item.add_marker(skip)
+
+def best_of(function, repeats = 5):
+    ''' return the shortest of several wall clock times of function() in seconds '''
+    import time
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+class FakeGPIOKernel(object):
+    '''
+        answers the gpiochip ioctls like the kernel, see gpiochip.Chip(ioctl = ...)
+
+        lines held by an open request can not be requested again (EBUSY). every
+        request gets the read end of a pipe as its file descriptor, a request is
+        released when that descriptor is closed.
+    '''
+    def __init__(self, lines = 54):
+        self.lines = lines
+        # read fd: (offsets, inode, write fd)
+        self.requests = {}
+        # offset: level, offset: flags
+        self.levels = {}
+        self.flags = {}
+        self.line_requests = 0
+        self.set_values_calls = 0
+        # (time, {offset: level}) of every write
+        self.writes = []
+
+    def _released(self, fd):
+        offsets, inode, write_fd = self.requests[fd]
+        try:
+            return os.fstat(fd).st_ino != inode
+        except OSError:
+            return True
+
+    def held(self):
+        ''' return the offsets of all open requests '''
+        for fd in list(self.requests):
+            if self._released(fd):
+                os.close(self.requests.pop(fd)[2])
+        return [offset for offsets, _, _ in self.requests.values() for offset in offsets]
+
+    def _configure(self, offsets, config):
+        for offset in offsets:
+            self.flags[offset] = config.flags
+        for idx in range(config.num_attrs):
+            attr = config.attrs[idx]
+            for bit, offset in enumerate(offsets):
+                if attr.mask & (1<<bit):
+                    if attr.attr.id == gpiochip.GPIO_V2_LINE_ATTR_ID_FLAGS:
+                        self.flags[offset] = attr.attr.flags
+                    elif attr.attr.id == gpiochip.GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES:
+                        self.levels[offset] = (attr.attr.values >> bit) & 1
+
+    def __call__(self, fd, request, arg, mutate = True):
+        if request == gpiochip.GPIO_GET_CHIPINFO_IOCTL:
+            arg.name = b'gpiochip0'
+            arg.label = b'fake'
+            arg.lines = self.lines
+        elif request == gpiochip.GPIO_V2_GET_LINE_IOCTL:
+            offsets = list(arg.offsets[:arg.num_lines])
+            if set(offsets) & set(self.held()):
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+            read_fd, write_fd = os.pipe()
+            self.requests[read_fd] = (offsets, os.fstat(read_fd).st_ino, write_fd)
+            arg.fd = read_fd
+            self.line_requests += 1
+            self._configure(offsets, arg.config)
+        elif request == gpiochip.GPIO_V2_LINE_SET_CONFIG_IOCTL:
+            self._configure(self.requests[fd][0], arg)
+        elif request == gpiochip.GPIO_V2_LINE_GET_VALUES_IOCTL:
+            offsets = self.requests[fd][0]
+            arg.bits = sum(self.levels.get(offset, 0)<<bit for bit, offset in enumerate(offsets) if arg.mask & (1<<bit))
+        elif request == gpiochip.GPIO_V2_LINE_SET_VALUES_IOCTL:
+            offsets = self.requests[fd][0]
+            self.set_values_calls += 1
+            levels = dict((offset, (arg.bits >> bit) & 1) for bit, offset in enumerate(offsets) if arg.mask & (1<<bit))
+            self.levels.update(levels)
+            self.writes.append((time.perf_counter(), levels))
+        else:
+            raise OSError(errno.ENOTTY, os.strerror(errno.ENOTTY))
+        return 0
+
+@pytest.fixture
+def kernel():
+    ''' fake kernel behind the chip used by the gpiochip module functions '''
+    kernel = FakeGPIOKernel()
+    gpiochip.cleanup()
+    gpiochip._edges.clear()
+    gpiochip._chip = gpiochip.Chip(os.devnull, ioctl = kernel)
+    yield kernel
+    gpiochip.cleanup()
+
+def write_pin_map(path, pins = range(2, 28), **sections):
+    ''' write a pin map with output pins and the given sections, returns its path '''
+    pin_map = dict(sections, pins = [pin if isinstance(pin, dict) else {'gpio': pin} for pin in pins])
+    with open(str(path), 'w') as f:
+        json.dump(pin_map, f)
+    return str(path)
+
+@pytest.fixture
+def pin_map():
+    ''' pin map of the device fixture, None for SCPI_Server/pinmap.json. override in a test module. '''
+    return None
+
+@pytest.fixture
+def device(kernel, pin_map, tmp_path, monkeypatch):
+    ''' PiGPIO on the fake chip with the pins of the pin map set up '''
+    import interface_gpio
+    if pin_map is not None:
+        monkeypatch.setattr(interface_gpio.PiGPIO, 'pin_map_path', pin_map)
+    monkeypatch.setattr(interface_gpio.PiGPIO, 'states_path', str(tmp_path/'state'/'gpio_states.json'))
+    monkeypatch.setattr(interface_gpio.PiGPIO, 'command_cache_path', str(tmp_path/'cache'/'command_cache.pickle'))
+    device = interface_gpio.PiGPIO()
+    device.initialise()
+    yield device
+    device._sampler.stop()
+
+@pytest.fixture
+def serve():
+    ''' function starting a threaded TCP server on a loopback port, returns its address '''
+    import threading
+    from socketserver import ThreadingTCPServer
+    servers = []
+    def start(handler):
+        tcp_server = ThreadingTCPServer(('127.0.0.1', 0), handler)
+        tcp_server.daemon_threads = True
+        threading.Thread(target = tcp_server.serve_forever, daemon = True).start()
+        servers.append(tcp_server)
+        return tcp_server.server_address
+    yield start
+    for tcp_server in servers:
+        tcp_server.shutdown()
+        tcp_server.server_close()
+
+@pytest.fixture
+def server(device, serve, monkeypatch):
+    ''' address of a threaded pi_server serving device '''
+    import pi_server
+    monkeypatch.setattr(pi_server.PiGPIOHandler, 'hGPIO', device)
+    return serve(pi_server.PiGPIOHandler)
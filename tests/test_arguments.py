@@ -0,0 +1,25 @@
+import pytest
+
+import scpi_event as se
+from scpi_base import ArgFloat, ArgInt
+
+def test_float_arguments_accept_units_and_limits():
+    arg = ArgFloat(0., 10., units={'S': 1., 'MS': 1e-3})
+    assert arg('2.5') == 2.5
+    assert arg('20 ms') == pytest.approx(0.02)
+    assert arg('MAX') == 10.
+    assert ArgInt(0, 255, base=0)('0x10') == 16
+
+@pytest.mark.parametrize('text', ['nan', 'inf', '-inf', 'NaN', '1e999'])
+def test_float_arguments_must_be_finite(text):
+    for arg in (ArgFloat(), ArgFloat(0., 10.)):
+        with pytest.raises(se.SCPIEvent) as err:
+            arg(text)
+        assert err.value.args[0] == se.CODE_DATA_OUT_OF_RANGE
+
+@pytest.mark.parametrize('delay', ['nan', 'inf'])
+def test_pulses_with_a_non_finite_delay_are_rejected(device, kernel, delay):
+    device.process('GPIO:SOUR:DIG:PULS5 1,%s'%delay)
+    assert device.process('SYST:ERR?')[0].startswith('-222,')
+    assert device.process('GPIO:SOUR:DIG:DATA5?') == ['0']
+    assert kernel.levels.get(5, 0) == 0
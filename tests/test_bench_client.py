@@ -0,0 +1,22 @@
+#Pipelined versus sequential queries of PiClient against a loopback server
+
+import pytest
+
+from conftest import best_of
+from pi_client import PiClient
+
+QUERIES = 200
+
+@pytest.mark.bench
+def test_pipelined_queries(server):
+    client = PiClient(*server)
+    lines = ['GPIO:MEAS:DIG:DATA%d?'%(5+idx%8) for idx in range(QUERIES)]
+    try:
+        assert client.pipeline(lines) == [client.query(line) for line in lines]
+        sequential = best_of(lambda: [client.query(line) for line in lines])
+        pipelined = best_of(lambda: client.pipeline(lines))
+    finally:
+        client.close()
+    print('\n%d queries: sequential %.1f ms, pipelined %.1f ms (%.2fx)'%
+          (QUERIES, 1e3*sequential, 1e3*pipelined, sequential/pipelined))
+    assert pipelined < sequential
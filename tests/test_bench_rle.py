@@ -0,0 +1,41 @@
+#Size and encoding time of sampled GPIO buffers in the ASCII and RLE formats
+
+import random
+
+import pytest
+
+from conftest import best_of
+from gpio_codec import encode_transitions
+from pi_client import decode_transitions
+
+SAMPLES = 100000
+# fraction of samples at which a pin toggles
+DENSITIES = (0.001, 0.01, 0.1, 0.5)
+PINS = (5, 6, 12, 13, 16, 19, 20, 21)
+
+def bank_samples(density, seed = 1):
+    ''' SAMPLES bank states of PINS, one of the pins toggles with probability density per sample '''
+    rng = random.Random(seed)
+    state, samples = 0, []
+    for _ in range(SAMPLES):
+        if rng.random() < density:
+            state ^= 1<<rng.choice(PINS)
+        samples.append(state)
+    return samples
+
+def ascii_format(samples):
+    ''' the ASCii reply of PiGPIO.get_stream_data '''
+    return ('%d,%s'%(0, ','.join(str(sample) for sample in samples))).encode()
+
+@pytest.mark.bench
+@pytest.mark.parametrize('density', DENSITIES)
+def test_rle_size(density):
+    samples = bank_samples(density)
+    rle = encode_transitions(samples, 0, 1e-4)
+    text = ascii_format(samples)
+    assert decode_transitions(rle) == (0, 1e-4, samples)
+    print('\n%d samples, toggle density %g: ASCII %d B in %.1f ms, RLE %d B in %.1f ms (decoded in %.1f ms)'%
+          (SAMPLES, density, len(text), 1e3*best_of(lambda: ascii_format(samples), 3),
+           len(rle), 1e3*best_of(lambda: encode_transitions(samples, 0, 1e-4), 3),
+           1e3*best_of(lambda: decode_transitions(rle), 3)))
+    assert len(rle) < len(text)
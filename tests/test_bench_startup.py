@@ -0,0 +1,63 @@
+#Time to the first response of a freshly started server and the cost of building
+#the command table with and without the command cache
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import ROOT, best_of
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _first_response(args, timeout = 10.):
+    ''' start pi_server.py with args and return the seconds until *IDN? is answered '''
+    port = _free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'SCPI_Server', 'pi_server.py'), '--port', str(port)]+args,
+                              stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        while time.perf_counter()-start < timeout:
+            try:
+                sock = socket.create_connection(('127.0.0.1', port), timeout)
+            except ConnectionRefusedError:
+                time.sleep(0.001)
+                continue
+            with sock:
+                sock.sendall(b'*IDN?\n')
+                reply = sock.makefile('rb').readline()
+            assert reply.startswith(b'SQDLab')
+            return time.perf_counter()-start
+        raise TimeoutError('no response from pi_server.py')
+    finally:
+        server.kill()
+        server.wait()
+
+@pytest.mark.bench
+def test_time_to_first_response(tmp_path):
+    # without a GPIO chip the bank never becomes ready, the pending parser answers *IDN?
+    args = ['--backend', 'chardev', '--chip', '/nonexistent', '--cache-dir', str(tmp_path), '--state-dir', str(tmp_path)]
+    interpreter = best_of(lambda: subprocess.run([sys.executable, '-c', 'pass'], check = True), 3)
+    response = min(_first_response(args) for _ in range(3))
+    print('\ninterpreter start-up %.0f ms, first response of pi_server.py %.0f ms'%(1e3*interpreter, 1e3*response))
+
+@pytest.mark.bench
+def test_command_table(kernel, tmp_path, monkeypatch):
+    import interface_gpio
+    path = tmp_path/'command_cache.pickle'
+    monkeypatch.setattr(interface_gpio.PiGPIO, 'command_cache_path', str(path))
+    def build(cached):
+        if not cached and path.exists():
+            path.unlink()
+        device = interface_gpio.PiGPIO()
+        device._sampler.stop()
+    cold = best_of(lambda: build(False))
+    warm = best_of(lambda: build(True))
+    assert path.exists()
+    print('\nPiGPIO() without command cache %.1f ms, with command cache %.1f ms'%(1e3*cold, 1e3*warm))
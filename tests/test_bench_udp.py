@@ -0,0 +1,61 @@
+#Round trip latency of single commands via TCP and via UDP datagrams
+#
+#UDP is meant for single-shot senders, so TCP is timed both on a persistent
+#connection and with a new connection per command.
+
+import socket
+import statistics
+import threading
+import time
+from socketserver import UDPServer
+
+import pytest
+
+from pi_client import PiClient
+
+ROUNDS = 500
+LINE = 'GPIO:MEAS:DIG:DATA5?'
+
+@pytest.fixture
+def udp_server(server):
+    ''' address of a UDP listener next to the TCP server of the server fixture '''
+    import pi_server
+    udp = UDPServer(('127.0.0.1', 0), pi_server.PiGPIOUDPHandler)
+    threading.Thread(target = udp.serve_forever, daemon = True).start()
+    yield udp.server_address
+    udp.shutdown()
+    udp.server_close()
+
+def _latencies(request):
+    times = []
+    for seq in range(ROUNDS):
+        start = time.perf_counter()
+        request(seq)
+        times.append(time.perf_counter()-start)
+    return times
+
+@pytest.mark.bench
+def test_udp_latency(server, udp_server):
+    client = PiClient(*server)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1.)
+    def udp(seq):
+        sock.sendto(('%d %s'%(seq, LINE)).encode(), udp_server)
+        reply = sock.recv(1024).decode()
+        assert reply.startswith('%d '%seq) and ('!' not in reply)
+    def tcp_single_shot(seq):
+        with PiClient(*server) as single:
+            single.query(LINE)
+    try:
+        client.query(LINE)
+        udp(ROUNDS)
+        tcp_times = _latencies(lambda seq: client.query(LINE))
+        connect_times = _latencies(tcp_single_shot)
+        udp_times = _latencies(udp)
+    finally:
+        client.close()
+        sock.close()
+    print('\n%d round trips of %s, median / 99th percentile'%(ROUNDS, LINE))
+    for name, times in (('TCP', tcp_times), ('TCP, new connection', connect_times), ('UDP', udp_times)):
+        times.sort()
+        print('%s: %.0f us / %.0f us'%(name, 1e6*statistics.median(times), 1e6*times[int(.99*len(times))]))
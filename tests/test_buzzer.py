@@ -0,0 +1,49 @@
+import os
+import time
+
+import pytest
+
+import buzzer
+
+class FakePWM(object):
+    def __init__(self):
+        self.calls = []
+
+    def ChangeFrequency(self, frequency):
+        self.calls.append(('f', frequency))
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.calls.append(('d', duty_cycle))
+
+@pytest.fixture
+def tune(tmp_path):
+    path = tmp_path/'tune.csv'
+    path.write_text('440,0.01\n440,0.01\n0,0.01\n880,0.01\n')
+    return str(path)
+
+def test_tunes_are_compiled_once(tune, monkeypatch):
+    assert list(buzzer.load_tune(tune)) == [440, 0.01, 440, 0.01, 0, 0.01, 880, 0.01]
+    assert os.path.exists(tune+'.bin')
+    def parse(csv_file):
+        raise AssertionError('tune parsed again')
+    monkeypatch.setattr(buzzer, 'parse_pwm_file', parse)
+    assert list(buzzer.load_tune(tune)) == [440, 0.01, 440, 0.01, 0, 0.01, 880, 0.01]
+
+def test_changed_tunes_are_compiled_again(tune):
+    buzzer.load_tune(tune)
+    with open(tune, 'a') as f:
+        f.write('220,0.02\n')
+    assert list(buzzer.load_tune(tune))[-2:] == [220, 0.02]
+
+def test_corrupt_cache_is_ignored(tune):
+    buzzer.load_tune(tune)
+    with open(tune+'.bin', 'wb') as f:
+        f.write(b'TU')
+    assert len(buzzer.load_tune(tune)) == 8
+
+def test_play_skips_redundant_changes(tune):
+    pwm = FakePWM()
+    start = time.perf_counter()
+    buzzer.play(pwm, buzzer.load_tune(tune))
+    assert time.perf_counter()-start >= 0.04
+    assert pwm.calls == [('f', 440), ('d', 50), ('d', 0), ('f', 880), ('d', 50)]
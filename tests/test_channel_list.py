@@ -0,0 +1,33 @@
+import pytest
+
+import scpi_event as se
+from scpi_base import ChannelList
+
+def test_channel_lists_are_parsed_into_ranges():
+    channels = ChannelList('(@1, 3,5:8,12:10)')
+    assert channels.ranges == [(1, 1), (3, 3), (5, 8), (12, 10)]
+    assert list(channels) == [1, 3, 5, 6, 7, 8, 12, 11, 10]
+    assert len(channels) == 9
+    assert channels.bounds() == (1, 12)
+    assert str(channels) == '(@1,3,5:8,12:10)'
+
+@pytest.mark.parametrize('text', ['(@)', '(@1,,3)', '(@a)', '(@1:)', '(1,2)', '(@1:2:3)'])
+def test_invalid_channel_lists_are_rejected(text):
+    with pytest.raises(se.SCPIEvent) as err:
+        ChannelList(text)
+    assert err.value.args[0] == se.CODE_SYNTAX_ERROR
+
+def test_channel_lists_write_all_pins_at_once(device, kernel):
+    calls = kernel.set_values_calls
+    device.process('GPIO:SOUR:DIG:DATA 1,(@5,7,9:11)')
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    assert kernel.set_values_calls == calls+1
+    assert device.process('GPIO:SOUR:DIG:DATA? (@4:7)') == ['0,1,0,1']
+
+@pytest.mark.parametrize('line', ['GPIO:SOUR:DIG:DATA 1,(@0:5)', 'GPIO:SOUR:DIG:DATA 1,(@5,41)',
+                                  'GPIO:SOUR:DIG:DATA5 1,(@6)', '*RST (@1)'])
+def test_channel_lists_out_of_range_are_rejected(device, kernel, line):
+    calls = kernel.set_values_calls
+    device.process(line)
+    assert device.process('SYST:ERR?')[0].startswith('-102,')
+    assert kernel.set_values_calls == calls
@@ -0,0 +1,17 @@
+import os
+
+from scpi_base import SCPIBase
+
+def test_cache_is_saved_in_a_private_folder_and_reused(tmp_path):
+    path = str(tmp_path/'cache'/'command_cache.pickle')
+    parser = SCPIBase()
+    parser.save_command_table(path, 'key')
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+    assert SCPIBase().load_command_table(path, 'key')
+    assert not SCPIBase().load_command_table(path, 'other key')
+
+def test_cache_writable_by_others_is_ignored(tmp_path):
+    path = str(tmp_path/'command_cache.pickle')
+    SCPIBase().save_command_table(path, 'key')
+    os.chmod(path, 0o666)
+    assert not SCPIBase().load_command_table(path, 'key')
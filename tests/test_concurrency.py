@@ -0,0 +1,44 @@
+import socket
+import threading
+import time
+
+def query(sock, reader, line):
+    sock.sendall((line+'\n').encode())
+    return reader.readline().decode().rstrip('\n')
+
+def test_concurrent_clients_keep_their_sessions(server):
+    failures = []
+    def run(pin):
+        try:
+            with socket.create_connection(server) as sock:
+                reader = sock.makefile('rb')
+                for n in range(100):
+                    reply = query(sock, reader, 'GPIO:SOUR:DIG:DATA%d %d;DATA%d?'%(pin, n%2, pin))
+                    assert reply == str(n%2), (pin, n, reply)
+                # errors only go to the error queue of the client that caused them
+                query(sock, reader, 'GPIO:SOUR:DIG:DATA99?')
+                assert query(sock, reader, 'SYST:ERR?').startswith('-102,')
+                assert query(sock, reader, 'SYST:ERR?') == '0,"No error"'
+        except Exception as err:
+            failures.append(err)
+    threads = [threading.Thread(target = run, args = (pin,)) for pin in range(2, 10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not failures
+
+def test_third_client_is_served_while_two_pulse(server):
+    pulsers = [socket.create_connection(server) for _ in range(2)]
+    start = time.perf_counter()
+    for pin, sock in zip((5, 6), pulsers):
+        sock.sendall(b'GPIO:SOUR:DIG:PULS%d 1,1;DATA%d?\n'%(pin, pin))
+    time.sleep(0.2)
+    with socket.create_connection(server) as sock:
+        sent = time.perf_counter()
+        assert query(sock, sock.makefile('rb'), '*IDN?').startswith('SQDLab')
+        assert time.perf_counter()-sent < 0.3
+    for sock in pulsers:
+        assert sock.makefile('rb').readline() == b'0\n'
+        sock.close()
+    assert time.perf_counter()-start > 0.9
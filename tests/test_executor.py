@@ -0,0 +1,78 @@
+import threading
+import time
+
+from executor import CommandExecutor
+from scpi_base import SCPIBase
+
+def session(priority):
+    session = SCPIBase.Session()
+    session.priority = priority
+    return session
+
+def submit_all(executor, lines):
+    ''' submit (key, line, priority) tuples from one thread each, returns the threads '''
+    threads = [threading.Thread(target = executor.submit, args = (key, line, session(priority)), daemon = True)
+               for key, line, priority in lines]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def queued(executor, count):
+    ''' wait until at least count lines are queued '''
+    deadline = time.monotonic()+5.
+    while (executor.stats()[0] < count) and (time.monotonic() < deadline):
+        time.sleep(0.001)
+    assert executor.stats()[0] >= count
+
+def run_paused(lines):
+    ''' queue all lines on a single worker, then return the order they are executed in '''
+    order = []
+    executor = CommandExecutor(lambda line, session, allowed: order.append(line), workers = 1)
+    with executor.pause():
+        threads = submit_all(executor, lines)
+        queued(executor, len(lines))
+    for thread in threads:
+        thread.join(5.)
+    return order
+
+def test_connections_share_the_executor_by_weight():
+    lines = [('low', 'L', SCPIBase.PRIORITY_LOW)]*20 + [('normal', 'N', SCPIBase.PRIORITY_NORMAL)]*20
+    order = run_paused(lines)
+    assert len(order) == 40
+    # NORMal has 4x the weight of LOW
+    assert order[:10].count('L') == 2
+    assert order[:20].count('L') == 4
+
+def test_critical_lines_are_taken_first():
+    lines = [('normal', 'N', SCPIBase.PRIORITY_NORMAL)]*5 + [('high', 'H', SCPIBase.PRIORITY_HIGH)]*5
+    order = []
+    executor = CommandExecutor(lambda line, session, allowed: order.append(line), workers = 1)
+    with executor.pause():
+        threads = submit_all(executor, lines)
+        queued(executor, len(lines))
+        threads += submit_all(executor, [('critical', 'C', SCPIBase.PRIORITY_CRITICAL)])
+        queued(executor, len(lines)+1)
+    for thread in threads:
+        thread.join(5.)
+    assert order[0] == 'C'
+
+def test_flooding_low_client_does_not_starve_a_high_one():
+    def process(line, session, allowed):
+        time.sleep(0.005)
+    executor = CommandExecutor(process, workers = 1)
+    stop = threading.Event()
+    def flood():
+        while not stop.is_set():
+            executor.submit('low', 'L', session(SCPIBase.PRIORITY_LOW))
+    flooders = [threading.Thread(target = flood, daemon = True) for _ in range(20)]
+    for thread in flooders:
+        thread.start()
+    queued(executor, 19)
+    high = session(SCPIBase.PRIORITY_HIGH)
+    for _ in range(10):
+        executor.submit('high', 'H', high)
+    stop.set()
+    # in order of arrival every HIGH line would wait for about 20 LOW lines (100 ms)
+    assert executor.stats(SCPIBase.PRIORITY_HIGH)[3] < 0.05
+    for thread in flooders:
+        thread.join(5.)
@@ -0,0 +1,69 @@
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import pi_server
+from pi_gateway import PiGateway, PiGatewayHandler
+
+ROUTES = [
+    {'command': 'GPIO', 'channels': [1, 20], 'backend': 'a'},
+    {'command': 'GPIO', 'channels': [21, 40], 'backend': 'b', 'offset': 10},
+    {'command': 'GPIO', 'backend': 'a'}
+]
+
+@pytest.fixture
+def gateway(device, serve, monkeypatch):
+    ''' connection to a gateway in front of two pi_servers on loopback ports '''
+    monkeypatch.setattr(pi_server.PiGPIOHandler, 'hGPIO', device)
+    backends = {'a': serve(pi_server.PiGPIOHandler), 'b': serve(pi_server.PiGPIOHandler)}
+    gateway = PiGateway(backends, ROUTES)
+    monkeypatch.setattr(PiGatewayHandler, 'gateway', gateway)
+    sock = socket.create_connection(serve(PiGatewayHandler))
+    reader = sock.makefile('rb')
+    yield sock, reader
+    reader.close()
+    sock.close()
+    # the handler closes the backend connections when it sees the client go
+    deadline = time.perf_counter()+1.
+    while gateway._links and (time.perf_counter() < deadline):
+        time.sleep(0.01)
+
+def query(connection, line):
+    sock, reader = connection
+    sock.sendall((line+'\n').encode())
+    return reader.readline().decode().rstrip('\n')
+
+def test_commands_are_routed_by_channel(gateway, kernel):
+    assert query(gateway, 'GPIO:SOUR:DIG:DATA5 1;DATA25 1;DATA5?;DATA25?;:::*IDN?') == '1;1;SQDLab, PiGateway, ?, ?'
+    assert (kernel.levels[5], kernel.levels[15]) == (1, 1)
+    # a channel list is split between the backends and the replies are joined in order
+    assert query(gateway, 'GPIO:SOUR:DIG:DATA? (@4:5,24:25)') == '0,1,0,1'
+
+def test_backend_errors_reach_the_gateway_queue(gateway):
+    assert query(gateway, 'GPIO:SOUR:DIG:DATA39?') == ''
+    error = query(gateway, 'SYST:ERR?')
+    assert error.startswith('-300,') and error.endswith(';on b"')
+    assert query(gateway, 'SYST:ERR?') == '0,"No error"'
+
+def test_backends_run_concurrently(gateway):
+    start = time.perf_counter()
+    assert query(gateway, 'GPIO:SOUR:DIG:PULS5 1,0.5;PULS25 1,0.5;DATA5?;DATA25?') == '0;0'
+    assert time.perf_counter()-start < 0.9
+
+def test_unreachable_backend(device, serve, monkeypatch):
+    monkeypatch.setattr(pi_server.PiGPIOHandler, 'hGPIO', device)
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    backends = {'a': serve(pi_server.PiGPIOHandler), 'b': closed.getsockname()}
+    closed.close()
+    gateway = PiGateway(backends, ROUTES)
+    assert gateway.process('GPIO:SOUR:DIG:DATA5?;DATA25?') == ['0', '']
+    assert gateway.process('SYST:ERR?')[0].startswith('-241,"Hardware missing;backend b')
+
+def test_gateway_import_starts_no_threads():
+    code = 'import threading, pi_gateway; print(threading.active_count())'
+    output = subprocess.check_output([sys.executable, '-c', code], cwd = pi_server.__file__.rsplit('/', 1)[0])
+    assert output.strip() == b'1'
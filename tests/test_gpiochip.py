@@ -0,0 +1,35 @@
+import pytest
+
+import gpiochip
+
+def test_setup_groups_one_after_another(kernel):
+    gpiochip.setup([2, 3], gpiochip.OUT, initial = 1)
+    gpiochip.setup([4, 5], gpiochip.IN, pull_up_down = gpiochip.PUD_UP)
+    assert sorted(kernel.held()) == [2, 3, 4, 5]
+    assert kernel.levels[2] == kernel.levels[3] == 1
+    assert kernel.flags[4] & gpiochip.GPIO_V2_LINE_FLAG_BIAS_PULL_UP
+    # a line set up later, e.g. by a lazily configured pin
+    gpiochip.setup(6, gpiochip.OUT)
+    gpiochip.output([2, 6], [0, 1])
+    assert sorted(kernel.held()) == [2, 3, 4, 5, 6]
+    assert (kernel.levels[2], kernel.levels[3], kernel.levels[6]) == (0, 1, 1)
+    kernel.levels[5] = 1
+    assert gpiochip.inputs([4, 5]) == [0, 1]
+
+def test_reconfigure_keeps_the_request(kernel):
+    gpiochip.setup([2, 3], gpiochip.OUT)
+    requests = kernel.line_requests
+    gpiochip.setup(3, gpiochip.IN)
+    assert kernel.line_requests == requests
+    assert kernel.flags[3] & gpiochip.GPIO_V2_LINE_FLAG_INPUT
+
+def test_failed_request_restores_the_lines_in_use(kernel):
+    gpiochip.setup([2, 3], gpiochip.OUT, initial = 1)
+    # a line held by another consumer
+    other = gpiochip.LineRequest(gpiochip.chip().fd, [7], [gpiochip.GPIO_V2_LINE_FLAG_INPUT], ioctl = kernel)
+    with pytest.raises(OSError):
+        gpiochip.setup(7, gpiochip.OUT)
+    assert sorted(kernel.held()) == [2, 3, 7]
+    gpiochip.output(2, 0)
+    assert kernel.levels[2] == 0
+    other.close()
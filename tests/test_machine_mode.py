@@ -0,0 +1,24 @@
+import io
+import os
+
+from machine_mode import handle_batch, run_machine
+
+class EchoDevice(object):
+    def handle_command(self, cmdType, command):
+        if cmdType != 'READ':
+            raise ValueError('Invalid CMD Type')
+        return command
+
+def test_batch_replies_are_framed_in_order():
+    replies, seq = handle_batch(EchoDevice(), 'READ:a;WRITE:b\nREAD:c\n', 5)
+    assert replies == '5 OK a\n6 ERR Invalid CMD Type\n7 OK c\n'
+    assert seq == 8
+
+def test_unterminated_last_line_is_run_at_the_end():
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b'READ:a;READ:b\nREAD:c')
+    os.close(write_fd)
+    out = io.StringIO()
+    with os.fdopen(read_fd, 'rb') as stdin:
+        run_machine(EchoDevice(), stdin, out)
+    assert out.getvalue() == '0 OK a\n1 OK b\n2 OK c\n'
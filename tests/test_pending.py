@@ -0,0 +1,16 @@
+from scpi_base import SCPIBase
+from pi_server import PendingGPIO
+
+def test_restricted_clients_wait_for_the_hardware():
+    pending = PendingGPIO()
+    session = SCPIBase.Session()
+    assert pending.process('*RST;SYST:TRAC:STAT ON', session, {'*IDN'}) == []
+    assert pending.process('SYST:TRAC:STAT?', session) == ['0']
+    assert str(session.errors.popleft()).startswith('-241,')
+
+def test_unrestricted_clients_get_the_common_commands():
+    pending = PendingGPIO()
+    session = SCPIBase.Session()
+    assert pending.process('*IDN?', session) == ['SQDLab, PiGPIO (initialising), ?, ?']
+    pending.process('GPIO:SOUR:DIG:DATA5 1', session)
+    assert 'in progress' in str(session.errors.popleft())
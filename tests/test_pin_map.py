@@ -0,0 +1,43 @@
+import pytest
+
+from conftest import write_pin_map
+from interface_gpio import GPIO, load_pin_map
+
+@pytest.fixture
+def pin_map(tmp_path):
+    return write_pin_map(tmp_path/'pinmap.json', [5, {'gpio': 6, 'mode': 'IN', 'pull': 'UP'}, {'gpio': 17, 'value': 1, 'val_fix': True}],
+                         defaults = {'description': 'test'}, aliases = {'GPIO:SW1:POSition': 5, 'GPIO:SW2:POSition': 6})
+
+def test_entries_take_missing_keys_from_the_defaults(pin_map):
+    pins, aliases, switches = load_pin_map(pin_map)
+    pins = dict((spec['gpio'], spec) for spec in pins)
+    assert (pins[5]['mode_rst'], pins[5]['val_rst'], pins[5]['description']) == (GPIO.OUT, False, 'test')
+    assert (pins[6]['mode_rst'], pins[6]['pud_rst']) == (GPIO.IN, GPIO.PUD_UP)
+    assert pins[17]['val_fix'] and pins[17]['val_rst']
+    assert aliases == {'GPIO:SW1:POSition': 5, 'GPIO:SW2:POSition': 6}
+    assert switches == []
+
+@pytest.mark.parametrize('pins,sections', [
+    ([{'gpio': 5, 'colour': 'red'}], {}),
+    ([5, 5], {}),
+    ([41], {}),
+    ([{'gpio': 5, 'mode': 'ALT0'}], {}),
+    ([{'gpio': 5, 'max_on': -1}], {}),
+    ([5], {'aliases': {'GPIO:SW1:POSition': 6}}),
+    ([{'gpio': 5, 'mode': 'IN'}, 6], {'switches': [{'name': 'SW', 'pins': [5, 6], 'positions': {'1': [1, 0]}}]}),
+    ([5, 6], {'switches': [{'name': 'SW', 'pins': [5, 6], 'positions': {'1': [1]}}]}),
+])
+def test_invalid_pin_maps_are_rejected(tmp_path, pins, sections):
+    with pytest.raises(ValueError):
+        load_pin_map(write_pin_map(tmp_path/'pinmap.json', pins, **sections))
+
+def test_only_pins_of_the_map_are_available(device):
+    device.process('GPIO:SOUR:DIG:DATA7 1')
+    assert device.process('SYST:ERR?')[0].startswith('-')
+
+def test_aliases_act_on_their_pins(device, kernel):
+    device.process('GPIO:SW1:POS 1')
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    assert kernel.levels[5] == 1
+    kernel.levels[6] = 1
+    assert device.process('GPIO:SW2:POS?') == ['1']
@@ -0,0 +1,52 @@
+import pytest
+
+from conftest import write_pin_map
+
+@pytest.fixture
+def pin_map(tmp_path):
+    return write_pin_map(tmp_path/'pinmap.json', [5] + [{'gpio': pin, 'setup': False} for pin in (12, 13, 18)])
+
+@pytest.fixture
+def pwmchip(tmp_path, monkeypatch):
+    ''' pwm sysfs directory with two exported channels '''
+    import interface_gpio
+    chip = tmp_path/'pwmchip0'
+    for channel in range(2):
+        (chip/('pwm%d'%channel)).mkdir(parents = True)
+        for name in ('period', 'duty_cycle', 'enable'):
+            (chip/('pwm%d'%channel)/name).write_text('0')
+    (chip/'npwm').write_text('2')
+    (chip/'export').write_text('')
+    monkeypatch.setattr(interface_gpio.PiGPIO, 'pwm_chip_path', str(chip))
+    return chip
+
+def read(chip, channel, name):
+    return int((chip/('pwm%d'%channel)/name).read_text())
+
+def test_hardware_pins_drive_their_sysfs_channel(pwmchip, device):
+    device.process('GPIO:SOUR:PWM12:FREQ 2000')
+    device.process('GPIO:SOUR:PWM12:DCYC 25')
+    device.process('GPIO:SOUR:PWM12:STAT ON')
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    assert (read(pwmchip, 0, 'period'), read(pwmchip, 0, 'duty_cycle'), read(pwmchip, 0, 'enable')) == (500000, 125000, 1)
+    assert device.process('GPIO:SOUR:DIG:IO12?') == ['PWM']
+
+def test_pins_sharing_a_channel_are_rejected(pwmchip, device):
+    device.process('GPIO:SOUR:PWM12:STAT ON')
+    device.process('GPIO:SOUR:PWM18:STAT ON')
+    assert device.process('SYST:ERR?')[0].startswith('-300,')
+    assert device.process('GPIO:SOUR:PWM18:STAT?') == ['0']
+    device.process('GPIO:SOUR:PWM13:STAT ON')
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    assert read(pwmchip, 1, 'enable') == 1
+
+def test_hardware_pins_can_leave_pwm(pwmchip, device):
+    device.process('GPIO:SOUR:PWM12:STAT ON')
+    device.process('GPIO:SOUR:DIG:IO12 OUT')
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    assert device.process('GPIO:SOUR:DIG:IO12?') == ['OUT']
+    assert read(pwmchip, 0, 'enable') == 0
+    # the channel is free for the other pin of the pair
+    device.process('GPIO:SOUR:PWM18:STAT ON')
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    assert read(pwmchip, 0, 'enable') == 1
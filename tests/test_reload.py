@@ -0,0 +1,39 @@
+import threading
+import time
+
+import pytest
+
+from pi_client import PiClient
+
+@pytest.fixture
+def reloadable(device, server, monkeypatch):
+    ''' address of a server whose device can be reloaded, yields the handler class '''
+    import pi_server
+    device.reload_handler = pi_server.reload_gpio
+    yield server, pi_server.PiGPIOHandler
+    new = pi_server.PiGPIOHandler.hGPIO
+    if new is not device:
+        new._sampler.stop()
+
+def test_reload_takes_over_the_state(reloadable, device, kernel):
+    address, handler = reloadable
+    with PiClient(*address) as client:
+        client.write('GPIO:SOUR:DIG:DATA5 1')
+        assert client.query('SYST:REL;ERR?') == '0,"No error"'
+        assert handler.hGPIO is not device
+        assert client.query('GPIO:SOUR:DIG:DATA5?') == '1'
+
+def test_reload_waits_for_running_pulses(reloadable, device, kernel):
+    address, handler = reloadable
+    with PiClient(*address) as pulser, PiClient(*address) as client:
+        thread = threading.Thread(target = pulser.write, args = ('GPIO:SOUR:DIG:PULS6 1,0.2',))
+        start = time.perf_counter()
+        thread.start()
+        time.sleep(0.05)
+        assert client.query('SYST:REL;ERR?') == '0,"No error"'
+        assert time.perf_counter()-start >= 0.2
+        thread.join()
+        assert kernel.levels[6] == 0
+        # the shadow state of the new instance matches the hardware
+        assert client.query('GPIO:SOUR:DIG:DATA6?') == '0'
+        assert handler.hGPIO._pin(6).val == 0
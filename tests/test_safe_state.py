@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from conftest import write_pin_map
+from scpi_base import SCPIBase
+
+@pytest.fixture
+def pin_map(tmp_path):
+    return write_pin_map(tmp_path/'pinmap.json', [{'gpio': 5, 'max_on': 0.05}, 6, 7])
+
+def run_in_thread(device, line):
+    ''' process line in a thread with its own session, returns the thread and the session '''
+    session = SCPIBase.Session()
+    thread = threading.Thread(target = device.process, args = (line, session))
+    thread.start()
+    return thread, session
+
+def test_watchdog_trip_ends_a_pulse(device, kernel):
+    device.process('GPIO:SOUR:DIG:DATA6 1')
+    thread, session = run_in_thread(device, 'GPIO:SOUR:DIG:PULS6 0,0.3')
+    time.sleep(0.02)
+    # exceeds its maximum on-time after 50ms
+    device.process('GPIO:SOUR:DIG:DATA5 1')
+    thread.join()
+    assert list(session.errors) == []
+    assert device.process('GPIO:WATC:REAS?') == ['"pin 5 exceeded its maximum on-time"']
+    assert (kernel.levels[5], kernel.levels[6]) == (0, 0)
+    assert device.process('GPIO:SOUR:DIG:DATA6?') == ['0']
+
+def test_safe_state_cancels_batch_pulses(device, kernel):
+    device.process('GPIO:SOUR:DIG:DATA6 1;DATA7 1')
+    start = time.perf_counter()
+    thread, session = run_in_thread(device, 'GPIO:SOUR:DIG:PULS:BATC 6,0,0.3,7,0,0.3')
+    time.sleep(0.05)
+    device.process('GPIO:SAFE')
+    thread.join()
+    assert time.perf_counter()-start < 0.2
+    time.sleep(0.3)
+    assert (kernel.levels[6], kernel.levels[7]) == (0, 0)
+
+def test_safe_state_discards_the_transactions_of_all_clients(device, kernel):
+    other = SCPIBase.Session()
+    device.process('SYST:TRAN:BEG', other)
+    device.process('GPIO:SOUR:DIG:DATA6 1', other)
+    device.process('GPIO:SAFE')
+    device.process('SYST:TRAN:COMM', other)
+    assert str(other.errors.popleft()).startswith('-200,')
+    assert kernel.levels.get(6, 0) == 0
+    # the next transaction of the client works again
+    device.process('SYST:TRAN:BEG;::GPIO:SOUR:DIG:DATA6 1;:::SYST:TRAN:COMM', other)
+    assert list(other.errors) == []
+    assert kernel.levels[6] == 1
@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+
+from conftest import write_pin_map
+from sampler import FrameWriter
+from scpi_base import SCPIBase
+
+@pytest.fixture
+def pin_map(tmp_path):
+    return write_pin_map(tmp_path/'pinmap.json', [{'gpio': 5, 'mode': 'IN'}, {'gpio': 35, 'mode': 'IN'}])
+
+@pytest.fixture
+def stall():
+    ''' event a stalled push waits for, set at the end of the test '''
+    stall = threading.Event()
+    yield stall
+    stall.set()
+
+def test_pins_from_32_upward_are_rejected(device):
+    device.process('GPIO:STReam:MASK %d'%(1<<35 | 1<<5))
+    assert device.process('SYST:ERR?') == ['-300,"Device-specific error;pins 32 and above can not be sampled."']
+    assert device.process('GPIO:STReam:MASK?') == ['0']
+    device.process('GPIO:STReam:MASK %d'%(1<<5))
+    assert device.process('SYST:ERR?;:GPIO:STReam:MASK?') == ['0,"No error"', '32']
+
+def test_stalled_writer_is_closed(stall):
+    writer = FrameWriter(lambda data: stall.wait(), depth = 2)
+    assert writer.send(b'frame')
+    # the writer takes the first frame and stalls, two more fit into the queue
+    time.sleep(0.05)
+    assert [writer.send(b'frame') for _ in range(3)] == [True, True, False]
+    assert writer.closed
+
+def test_stalled_subscriber_does_not_block_the_others(device, stall):
+    frames = []
+    stalled = SCPIBase.Session(connection = 'stalled', push = lambda data: stall.wait())
+    receiver = SCPIBase.Session(connection = 'receiver', push = frames.append)
+    device.process('GPIO:STReam ON', stalled)
+    device.process('GPIO:STReam ON', receiver)
+    device.process('GPIO:STReam:MASK 32;RATE 1000;STATe ON')
+    time.sleep(0.45)
+    device.process('GPIO:STReam:STATe OFF')
+    assert list(stalled.errors) == list(receiver.errors) == []
+    assert len(frames) >= 3
+    assert int(device.process('GPIO:STReam:COUNt?')[0]) > 300
@@ -0,0 +1,8 @@
+import os
+
+def test_slots_are_saved_in_the_state_folder(device):
+    device.process('GPIO:SOUR:DIG:DATA5 1;:::GPIO:STAT:SAVE 3')
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    assert os.path.exists(device.states_path)
+    device.process('GPIO:SOUR:DIG:DATA5 0;:::GPIO:STAT:REC 3')
+    assert device.process('GPIO:SOUR:DIG:DATA5?') == ['1']
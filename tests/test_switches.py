@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from conftest import write_pin_map
+from switch_group import SwitchGroup
+
+BBM = {'name': 'SW1', 'type': 'bbm', 'pins': [17, 18], 'positions': {'1': [1, 0], '2': [0, 1]}, 'dwell': 0.05}
+LATCHING = {'name': 'SW2', 'type': 'latching', 'pins': [22, 23], 'positions': {'1': [1, 0], '2': [0, 1]},
+            'reset': [1, 1], 'pulse': 0.01, 'dwell': 0.02}
+
+@pytest.fixture
+def pin_map(tmp_path):
+    return write_pin_map(tmp_path/'pinmap.json', switches = [BBM, LATCHING])
+
+def wait_settled(device, timeout = 2.):
+    end = time.perf_counter()+timeout
+    while device.process('STAT:OPER:COND?') != ['0']:
+        assert time.perf_counter() < end
+        time.sleep(0.005)
+
+def test_bbm_breaks_before_it_makes():
+    switch = SwitchGroup(**BBM)
+    assert switch.sequence(2, [True, False]) == [(0., {17: False}), (0.05, {17: False, 18: True}), (0.1, {})]
+    # nothing to break from an unknown position
+    assert switch.sequence(1, [False, False]) == [(0., {17: True, 18: False}), (0.05, {})]
+
+def test_latching_pulses_reset_then_position():
+    switch = SwitchGroup(**LATCHING)
+    off = {22: False, 23: False}
+    assert switch.sequence(2, [False, False]) == [(0., {22: True, 23: True}), (0.01, off), (0.03, {22: False, 23: True}),
+                                                (0.04, off), (0.06, {})]
+
+def test_bbm_move_waits_the_dwell_time(device, kernel):
+    device.process('GPIO:SWIT1:POS 1')
+    wait_settled(device)
+    del kernel.writes[:]
+    device.process('GPIO:SWIT1:POS 2')
+    assert device.process('STAT:OPER:COND?') == ['2']
+    assert device.process('GPIO:SWIT1:BUSY?') == ['1']
+    wait_settled(device)
+    assert device.process('GPIO:SWIT1:POS?;BUSY?') == ['2', '0']
+    assert [levels for _, levels in kernel.writes] == [{17: 0}, {17: 0, 18: 1}]
+    assert kernel.writes[1][0]-kernel.writes[0][0] >= 0.05-1e-3
+
+def test_latching_coils_are_off_after_a_move(device, kernel):
+    device.process('GPIO:SWIT2:POS 1')
+    wait_settled(device)
+    assert device.process('GPIO:SWIT2:POS?') == ['1']
+    assert (kernel.levels[22], kernel.levels[23]) == (0, 0)
+    assert [levels for _, levels in kernel.writes][-2:] == [{22: 1, 23: 0}, {22: 0, 23: 0}]
+
+def test_a_new_move_cancels_the_running_one(device, kernel):
+    device.process('GPIO:SWIT1:POS 1')
+    device.process('GPIO:SWIT1:POS 2')
+    wait_settled(device)
+    assert device.process('GPIO:SWIT1:POS?') == ['2']
+    assert (kernel.levels[17], kernel.levels[18]) == (0, 1)
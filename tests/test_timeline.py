@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from conftest import write_pin_map
+from pulse_scheduler import EdgeScheduler
+
+@pytest.fixture
+def pin_map(tmp_path):
+    switches = [{'name': 'SW%d'%idx, 'pins': pins, 'positions': {'1': [1, 0], '2': [0, 1]}, 'dwell': 0.05}
+                for idx, pins in ((1, [17, 18]), (2, [22, 23]))]
+    return write_pin_map(tmp_path/'pinmap.json', switches = switches)
+
+def test_coincident_edges_are_written_together():
+    writes = []
+    scheduler = EdgeScheduler(writes.append)
+    try:
+        scheduler.run([[(0., {1: 1}), (0.02, {1: 0})], [(0., {2: 1}), (0.02, {2: 0}), (0.04, {2: 1})]])
+    finally:
+        scheduler.stop()
+    assert writes == [{1: 1, 2: 1}, {1: 0, 2: 0}, {2: 1}]
+
+def test_cancelled_jobs_write_nothing_more():
+    writes = []
+    scheduler = EdgeScheduler(writes.append)
+    try:
+        job = scheduler.submit([(0., {1: 1}), (0.05, {1: 0})])
+        time.sleep(0.01)
+        scheduler.cancel(job)
+        assert job.finished.is_set()
+        time.sleep(0.06)
+    finally:
+        scheduler.stop()
+    assert writes == [{1: 1}]
+
+def test_batch_pulses_run_in_parallel(device, kernel):
+    start = time.perf_counter()
+    device.process('GPIO:SOUR:DIG:PULS:BATC 5,1,0.05,6,1,0.1')
+    elapsed = time.perf_counter()-start
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    assert 0.1 <= elapsed < 0.14
+    assert [levels for _, levels in kernel.writes] == [{5: 1, 6: 1}, {5: 0}, {6: 0}]
+
+def test_switches_move_on_a_common_timeline(device, kernel):
+    device.process('GPIO:SWIT:APPL 1,1,2,1')
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    end = time.perf_counter()+1.
+    while device.process('STAT:OPER:COND?') != ['0']:
+        assert time.perf_counter() < end
+        time.sleep(0.005)
+    assert [levels for _, levels in kernel.writes] == [{17: 1, 18: 0, 22: 1, 23: 0}]
+    assert device.process('GPIO:SWIT1:POS?') == ['1']
+    assert device.process('GPIO:SWIT2:POS?') == ['1']
@@ -0,0 +1,56 @@
+import json
+import threading
+
+import pytest
+
+import tracing
+from tracing import Tracer
+
+@pytest.fixture
+def tracer():
+    ''' the shared tracer, switched off and emptied afterwards '''
+    yield tracing.tracer
+    tracing.tracer.enabled = False
+    tracing.tracer.clear()
+
+def block_unpack(reply):
+    digits = int(reply[1])
+    return reply[2+digits:2+digits+int(reply[2:2+digits])]
+
+def test_spans_are_only_recorded_while_enabled():
+    spans = Tracer(capacity = 4)
+    with spans.span('off'):
+        pass
+    assert spans.events()[-1]['ph'] == 'M'
+    spans.enabled = True
+    with spans.span('on', 'io', pin = 5):
+        pass
+    event = spans.events()[-1]
+    assert (event['name'], event['cat'], event['ph'], event['args']) == ('on', 'io', 'X', {'pin': '5'})
+    assert event['dur'] >= 0
+
+def test_the_ring_keeps_the_latest_spans():
+    spans = Tracer(capacity = 4)
+    for idx in range(10):
+        spans.record('span%d'%idx, 'scpi', idx, idx+1)
+    names = [event['name'] for event in spans.events() if event['ph'] == 'X']
+    assert names == ['span6', 'span7', 'span8', 'span9']
+
+def test_dump_writes_chrome_trace_json(tmp_path):
+    spans = Tracer()
+    spans.record('span', 'scpi', 1000, 3000)
+    with open(spans.dump(str(tmp_path/'trace.json'))) as f:
+        trace = json.load(f)
+    names = dict((event['tid'], event['args']['name']) for event in trace['traceEvents'] if event['ph'] == 'M')
+    assert names[threading.get_ident()] == threading.current_thread().name
+    assert [(event['ts'], event['dur']) for event in trace['traceEvents'] if event['ph'] == 'X'] == [(1., 2.)]
+
+def test_commands_are_traced(device, tracer):
+    device.process('SYST:TRAC:STAT ON')
+    device.process('GPIO:SOUR:DIG:DATA5 1')
+    trace = json.loads(block_unpack(device.process('SYST:TRAC:DUMP?')[0]))
+    names = set(event['name'] for event in trace['traceEvents'])
+    assert {'parse', 'lookup', 'execute', 'GPIO.output'} <= names
+    device.process('SYST:TRAC:STAT OFF;CLE')
+    trace = json.loads(block_unpack(device.process('SYST:TRAC:DUMP?')[0]))
+    assert [event for event in trace['traceEvents'] if event['ph'] == 'X'] == []
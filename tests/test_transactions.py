@@ -0,0 +1,29 @@
+def test_transaction_commits_staged_pins_at_once(device, kernel):
+    device.process('GPIO:SOUR:DIG:DATA2 0;DATA3 0')
+    calls = kernel.set_values_calls
+    device.process('SYST:TRAN:BEG')
+    device.process('GPIO:SOUR:DIG:DATA2 1;DATA3 1')
+    assert device.process('GPIO:SOUR:DIG:DATA2?') == ['0']
+    device.process('SYST:TRAN:COMM')
+    assert device.process('SYST:ERR?') == ['0,"No error"']
+    assert (kernel.levels[2], kernel.levels[3]) == (1, 1)
+    assert kernel.set_values_calls == calls+1
+
+def test_reset_and_safe_state_work_in_a_transaction(device, kernel):
+    device.process('SYST:TRAN:BEG')
+    device.process('GPIO:SOUR:DIG:DATA2 1')
+    device.process('SYST:COMM:PRI HIGH')
+    device.process('*RST')
+    assert device.process('SYST:ERR?;TRAN:STAT?') == ['0,"No error"', '0']
+    device.process('GPIO:SOUR:DIG:DATA2 1')
+    device.process('SYST:TRAN:BEG')
+    device.process('GPIO:SOUR:DIG:DATA3 1')
+    device.process('GPIO:SAFE')
+    assert device.process('SYST:ERR?;TRAN:STAT?') == ['0,"No error"', '0']
+    assert device.process('SYST:COMM:PRI?') == ['HIGH']
+    assert (kernel.levels[2], kernel.levels[3]) == (0, 0)
+
+def test_other_setters_are_rejected_in_a_transaction(device):
+    device.process('SYST:TRAN:BEG')
+    device.process('GPIO:SOUR:DIG:IO5 IN')
+    assert device.process('SYST:ERR?')[0].startswith('-221,')
@@ -0,0 +1,71 @@
+import socket
+import threading
+import time
+from socketserver import ThreadingUnixStreamServer
+
+import pytest
+
+import shm_mailbox
+from shm_mailbox import ShmGPIO, ShmMailbox
+
+@pytest.fixture
+def mailbox(device, tmp_path):
+    mailbox = ShmMailbox(str(tmp_path/'mailbox'), device)
+    yield mailbox
+    mailbox.close()
+
+def test_mailbox_round_trip(mailbox, kernel):
+    with ShmGPIO(mailbox.path) as gpio:
+        for idx in range(3*mailbox.slots):
+            gpio.write_pins({5: idx%2, 6: 1})
+            assert (kernel.levels[5], kernel.levels[6]) == (idx%2, 1)
+        kernel.levels[7] = 1
+        assert gpio.read_pins([5, 6, 7]) == [1, 1, 1]
+        with pytest.raises(ValueError):
+            gpio.read_port(1<<40)
+
+def test_unserved_mailbox_times_out_without_spinning(device, tmp_path):
+    path = str(tmp_path/'mailbox')
+    ShmMailbox(path, device).close()
+    with ShmGPIO(path, timeout = 0.2) as gpio:
+        start = time.thread_time()
+        with pytest.raises(TimeoutError):
+            gpio.read_port(1<<5)
+        assert time.thread_time()-start < 0.05
+
+def test_reused_slot_is_detected(device, tmp_path):
+    path = str(tmp_path/'mailbox')
+    ShmMailbox(path, device, slots = 1).close()
+    with ShmGPIO(path, timeout = 1.) as gpio, ShmGPIO(path) as other:
+        errors = []
+        def request():
+            try:
+                gpio.read_port(1<<5)
+            except Exception as err:
+                errors.append(err)
+        thread = threading.Thread(target = request)
+        thread.start()
+        time.sleep(0.02)
+        # a newer request of another client takes over the only slot
+        offset = shm_mailbox.HEADER.size
+        shm_mailbox.SLOT.pack_into(other._map, offset, 2, shm_mailbox.OP_READ, 0, 1<<6, 0, 0)
+        thread.join()
+    assert [type(err) for err in errors] == [ConnectionError]
+
+def test_unix_socket_round_trip(server, tmp_path):
+    import pi_server
+    path = str(tmp_path/'gpio.sock')
+    unix_server = ThreadingUnixStreamServer(path, pi_server.PiGPIOHandler)
+    unix_server.daemon_threads = True
+    threading.Thread(target = unix_server.serve_forever, daemon = True).start()
+    try:
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(path)
+            reader = sock.makefile('rb')
+            sock.sendall(b'GPIO:SOUR:DIG:DATA5 1;DATA5?\n*IDN?\n')
+            assert reader.readline() == b'1\n'
+            assert reader.readline().startswith(b'SQDLab')
+            reader.close()
+    finally:
+        unix_server.shutdown()
+        unix_server.server_close()
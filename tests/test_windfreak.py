@@ -0,0 +1,83 @@
+import re
+
+import pytest
+
+pytest.importorskip('serial')
+import RPi_windfreak_interface as windfreak
+
+class FakeWindfreak(object):
+    ''' serial port of a two channel Windfreak answering C and f commands '''
+    def __init__(self):
+        self.channel = '0'
+        self.frequency = {'0': '1000.0', '1': '2000.0'}
+        self.replies = []
+        self.queries = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.replies)
+
+    def write(self, data):
+        for parameter, value in re.findall(r"([A-Za-z])([^A-Za-z]*)", data.decode()):
+            if value == '?':
+                self.queries += 1
+                self.replies.append(self.channel if parameter == 'C' else self.frequency[self.channel])
+            elif parameter == 'C':
+                self.channel = value
+            elif parameter == 'f':
+                self.frequency[self.channel] = value
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        return (self.replies.pop(0)+'\n').encode()
+
+class FakeDevice(windfreak.Device):
+    def setup_serial(self, com):
+        return FakeWindfreak()
+
+def test_channel_selected_by_a_query_is_followed():
+    device = FakeDevice(None, verbose = False)
+    assert device.read_command('C1f?') == '2000.0'
+    assert device.read_command('f?') == '2000.0'
+    assert device.read_command('C0f?') == '1000.0'
+    assert device.read_command('f?') == '1000.0'
+    queries = device._ser.queries
+    assert device.read_command('f?') == '1000.0'
+    assert device._ser.queries == queries
+
+@pytest.mark.parametrize('command,reply', [
+    ('LOAD 100,0,0.01;abc', 'Invalid sweep point: abc'),
+    ('LOAD 100,0', 'Invalid sweep point: 100,0'),
+    ('START x', 'Invalid SWEEP arguments'),
+    ('START 1,2,3', 'Invalid SWEEP arguments'),
+])
+def test_invalid_sweep_arguments_are_answered(command, reply):
+    device = FakeDevice(None, verbose = False)
+    assert device.handle_command('SWEEP', 'LOAD 100,-5,0.01') == 1
+    assert device.handle_command('SWEEP', command) == reply
+    # a rejected list keeps the loaded one
+    assert device.handle_command('SWEEP', 'STATUS') == '0,0,1,0'
+
+def test_sweep_steps_through_the_list():
+    device = FakeDevice(None, verbose = False)
+    assert device.handle_command('SWEEP', 'LOAD 100,-5,0.01;200,-5,0.01 300,0,0.01') == 3
+    assert device.handle_command('SWEEP', 'START 2') == 3
+    device.sweep._thread.join(5.)
+    assert device.handle_command('SWEEP', 'STATUS') == '0,2,3,2'
+    assert device._ser.frequency['0'] == '300.0000000'
+
+def test_cache_clear_returns_the_removed_entries():
+    device = FakeDevice(None, verbose = False)
+    device.write_command('C1')
+    device.read_command('f?')
+    device.write_command('C0')
+    device.read_command('f?')
+    assert device.handle_command('CACHE', 'CLEAR') == 2
+    assert device.handle_command('CACHE', 'CLEAR') == 0
+    queries = device._ser.queries
+    assert device.read_command('f?') == '1000.0'
+    assert device._ser.queries == queries+1
+    assert device.handle_command('CACHE', 'TTL x') == 'Invalid CACHE arguments'